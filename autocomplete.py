@@ -0,0 +1,90 @@
+# autocomplete.py
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+AUTOCOMPLETE_TTL_SECONDS = 30.0
+AUTOCOMPLETE_MAX_ENTRIES = 1024
+
+
+@dataclass
+class CachedQuery:
+    prefix: str
+    matches: List[Dict[str, Any]]
+    expires_at: float
+
+    @property
+    def ids(self) -> List[int]:
+        return [row["id"] for row in self.matches]
+
+
+class AutocompleteCache:
+    """
+    Per-user cache of autocomplete results keyed by the typed prefix.
+
+    `get` returns the entry for the longest cached prefix of the current text.
+    An exact hit can be answered directly; a shorter prefix's matches are
+    rescored along with the current text's own candidates, so extending the
+    query does not rescan the whole corpus.
+    Entries expire after `ttl` seconds; the least recently used entry is evicted
+    once `max_entries` is reached.
+    """
+
+    def __init__(
+        self,
+        ttl: float = AUTOCOMPLETE_TTL_SECONDS,
+        max_entries: int = AUTOCOMPLETE_MAX_ENTRIES,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: "OrderedDict[Tuple[Hashable, str], CachedQuery]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, text: str) -> Optional[CachedQuery]:
+        now = self._clock()
+        for end in range(len(text), -1, -1):
+            cache_key = (key, text[:end])
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                continue
+            if entry.expires_at <= now:
+                del self._entries[cache_key]
+                continue
+            self._entries.move_to_end(cache_key)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        return None
+
+    def put(self, key: Hashable, text: str, matches: List[Dict[str, Any]]) -> None:
+        cache_key = (key, text)
+        self._entries[cache_key] = CachedQuery(
+            prefix=text,
+            matches=matches,
+            expires_at=self._clock() + self.ttl,
+        )
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+        }
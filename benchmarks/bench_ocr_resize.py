@@ -0,0 +1,97 @@
+# benchmarks/bench_ocr_resize.py
+"""
+Compare OCR latency and accuracy across resize policies.
+
+Usage:
+    python benchmarks/bench_ocr_resize.py SAMPLE_DIR [--upscale-below N] [--max-side N] [--max-pixels N]
+
+SAMPLE_DIR holds images plus a ground-truth text file per image, named
+`<image>.gt.txt` (or a `<image>.txt` OCR sidecar, as older versions of the bot wrote).
+Accuracy is rapidfuzz `ratio` between OCR output and ground truth (0-100).
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import cv2
+from rapidfuzz import fuzz
+
+import ocr
+
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+
+
+def load_samples(sample_dir: str):
+    samples = []
+    for name in sorted(os.listdir(sample_dir)):
+        if not name.lower().endswith(IMAGE_EXTS):
+            continue
+        path = os.path.join(sample_dir, name)
+        for truth_path in (path + ".gt.txt", path + ".txt"):
+            if os.path.exists(truth_path):
+                with open(truth_path, encoding="utf-8") as f:
+                    samples.append((path, f.read().strip()))
+                break
+    return samples
+
+
+def run_policy(samples, policy: ocr.ResizePolicy):
+    latencies, accuracies, pixels = [], [], []
+    for path, truth in samples:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            continue
+
+        started = time.perf_counter()
+        prepared = ocr.resize_for_ocr(img, policy)
+        text = " ".join(ocr.extract_lines(prepared)).strip()
+        latencies.append(time.perf_counter() - started)
+
+        accuracies.append(fuzz.ratio(text, truth))
+        pixels.append(prepared.shape[0] * prepared.shape[1])
+    return latencies, accuracies, pixels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sample_dir")
+    defaults = ocr.ResizePolicy()
+    parser.add_argument("--upscale-below", type=int, default=defaults.upscale_below)
+    parser.add_argument("--max-side", type=int, default=defaults.max_side)
+    parser.add_argument("--max-pixels", type=int, default=defaults.max_pixels)
+    args = parser.parse_args()
+
+    samples = load_samples(args.sample_dir)
+    if not samples:
+        sys.exit(f"No images with ground truth found in {args.sample_dir}")
+
+    policies = {
+        "fixed-2x": ocr.FIXED_2X_POLICY,
+        "adaptive": ocr.ResizePolicy(
+            upscale_below=args.upscale_below,
+            max_side=args.max_side,
+            max_pixels=args.max_pixels,
+        ),
+    }
+
+    # Load the model before timing anything.
+    ocr.get_reader()
+
+    print(f"{len(samples)} samples")
+    print(f"{'policy':<10} {'mean s':>8} {'p95 s':>8} {'total s':>8} {'accuracy':>9} {'mean Mpx':>9}")
+    for name, policy in policies.items():
+        latencies, accuracies, pixels = run_policy(samples, policy)
+        p95 = sorted(latencies)[int(0.95 * (len(latencies) - 1))]
+        print(
+            f"{name:<10} {statistics.mean(latencies):>8.3f} {p95:>8.3f} {sum(latencies):>8.2f} "
+            f"{statistics.mean(accuracies):>9.1f} {statistics.mean(pixels) / 1e6:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
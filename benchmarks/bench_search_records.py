@@ -0,0 +1,126 @@
+# benchmarks/bench_search_records.py
+"""
+Memory and allocations of the search path: dict rows vs. slotted records and
+the id/text-only search index.
+
+Usage:
+    python benchmarks/bench_search_records.py [--rows N] [--queries N]
+
+Builds a throwaway SQLite database of N synthetic images, then reports:
+- resident size of the search corpus: every row as a dict (the old index)
+  vs. ids + texts only (SearchIndex)
+- full-table fetch: per-row dicts (the old _row_to_dict) vs. ImageRecord
+- per-query peak allocation and latency: fetching the table as dicts and
+  scoring it (the original per-search path) vs. SearchIndex with lazy rows
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import search
+from storage import fetch_all_images, init_db
+
+
+WORDS = "cat dog sofa garden meme reaction cursed wholesome anime frog pepe doge wow much screenshot chat".split()
+
+
+def build_db(path: str, rows: int) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    init_db(conn)
+    rng = random.Random(0)
+    conn.executemany(
+        """
+        INSERT INTO images (uploader_id, channel_id, message_id, file_path, image_hash, user_text, ocr_text, index_text)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (
+                "123456789012345678", "234567890123456789", str(i),
+                f"data/images/{i}_upload.png", f"{rng.getrandbits(64):016x}",
+                None, text, text,
+            )
+            for i, text in ((i, " ".join(rng.choices(WORDS, k=rng.randint(3, 12)))) for i in range(rows))
+        ],
+    )
+    conn.commit()
+    return conn
+
+
+def dict_rows(conn):
+    """The old fetch: SELECT * and a dict per row, column names rebuilt per row."""
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM images")
+    rows = cur.fetchall()
+    return [{col: r[i] for i, col in enumerate([d[0] for d in cur.description])} for r in rows]
+
+
+def measure(fn):
+    """(result, retained bytes, peak bytes, seconds) of one call."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, retained, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = build_db(os.path.join(tmp, "bench.db"), args.rows)
+        mb = 1024 * 1024
+
+        print(f"{args.rows} rows\n")
+        print(f"{'resident corpus':<28} {'MiB':>8} {'load s':>8}")
+        rows, dict_bytes, _, dict_s = measure(lambda: dict_rows(conn))
+        print(f"{'dict per row':<28} {dict_bytes / mb:>8.1f} {dict_s:>8.3f}")
+        del rows
+        index, index_bytes, _, index_s = measure(lambda: search.SearchIndex.load(conn))
+        print(f"{'ids + texts (SearchIndex)':<28} {index_bytes / mb:>8.1f} {index_s:>8.3f}")
+
+        print(f"\n{'full-table fetch':<28} {'MiB':>8} {'s':>8}")
+        rows, b, _, s = measure(lambda: dict_rows(conn))
+        print(f"{'dict per row':<28} {b / mb:>8.1f} {s:>8.3f}")
+        del rows
+        rows, b, _, s = measure(lambda: fetch_all_images(conn))
+        print(f"{'ImageRecord':<28} {b / mb:>8.1f} {s:>8.3f}")
+        del rows
+
+        rng = random.Random(1)
+        queries = [" ".join(rng.choices(WORDS, k=3)) for _ in range(args.queries)]
+
+        def per_query(fn):
+            peaks, times = [], []
+            for q in queries:
+                _, _, peak, elapsed = measure(lambda: fn(q))
+                peaks.append(peak)
+                times.append(elapsed)
+            return statistics.mean(peaks) / mb, statistics.mean(times) * 1000
+
+        def scan_query(q):
+            rows = dict_rows(conn)
+            scores = search.score_texts(q, [r["index_text"] for r in rows])
+            return [rows[p] for p in search.top_k(scores, 10)]
+
+        print(f"\n{'per query (limit=10)':<28} {'peak MiB':>8} {'ms':>8}")
+        peak, ms = per_query(scan_query)
+        print(f"{'dict rows, full scan':<28} {peak:>8.2f} {ms:>8.1f}")
+        peak, ms = per_query(lambda q: index.search(q, limit=10))
+        print(f"{'SearchIndex + lazy rows':<28} {peak:>8.2f} {ms:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,32 @@
 # bot.py
 
+import asyncio
+from dataclasses import dataclass
+
 import discord
-from search import search_best_match
-from storage import save_image_record, get_random_image, get_image_by_hash
-from ocr import extract_text
+from search import get_search_index, search_best_match
+from autocomplete import AutocompleteCache
+from db import transaction
+from delivery import send_image, respond_with_image
+from derivatives import ensure_derivative_async, get_derivative_policy
+from image_store import ImageStore
+from hash_index import find_near_duplicate, find_similar, hash_bands
+from storage import (
+    save_image_record,
+    save_hash_bands,
+    get_random_image,
+    get_image_by_hash,
+    get_image_by_id,
+    get_images_by_ids,
+)
+from ocr import extract_text, decode_image
+from shuffle_bag import draw_shuffled_image
+from write_queue import call_write
 from PIL import Image
+import cv2
 import imagehash
 import os
+import sqlite3
 
 
 
@@ -38,41 +58,290 @@ def compute_image_hash(path: str) -> str:
     except Exception:
         # Test-safe fallback
         return "invalid_image_hash"
+
+
+def compute_array_hash(img) -> str:
+    """
+    Perceptual hash of an already-decoded BGR array (see ocr.decode_image).
+    Same fallback as compute_image_hash when decoding failed.
+    """
+    if img is None:
+        return "invalid_image_hash"
+    try:
+        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        return str(imagehash.phash(Image.fromarray(rgb)))
+    except Exception:
+        return "invalid_image_hash"
+
+
+def compute_array_hashes(img) -> dict:
+    """
+    phash, dhash and whash of a decoded BGR array, all from the same PIL image.
+    phash keeps the "invalid_image_hash" fallback; the others are None on failure.
+    """
+    hashes = {"phash": compute_array_hash(img), "dhash": None, "whash": None}
+    if img is None:
+        return hashes
+    try:
+        pil = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+        hashes["dhash"] = str(imagehash.dhash(pil))
+        hashes["whash"] = str(imagehash.whash(pil))
+    except Exception as e:
+        print(f"[WARN] Could not compute dhash/whash: {e}")
+    return hashes
+
+
+def decode_and_hash(data: bytes):
+    """Decode attachment bytes once; returns (bgr_array_or_None, hashes dict)."""
+    img = decode_image(data)
+    return img, compute_array_hashes(img)
+
+
 # ----------------------------
 # Image indexing pipeline
 # ----------------------------
+def find_duplicate(conn, img_hash: str):
+    """
+    Existing row for an exact hash match, else for the closest phash within
+    the configured Hamming distance (hash_index.set_duplicate_distance).
+    """
+    existing = get_image_by_hash(conn, img_hash)
+    if existing:
+        return existing
+    near_id = find_near_duplicate(conn, img_hash)
+    if near_id is None:
+        return None
+    return get_image_by_id(conn, near_id)
+
+
+def _write_image_file(image_path: str, data: bytes) -> None:
+    with open(image_path, "wb") as f:
+        f.write(data)
+
+
+def _discard_duplicate(image_path: str) -> None:
+    try:
+        os.remove(image_path)
+    except FileNotFoundError:
+        pass
+
+
+def _store_indexed_image(
+    conn,
+    message,
+    image_path: str,
+    hashes: dict,
+    ocr_text: str | None,
+    attachment=None,
+) -> int:
+    """
+    Store DB record and its hash bands in one transaction (a savepoint when run
+    inside a WriteQueue batch). Returns the new id, or -existing_id if
+    another upload of the same hash won the race since the dedup check.
+    `hashes` holds "phash" and optionally "dhash"/"whash"; `attachment` is the
+    Discord attachment the image came from, whose URL later sends can reuse.
+    """
+    img_hash = hashes["phash"]
+    user_text = message.content.strip() or None
+    attachment_id = getattr(attachment, "id", None)
+    with transaction(conn):
+        try:
+            img_id = save_image_record(
+                conn,
+                uploader_id=str(message.author.id),
+                channel_id=str(message.channel.id),
+                message_id=str(message.id),
+                file_path=image_path,
+                user_text=user_text,
+                ocr_text=ocr_text,
+                image_hash=img_hash,
+                dhash=hashes.get("dhash"),
+                whash=hashes.get("whash"),
+                attachment_id=str(attachment_id) if attachment_id is not None else None,
+                attachment_url=getattr(attachment, "url", None),
+            )
+        except sqlite3.IntegrityError:
+            # Only the insert's savepoint was rolled back.
+            existing = get_image_by_hash(conn, img_hash)
+            if existing is None:
+                raise
+            return -existing["id"]
+
+        bands = hash_bands(hashes)
+        if bands:
+            save_hash_bands(conn, img_id, bands)
+    return img_id
+
+
+def find_similar_images(conn, hashes: dict, limit: int = 10) -> list:
+    """(mean Hamming distance, row) of the indexed images that look most like `hashes`, closest first."""
+    found = find_similar(conn, hashes, limit=limit)
+    distances = {image_id: distance for distance, image_id in found}
+    rows = get_images_by_ids(conn, [image_id for _, image_id in found])
+    return [(distances[row["id"]], row) for row in rows]
+
+
+def format_select_option(row, distance: float | None = None) -> tuple[str, str | None]:
+    """Label and description of `row` in an image dropdown; `distance` is set for similarity results."""
+    label = row["index_text"][:50] or f"#{row['id']} (no text)"
+    if distance is None:
+        return label, None
+    return label, f"#{row['id']} · Hamming distance {distance:.1f}"
+
+
 def index_image_from_message(conn, message, image_path: str) -> int:
     # 1. Compute hash
     img_hash = compute_image_hash(image_path)
 
-    # 2. Dedup check
-    existing = get_image_by_hash(conn, img_hash)
+    # 2. Dedup check (exact, then near-duplicate)
+    existing = find_duplicate(conn, img_hash)
     if existing:
-        os.remove(image_path)
+        _discard_duplicate(image_path)
         return -existing["id"]
 
-    user_text = message.content.strip() or None
     ocr_text = extract_text(image_path) or None
 
-    # Write OCR result to a .txt file
-    txt_path = image_path + ".txt"
-    try:
-        with open(txt_path, "w", encoding="utf-8") as f:
-            f.write(ocr_text or "")
-    except Exception as e:
-        print(f"[WARN] Could not write OCR file {txt_path}: {e}")
-
-    # Store DB record
-    return save_image_record(
-        conn,
-        uploader_id=str(message.author.id),
-        channel_id=str(message.channel.id),
-        message_id=str(message.id),
-        file_path=image_path,
-        user_text=user_text,
-        ocr_text=ocr_text,
-        image_hash=img_hash,
+    img_id = _store_indexed_image(conn, message, image_path, {"phash": img_hash}, ocr_text)
+    if img_id < 0:
+        _discard_duplicate(image_path)
+    return img_id
+
+
+async def index_attachment_async(
+    executors,
+    conn,
+    message,
+    data: bytes,
+    image_path: str,
+    ocr_service=None,
+    attachment=None,
+    writes=None,
+    store: ImageStore | None = None,
+) -> int:
+    """
+    Index one attachment from its downloaded bytes.
+
+    The bytes are decoded once; that array feeds both the phash and
+    in-process OCR (`ocr_service` workers are sent the bytes instead).
+    The file is written to `image_path` (a path inside `store` when given)
+    only once the image is known not to be a duplicate. Blocking steps run on `executors` (decode/hash/OCR on the
+    cpu pool, SQLite on the db pool); OCR goes to `ocr_service` when given,
+    and the insert is batched through the `writes` WriteQueue when given.
+    Images over the send budget get their send derivative encoded right away.
+    Returns the new id, or -existing_id for a duplicate.
+    """
+    img, hashes = await executors.run_cpu(decode_and_hash, data)
+
+    existing = await executors.run_db(find_duplicate, conn, hashes["phash"])
+    if existing:
+        return -existing["id"]
+
+    if store is not None:
+        await executors.run_io(store.write, image_path, data)
+    else:
+        await executors.run_io(_write_image_file, image_path, data)
+
+    if img is None:
+        ocr_text = None
+    elif ocr_service is not None:
+        # The worker process decodes its own copy from the (much smaller) bytes.
+        ocr_text = await ocr_service.extract_text(data) or None
+    else:
+        ocr_text = await executors.run_cpu(extract_text, img) or None
+
+    img_id = await call_write(
+        writes, executors, _store_indexed_image, conn, message, image_path, hashes, ocr_text, attachment
     )
+    if img_id > 0 and len(data) > get_derivative_policy().max_bytes:
+        # Encode the send derivative now rather than while a user waits on a send.
+        source = store.resolve(image_path) if store is not None else image_path
+        await ensure_derivative_async(
+            executors, conn, {"id": img_id, "file_path": image_path}, source, writes=writes
+        )
+    if img_id < 0:
+        # Identical bytes share one content-addressed file: keep it if the winner uses it.
+        existing = await executors.run_db(get_image_by_id, conn, -img_id)
+        if existing is None or existing["file_path"] != image_path:
+            if store is not None:
+                await executors.run_io(store.remove, image_path)
+            else:
+                await executors.run_io(_discard_duplicate, image_path)
+    return img_id
+
+
+@dataclass
+class IngestResult:
+    """Outcome of indexing one attachment of a message."""
+    filename: str
+    image_id: int | None = None
+    duplicate: bool = False
+    ocr_text: str | None = None
+    error: str | None = None
+
+
+OCR_PREVIEW_CHARS = 80
+
+
+async def index_attachments_async(
+    executors,
+    conn,
+    message,
+    attachments,
+    image_store: ImageStore | str,
+    *,
+    ocr_service=None,
+    concurrency: int = 4,
+    writes=None,
+) -> list[IngestResult]:
+    """
+    Download and index every attachment concurrently (at most `concurrency`
+    at a time) into `image_store` (an ImageStore, or its root folder).
+    Results are returned in attachment order; a failure in one attachment is
+    reported in its result and does not affect the others.
+    """
+    store = image_store if isinstance(image_store, ImageStore) else ImageStore(image_store)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _one(attachment) -> IngestResult:
+        result = IngestResult(filename=attachment.filename)
+        async with semaphore:
+            try:
+                data = await attachment.read()
+                image_path = await executors.run_cpu(store.path_for, data, attachment.filename)
+                img_id = await index_attachment_async(
+                    executors, conn, message, data, image_path,
+                    ocr_service=ocr_service, attachment=attachment, writes=writes, store=store,
+                )
+                if img_id < 0:
+                    result.image_id = -img_id
+                    result.duplicate = True
+                else:
+                    result.image_id = img_id
+                    row = await executors.run_db(get_image_by_id, conn, img_id)
+                    result.ocr_text = row.get("ocr_text") if row else None
+            except Exception as e:
+                print(f"[WARN] Failed to index {attachment.filename}: {e}")
+                result.error = str(e) or type(e).__name__
+        return result
+
+    return list(await asyncio.gather(*(_one(a) for a in attachments)))
+
+
+def format_ingest_summary(results: list[IngestResult]) -> str:
+    """One reply covering every attachment of a message."""
+    indexed = sum(1 for r in results if r.image_id and not r.duplicate)
+    lines = [f"Indexed {indexed} of {len(results)} image(s):"]
+    for r in results:
+        if r.error:
+            lines.append(f"- {r.filename}: failed ({r.error})")
+        elif r.duplicate:
+            lines.append(f"- #{r.image_id} {r.filename}: ⚠️ duplicate, already indexed")
+        else:
+            preview = r.ocr_text or "(none)"
+            if len(preview) > OCR_PREVIEW_CHARS:
+                preview = preview[:OCR_PREVIEW_CHARS] + "…"
+            lines.append(f"- #{r.image_id} {r.filename}: OCR: {preview}")
+    return "\n".join(lines)
 
 
 # ----------------------------
@@ -87,7 +356,7 @@ async def handle_text_query(conn, message):
         return
 
     row = matches[0]
-    await message.channel.send(file=discord.File(row["file_path"]))
+    await send_image(message.channel, conn, row)
 
 
 # ----------------------------
@@ -103,18 +372,44 @@ async def run_img_command(interaction, conn, query: str):
         return
 
     row = matches[0]
-    await interaction.response.send_message(
-        file=discord.File(row["file_path"]),
-        ephemeral=False
-    )
+    await respond_with_image(interaction, conn, row, ephemeral=False)
 
 
 # ----------------------------
 # Autocomplete handler
 # ----------------------------
+AUTOCOMPLETE_CHOICES = 5
+AUTOCOMPLETE_CANDIDATES = 50  # superset kept per prefix for narrowing
+
+autocomplete_cache = AutocompleteCache()
+
+
 async def run_img_autocomplete(interaction, conn, current: str):
     """Autocomplete handler for /img."""
-    matches = search_best_match(conn, current, limit=5)
+    user = getattr(interaction, "user", None)
+    cache_key = getattr(user, "id", None)
+
+    # No user to key a session on: don't share one cache entry between everyone.
+    cached = autocomplete_cache.get(cache_key, current) if cache_key is not None else None
+    if cached is not None and cached.prefix == current:
+        candidates = cached.matches
+    else:
+        fresh_ids = get_search_index(conn).candidate_ids(current) if cached is not None else None
+        if fresh_ids is not None:
+            # The score is not monotone as the prefix grows (rows below the
+            # cutoff for "ca" can pass it for "cat"), and images may have been
+            # indexed since: rescore the prefix's matches together with the
+            # candidates of the current text itself.
+            candidates = search_best_match(
+                conn, current, limit=AUTOCOMPLETE_CANDIDATES,
+                candidate_ids=list(dict.fromkeys(cached.ids + fresh_ids)),
+            )
+        else:
+            candidates = search_best_match(conn, current, limit=AUTOCOMPLETE_CANDIDATES)
+
+    if cache_key is not None:
+        autocomplete_cache.put(cache_key, current, candidates)
+    matches = candidates[:AUTOCOMPLETE_CHOICES]
 
     # Discord requires list of Choice objects
     choices = [
@@ -128,15 +423,15 @@ async def run_img_autocomplete(interaction, conn, current: str):
     await interaction.response.send_autocomplete(choices)
 
 
-async def run_random_command(interaction, conn):
-    """Slash command handler for /random."""
-    row = get_random_image(conn)
+async def run_random_command(interaction, conn, shuffle: bool = False):
+    """Slash command handler for /random (no repeats per channel with `shuffle`)."""
+    if shuffle:
+        row = draw_shuffled_image(conn, str(interaction.channel_id))
+    else:
+        row = get_random_image(conn)
 
     if not row:
         await interaction.response.send_message("No image found", ephemeral=True)
         return
 
-    await interaction.response.send_message(
-        file=discord.File(row["file_path"]),
-        ephemeral=False,
-    )
+    await respond_with_image(interaction, conn, row, ephemeral=False)
@@ -0,0 +1,225 @@
+# db.py
+import itertools
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Union
+
+
+DEFAULT_READERS = 4
+BUSY_TIMEOUT_MS = 5000
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KIB = 16 * 1024
+
+
+def _apply_pragmas(conn: sqlite3.Connection, *, busy_timeout_ms: int, mmap_size: int, cache_size_kib: int) -> None:
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+    conn.execute(f"PRAGMA cache_size = -{int(cache_size_kib)}")  # negative = KiB
+
+
+class Database:
+    """
+    One serialized writer connection plus a pool of read-only WAL readers.
+
+    Writes go through `writer()`, which holds a lock so only one thread uses the
+    writer connection at a time. Reads go through `reader()`, which hands out a
+    pooled read-only connection; in WAL mode readers see the last committed state
+    and never wait behind a writer's commit. A thread that is inside `writer()`
+    reads through the writer too, so it sees its own uncommitted writes.
+    In-memory databases cannot be shared between connections, so there
+    `reader()` always falls back to the writer.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        readers: int = DEFAULT_READERS,
+        busy_timeout_ms: int = BUSY_TIMEOUT_MS,
+        mmap_size: int = MMAP_SIZE,
+        cache_size_kib: int = CACHE_SIZE_KIB,
+    ):
+        self.path = path
+        self._pragmas = dict(busy_timeout_ms=busy_timeout_ms, mmap_size=mmap_size, cache_size_kib=cache_size_kib)
+        self._write_lock = threading.RLock()
+        self._writer_thread: Optional[int] = None
+        self._writer = sqlite3.connect(path, check_same_thread=False)
+        self._in_memory = path == ":memory:" or path.startswith("file::memory:")
+        if not self._in_memory:
+            self._writer.execute("PRAGMA journal_mode=WAL")
+        _apply_pragmas(self._writer, **self._pragmas)
+
+        self.max_readers = 0 if self._in_memory else max(0, readers)
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._all_readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+
+    def _open_reader(self) -> sqlite3.Connection:
+        uri = Path(self.path).absolute().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        _apply_pragmas(conn, **self._pragmas)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def _acquire_reader(self) -> sqlite3.Connection:
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._readers_lock:
+            if len(self._all_readers) < self.max_readers:
+                conn = self._open_reader()
+                self._all_readers.append(conn)
+                return conn
+        return self._readers.get()
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """The writer connection, held exclusively; rolls back if the block raises."""
+        with self._write_lock:
+            outer_thread = self._writer_thread
+            self._writer_thread = threading.get_ident()
+            try:
+                yield self._writer
+            except BaseException:
+                if self._writer.in_transaction and outer_thread is None:
+                    self._writer.rollback()
+                raise
+            finally:
+                self._writer_thread = outer_thread
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """A pooled read-only connection (the writer for in-memory databases)."""
+        if self.max_readers == 0 or self._writer_thread == threading.get_ident():
+            with self.writer() as conn:
+                yield conn
+            return
+
+        conn = self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    def close(self) -> None:
+        with self._readers_lock:
+            for conn in self._all_readers:
+                conn.close()
+            self._all_readers = []
+        with self._write_lock:
+            self._writer.close()
+
+
+DatabaseLike = Union[Database, sqlite3.Connection]
+
+
+@contextmanager
+def writer(conn: DatabaseLike) -> Iterator[sqlite3.Connection]:
+    """
+    Connection to write with. Accepts a Database or a plain sqlite3 connection
+    (tests and scripts), which is used as-is.
+    """
+    if isinstance(conn, Database):
+        with conn.writer() as db:
+            yield db
+        return
+    try:
+        yield conn
+    except BaseException:
+        # Inside transaction() the enclosing block decides what to roll back.
+        if conn.in_transaction and id(conn) not in _transactions:
+            conn.rollback()
+        raise
+
+
+@contextmanager
+def reader(conn: DatabaseLike) -> Iterator[sqlite3.Connection]:
+    """Connection to read with; see writer()."""
+    if isinstance(conn, Database):
+        with conn.reader() as db:
+            yield db
+        return
+    yield conn
+
+
+class _Transaction:
+    __slots__ = ("callbacks",)
+
+    def __init__(self):
+        self.callbacks: List[Callable[[], None]] = []
+
+
+_transactions: Dict[int, _Transaction] = {}  # id(writer sqlite3 connection) -> open transaction
+_savepoint_ids = itertools.count()
+
+
+@contextmanager
+def transaction(conn: DatabaseLike) -> Iterator[sqlite3.Connection]:
+    """
+    Write transaction on `conn`'s writer connection.
+
+    The outermost block BEGINs and COMMITs (or rolls back if it raises). Nested
+    blocks become SAVEPOINTs: a failing inner block rolls back only its own
+    writes, and nothing is committed until the outermost block ends. This is
+    what lets WriteQueue run many storage writes under one commit.
+    """
+    with writer(conn) as db:
+        tx = _transactions.get(id(db))
+        if tx is None:
+            tx = _transactions[id(db)] = _Transaction()
+            try:
+                if not db.in_transaction:
+                    db.execute("BEGIN")
+                yield db
+                db.commit()
+            except BaseException:
+                if db.in_transaction:
+                    db.rollback()
+                raise
+            finally:
+                del _transactions[id(db)]
+            for callback in tx.callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"[WARN] After-commit callback failed: {e}")
+            return
+
+        name = f"sp_{next(_savepoint_ids)}"
+        mark = len(tx.callbacks)
+        db.execute(f"SAVEPOINT {name}")
+        try:
+            yield db
+        except BaseException:
+            db.execute(f"ROLLBACK TO {name}")
+            db.execute(f"RELEASE {name}")
+            del tx.callbacks[mark:]
+            raise
+        db.execute(f"RELEASE {name}")
+
+
+def after_commit(db: sqlite3.Connection, callback: Callable[[], None]) -> None:
+    """
+    Run `callback` once the transaction open on writer connection `db` commits
+    (dropped if it rolls back); immediately when no transaction() is open.
+    """
+    tx = _transactions.get(id(db))
+    if tx is None:
+        callback()
+    else:
+        tx.callbacks.append(callback)
+
+
+def ensure_column(db: sqlite3.Connection, *, table: str, column: str, ddl: str) -> None:
+    """Add `column` to `table` unless it exists (schema migration for older databases)."""
+    cur = db.cursor()
+    cur.execute(f"PRAGMA table_info({table})")
+    existing = {r[1] for r in cur.fetchall()}
+    if column in existing:
+        return
+    cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
@@ -0,0 +1,232 @@
+# delivery.py
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+import aiohttp
+import discord
+
+from derivatives import needs_encode, send_path_async
+from executors import call_db
+from image_store import resolve_image_path
+from storage import clear_image_attachment, update_image_attachment
+
+
+# Treat signed CDN URLs as stale this long before their `ex` expiry.
+URL_EXPIRY_MARGIN_SECONDS = 60 * 60
+# A recorded URL that doesn't answer a HEAD request this fast is not reused.
+URL_CHECK_TIMEOUT_SECONDS = 1.5
+# A URL that resolved is trusted this long before it is checked again.
+URL_CHECK_TTL_SECONDS = 10 * 60
+URL_CHECK_CACHE_SIZE = 4096
+
+_http_session: Optional[aiohttp.ClientSession] = None
+_checked_urls: "OrderedDict[str, float]" = OrderedDict()  # url -> when it last resolved
+
+
+def set_http_session(session: Optional[aiohttp.ClientSession]) -> None:
+    """Long-lived session for URL checks (the bot opens one in setup_hook)."""
+    global _http_session
+    _http_session = session
+
+
+def url_expires_at(url: str) -> Optional[int]:
+    """Expiry (unix seconds) from a signed Discord CDN URL's `ex` param, if any."""
+    try:
+        ex = parse_qs(urlparse(url).query).get("ex")
+        return int(ex[0], 16) if ex else None
+    except (ValueError, IndexError):
+        return None
+
+
+def is_url_fresh(url: Optional[str], now: Optional[float] = None) -> bool:
+    if not url:
+        return False
+    expires_at = url_expires_at(url)
+    if expires_at is None:
+        return True
+    if now is None:
+        now = time.time()
+    return expires_at - URL_EXPIRY_MARGIN_SECONDS > now
+
+
+def url_recently_checked(url: str, now: Optional[float] = None) -> bool:
+    """Whether `url` resolved within URL_CHECK_TTL_SECONDS (so checking it is free)."""
+    checked_at = _checked_urls.get(url)
+    if checked_at is None:
+        return False
+    return (time.monotonic() if now is None else now) - checked_at < URL_CHECK_TTL_SECONDS
+
+
+def _remember_check(url: str) -> None:
+    _checked_urls[url] = time.monotonic()
+    _checked_urls.move_to_end(url)
+    while len(_checked_urls) > URL_CHECK_CACHE_SIZE:
+        _checked_urls.popitem(last=False)
+
+
+async def _head_status(session: aiohttp.ClientSession, url: str) -> int:
+    timeout = aiohttp.ClientTimeout(total=URL_CHECK_TIMEOUT_SECONDS)
+    async with session.head(url, allow_redirects=True, timeout=timeout) as resp:
+        return resp.status
+
+
+async def url_resolves(url: str) -> bool:
+    """
+    Whether `url` still serves a file. An unexpired CDN URL stops working
+    when the message it was uploaded in is deleted. Positive answers are
+    cached for URL_CHECK_TTL_SECONDS, so a popular image is not re-checked
+    on every send.
+    """
+    if url_recently_checked(url):
+        return True
+    try:
+        if _http_session is not None and not _http_session.closed:
+            status = await _head_status(_http_session, url)
+        else:
+            async with aiohttp.ClientSession() as session:  # scripts without a bot
+                status = await _head_status(session, url)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"[WARN] Could not check attachment URL, uploading instead: {e}")
+        return False
+    if status >= 400:
+        _checked_urls.pop(url, None)
+        return False
+    _remember_check(url)
+    return True
+
+
+async def _reusable_url(conn, row: Dict[str, Any], executors=None) -> Optional[str]:
+    """`row`'s recorded CDN URL if it is fresh and still resolves; a dead one is forgotten."""
+    url = row.get("attachment_url")
+    if not is_url_fresh(url):
+        return None
+    if await url_resolves(url):
+        return url
+    if row.get("id") is not None:
+        await call_db(executors, clear_image_attachment, conn, row["id"])
+    row["attachment_id"] = None
+    row["attachment_url"] = None
+    return None
+
+
+def image_send_kwargs(row: Dict[str, Any], file_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Message kwargs for sending an indexed image: an embed pointing at the
+    recorded CDN URL while it is fresh, else an upload of the local file
+    (`file_path`, default the row's own).
+    """
+    url = row.get("attachment_url")
+    if is_url_fresh(url):
+        embed = discord.Embed()
+        embed.set_image(url=url)
+        return {"embed": embed}
+    return {"file": discord.File(file_path or resolve_image_path(row["file_path"]))}
+
+
+def _open_upload(path: str, source: str) -> discord.File:
+    """
+    discord.File of the send derivative at `path`, opened right away: once
+    open, eviction deleting it no longer matters, and if eviction got there
+    first the original at `source` is sent instead.
+    """
+    try:
+        return discord.File(path)
+    except FileNotFoundError:
+        if path == source:
+            raise
+        return discord.File(source)
+
+
+async def _upload_kwargs(conn, row: Dict[str, Any], executors=None, file_path: Optional[str] = None) -> Dict[str, Any]:
+    source = file_path or resolve_image_path(row["file_path"])
+    # Lookups on the db pool, a first-time encode on the cpu pool.
+    path = await send_path_async(executors, conn, row, source)
+    if executors is None:
+        return {"file": _open_upload(path, source)}
+    return {"file": await executors.run_io(_open_upload, path, source)}
+
+
+async def _send_kwargs(conn, row: Dict[str, Any], executors=None, file_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    image_send_kwargs, reusing the CDN URL only once it is known to still
+    resolve, and uploading the image's send derivative otherwise.
+    """
+    if await _reusable_url(conn, row, executors):
+        return image_send_kwargs(row)
+    return await _upload_kwargs(conn, row, executors, file_path)
+
+
+async def _remember_upload(conn, row: Dict[str, Any], message, executors=None) -> None:
+    attachments = getattr(message, "attachments", None)
+    if not attachments or row.get("id") is None:
+        return
+    uploaded = attachments[0]
+    await call_db(executors, update_image_attachment, conn, row["id"], str(uploaded.id), uploaded.url)
+    # Callers may reuse `row` (e.g. a dropdown's matches); keep it current too.
+    row["attachment_id"] = str(uploaded.id)
+    row["attachment_url"] = uploaded.url
+
+
+async def send_image(channel, conn, row: Dict[str, Any], *, executors=None, file_path: Optional[str] = None):
+    """Send `row`'s image to `channel`, recording the new URL after a file upload."""
+    kwargs = await _send_kwargs(conn, row, executors, file_path)
+    message = await channel.send(**kwargs)
+    if "file" in kwargs and message is not None:
+        await _remember_upload(conn, row, message, executors)
+    return message
+
+
+async def respond_with_image(
+    interaction,
+    conn,
+    row: Dict[str, Any],
+    *,
+    executors=None,
+    file_path: Optional[str] = None,
+    ephemeral: bool = False,
+) -> None:
+    """
+    Interaction-response counterpart of send_image. Anything that may take a
+    while before the image can be sent (checking a recorded URL that was not
+    checked recently, encoding a derivative) happens after deferring, so it
+    cannot run past Discord's 3 second deadline; the image then follows up.
+    """
+    deferred = False
+
+    async def _defer() -> None:
+        nonlocal deferred
+        if not deferred:
+            await interaction.response.defer(ephemeral=ephemeral, thinking=True)
+            deferred = True
+
+    url = row.get("attachment_url")
+    if is_url_fresh(url) and not url_recently_checked(url):
+        await _defer()
+    if await _reusable_url(conn, row, executors):
+        kwargs = image_send_kwargs(row)
+    else:
+        if await call_db(executors, needs_encode, conn, row, file_path):
+            await _defer()
+        kwargs = await _upload_kwargs(conn, row, executors, file_path)
+
+    if deferred:
+        message = await interaction.followup.send(**kwargs, ephemeral=ephemeral, wait=True)
+    else:
+        await interaction.response.send_message(**kwargs, ephemeral=ephemeral)
+        message = None
+    if "file" not in kwargs or ephemeral:
+        return
+
+    if message is None:
+        original_response = getattr(interaction, "original_response", None)
+        if original_response is None:
+            return
+        try:
+            message = await original_response()
+        except discord.HTTPException as e:
+            print(f"[WARN] Could not fetch response to record attachment URL: {e}")
+            return
+    await _remember_upload(conn, row, message, executors)
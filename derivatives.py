@@ -0,0 +1,281 @@
+# derivatives.py
+"""
+Send-optimized renditions of large images.
+
+Uploading a multi-megabyte screenshot to Discord is the slowest part of a
+send once the CDN URL has expired. When such an image is indexed (or, for
+older images, the first time it is uploaded), a WebP (or JPEG) copy under
+`DerivativePolicy.max_bytes` is encoded and kept next to the original
+(`ab/cd/<sha256>.send.webp`); uploads send that instead.
+Derivatives are tracked in `image_derivatives` and the least recently used
+are deleted once they add up to more than `cache_max_bytes`.
+"""
+import io
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from executors import call_db
+from image_store import resolve_image_path
+from storage import (
+    delete_derivative,
+    derivative_total_bytes,
+    get_derivative,
+    pop_least_recent_derivatives,
+    save_derivative,
+    touch_derivative,
+)
+from write_queue import call_write
+
+
+_FORMATS = {"webp": ("WEBP", ".send.webp"), "jpeg": ("JPEG", ".send.jpg")}
+
+QUALITY_LADDER = (85, 75, 60, 45)
+DOWNSCALE_STEP = 0.75
+TOUCH_INTERVAL_SECONDS = 60 * 60  # last_used only needs to be roughly right for LRU
+
+
+@dataclass(frozen=True)
+class DerivativePolicy:
+    """
+    - Originals larger than `max_bytes` get a derivative that fits in it
+      (0 disables derivatives).
+    - The derivative's longest side is at most `max_side`; it is encoded as
+      `format` ("webp" or "jpeg"), lowering quality and then size until it fits.
+    - Derivatives are evicted, least recently sent first, past `cache_max_bytes`.
+    """
+    max_bytes: int = 1024 * 1024
+    max_side: int = 2048
+    min_side: int = 256
+    format: str = "webp"
+    cache_max_bytes: int = 1024 * 1024 * 1024
+
+
+_derivative_policy = DerivativePolicy()
+
+
+def set_derivative_policy(policy: DerivativePolicy) -> None:
+    global _derivative_policy
+    _derivative_policy = policy
+
+
+def get_derivative_policy() -> DerivativePolicy:
+    return _derivative_policy
+
+
+def derivative_path(file_path: str, policy: Optional[DerivativePolicy] = None) -> str:
+    """Stored path of the derivative of `file_path`, next to the original."""
+    policy = policy or _derivative_policy
+    return os.path.splitext(file_path)[0] + _FORMATS[policy.format][1]
+
+
+def encode_derivative(source: str, policy: Optional[DerivativePolicy] = None) -> Optional[bytes]:
+    """
+    Encoded derivative of the image at `source` within policy.max_bytes, or
+    None when the image cannot be made to fit (or is animated).
+    """
+    policy = policy or _derivative_policy
+    pil_format = _FORMATS[policy.format][0]
+    with Image.open(source) as img:
+        if getattr(img, "is_animated", False):
+            return None  # re-encoding would keep only the first frame
+        img.load()
+        if pil_format == "JPEG":
+            img = img.convert("RGB")
+        elif img.mode not in ("RGB", "RGBA"):
+            has_alpha = "A" in img.getbands() or "transparency" in img.info
+            img = img.convert("RGBA" if has_alpha else "RGB")
+
+        scale = min(1.0, policy.max_side / max(img.size))
+        while True:
+            size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+            frame = img if size == img.size else img.resize(size, Image.LANCZOS)
+            for quality in QUALITY_LADDER:
+                buf = io.BytesIO()
+                frame.save(buf, pil_format, quality=quality)
+                if buf.tell() <= policy.max_bytes:
+                    return buf.getvalue()
+            if min(size) * DOWNSCALE_STEP < policy.min_side:
+                return None
+            scale *= DOWNSCALE_STEP
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _over_budget(source: str, policy: DerivativePolicy) -> bool:
+    try:
+        return os.path.getsize(source) > policy.max_bytes
+    except OSError:
+        return False  # missing originals have no derivative
+
+
+def find_derivative(
+    conn,
+    row: Dict[str, Any],
+    source: str,
+    *,
+    policy: Optional[DerivativePolicy] = None,
+    now: Optional[int] = None,
+) -> Tuple[Optional[str], bool]:
+    """
+    (path, encode) for `row`, whose original is at `source`: the real path of
+    its existing derivative (its last use touched), and whether one has to be
+    encoded first. Lookups and bookkeeping only; no image work.
+    """
+    policy = policy or _derivative_policy
+    if policy.max_bytes <= 0 or row.get("id") is None or not _over_budget(source, policy):
+        return None, False
+    now = int(time.time()) if now is None else now
+
+    existing = get_derivative(conn, row["id"])
+    if existing is not None:
+        file_path, _, last_used = existing
+        path = resolve_image_path(file_path)
+        if os.path.exists(path):
+            if now - last_used >= TOUCH_INTERVAL_SECONDS:
+                touch_derivative(conn, row["id"], now)
+            return path, False
+        delete_derivative(conn, row["id"])
+    return None, True
+
+
+def write_derivative(source: str, policy: Optional[DerivativePolicy] = None) -> Optional[int]:
+    """
+    Encode the derivative of the image at `source` and write it next to it.
+    Returns its size, or None when there is none. Pure image work: no DB.
+    """
+    policy = policy or _derivative_policy
+    try:
+        data = encode_derivative(source, policy)
+    except (OSError, ValueError) as e:
+        print(f"[WARN] Could not encode send derivative of {source}: {e}")
+        return None
+    if data is None:
+        return None
+    _write_atomic(derivative_path(source, policy), data)
+    return len(data)
+
+
+def record_derivative(
+    conn,
+    row: Dict[str, Any],
+    source: str,
+    size: int,
+    *,
+    policy: Optional[DerivativePolicy] = None,
+    now: Optional[int] = None,
+) -> Optional[str]:
+    """Track a derivative written by write_derivative, evicting past the cache budget; its real path."""
+    policy = policy or _derivative_policy
+    now = int(time.time()) if now is None else now
+    path = derivative_path(source, policy)  # next to the original, wherever it lives
+    save_derivative(conn, row["id"], derivative_path(row["file_path"], policy), size, now)
+    evict_derivatives(conn, policy.cache_max_bytes)
+    return path if os.path.exists(path) else None
+
+
+def ensure_derivative(
+    conn,
+    row: Dict[str, Any],
+    source: Optional[str] = None,
+    *,
+    policy: Optional[DerivativePolicy] = None,
+    now: Optional[int] = None,
+) -> Optional[str]:
+    """
+    Real path of `row`'s derivative, encoding it first if needed. None when
+    the original (at `source`, default its resolved file_path) already fits
+    the budget, is missing, or cannot be shrunk into it.
+    """
+    source = source or resolve_image_path(row["file_path"])
+    path, encode = find_derivative(conn, row, source, policy=policy, now=now)
+    if not encode:
+        return path
+    size = write_derivative(source, policy)
+    if size is None:
+        return None
+    return record_derivative(conn, row, source, size, policy=policy, now=now)
+
+
+async def ensure_derivative_async(
+    executors,
+    conn,
+    row: Dict[str, Any],
+    source: Optional[str] = None,
+    *,
+    writes=None,
+    policy: Optional[DerivativePolicy] = None,
+    now: Optional[int] = None,
+) -> Optional[str]:
+    """
+    ensure_derivative for the bot: lookups on the db pool, the encode on the
+    cpu pool (which never touches the DB) and the bookkeeping through the
+    `writes` WriteQueue when given.
+    """
+    source = source or resolve_image_path(row["file_path"])
+    path, encode = await call_db(executors, find_derivative, conn, row, source, policy=policy, now=now)
+    if not encode:
+        return path
+    if executors is None:
+        size = write_derivative(source, policy)
+    else:
+        size = await executors.run_cpu(write_derivative, source, policy)
+    if size is None:
+        return None
+    return await call_write(writes, executors, record_derivative, conn, row, source, size, policy=policy, now=now)
+
+
+def evict_derivatives(conn, cache_max_bytes: Optional[int] = None) -> List[str]:
+    """Delete least recently used derivatives until they fit `cache_max_bytes`."""
+    if cache_max_bytes is None:
+        cache_max_bytes = _derivative_policy.cache_max_bytes
+    excess = derivative_total_bytes(conn) - cache_max_bytes
+    if excess <= 0:
+        return []
+    paths = pop_least_recent_derivatives(conn, excess)
+    for file_path in paths:
+        _remove(resolve_image_path(file_path))
+    return paths
+
+
+def needs_encode(conn, row: Dict[str, Any], file_path: Optional[str] = None) -> bool:
+    """Whether sending `row` would have to encode a derivative first (slow for big images)."""
+    policy = _derivative_policy
+    source = file_path or resolve_image_path(row["file_path"])
+    if policy.max_bytes <= 0 or row.get("id") is None or not _over_budget(source, policy):
+        return False
+    existing = get_derivative(conn, row["id"])
+    return existing is None or not os.path.exists(resolve_image_path(existing[0]))
+
+
+async def send_path_async(
+    executors, conn, row: Dict[str, Any], file_path: Optional[str] = None, *, writes=None
+) -> str:
+    """Path to upload for `row`: its derivative when it has one, else the original."""
+    source = file_path or resolve_image_path(row["file_path"])
+    return await ensure_derivative_async(executors, conn, row, source, writes=writes) or source
@@ -0,0 +1,78 @@
+# executors.py
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+
+T = TypeVar("T")
+
+DEFAULT_DB_WORKERS = 4
+DEFAULT_CPU_WORKERS = 2
+
+
+class BotExecutors:
+    """
+    Thread pools that keep blocking work off the asyncio event loop.
+
+    - `db`: SQLite access and search. With `serialize_db` (for a single shared
+      sqlite3 connection) calls hold `conn_lock`, so the connection is never used
+      by two threads at once. A db.Database serializes its own writer and gives
+      each reader its own connection, so it runs with `serialize_db=False`.
+    - `cpu`: image decoding, hashing and OCR. No lock; these never touch the DB.
+    """
+
+    def __init__(
+        self,
+        db_workers: int = DEFAULT_DB_WORKERS,
+        cpu_workers: int = DEFAULT_CPU_WORKERS,
+        *,
+        serialize_db: bool = True,
+    ):
+        self.db_pool = ThreadPoolExecutor(max_workers=db_workers, thread_name_prefix="db")
+        self.cpu_pool = ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix="cpu")
+        self.conn_lock = threading.RLock()
+        self.serialize_db = serialize_db
+
+    def _locked(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        with self.conn_lock:
+            return fn(*args, **kwargs)
+
+    async def run_db(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run a DB/search call on the db pool (holding the connection lock if serializing)."""
+        loop = asyncio.get_running_loop()
+        if self.serialize_db:
+            call = functools.partial(self._locked, fn, *args, **kwargs)
+        else:
+            call = functools.partial(fn, *args, **kwargs)
+        return await loop.run_in_executor(self.db_pool, call)
+
+    async def run_io(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run small blocking file-system work on the db pool, without the lock."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.db_pool, functools.partial(fn, *args, **kwargs))
+
+    async def run_cpu(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run CPU-heavy image work on the cpu pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.cpu_pool, functools.partial(fn, *args, **kwargs))
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.db_pool.shutdown(wait=wait)
+        self.cpu_pool.shutdown(wait=wait)
+
+
+async def call_db(
+    executors: Optional[BotExecutors],
+    fn: Callable[..., T],
+    *args: Any,
+    **kwargs: Any,
+) -> T:
+    """
+    Run `fn` through `executors.run_db`, or inline when no executors are configured
+    (unit tests, scripts).
+    """
+    if executors is None:
+        return fn(*args, **kwargs)
+    return await executors.run_db(fn, *args, **kwargs)
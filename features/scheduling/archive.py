@@ -0,0 +1,97 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import discord
+
+from executors import call_db
+
+from .storage import archive_finished_messages, purge_archived_messages
+
+
+DAY_SECONDS = 60 * 60 * 24
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    """
+    - Sent, failed and canceled schedules stay in scheduled_messages for
+      `finished_days`, then move to scheduled_messages_archive.
+    - Archived schedules are deleted after `archive_days` (0 keeps them forever).
+    - The archival job runs every `interval_seconds`, moving `batch_size` rows
+      per transaction so it never holds the writer for long.
+    """
+    finished_days: float = 7
+    archive_days: float = 0
+    batch_size: int = 500
+    interval_seconds: float = 60 * 60
+
+
+_retention_policy = RetentionPolicy()
+
+
+def set_retention_policy(policy: RetentionPolicy) -> None:
+    global _retention_policy
+    _retention_policy = policy
+
+
+def get_retention_policy() -> RetentionPolicy:
+    return _retention_policy
+
+
+async def archive_once(
+    conn,
+    *,
+    executors=None,
+    policy: Optional[RetentionPolicy] = None,
+    now: Optional[int] = None,
+) -> Tuple[int, int]:
+    """Archive and purge everything `policy` says is due. Returns (archived, purged)."""
+    policy = policy or _retention_policy
+    if now is None:
+        now = int(time.time())
+    batch_size = max(1, policy.batch_size)
+
+    archived = 0
+    finished_before = now - int(policy.finished_days * DAY_SECONDS)
+    while True:
+        moved = await call_db(
+            executors, archive_finished_messages, conn,
+            finished_before=finished_before, now=now, limit=batch_size,
+        )
+        archived += moved
+        if moved < batch_size:
+            break
+        await asyncio.sleep(0)  # let other writers in between batches
+
+    purged = 0
+    if policy.archive_days > 0:
+        archived_before = now - int(policy.archive_days * DAY_SECONDS)
+        while True:
+            deleted = await call_db(
+                executors, purge_archived_messages, conn, finished_before=archived_before, limit=batch_size
+            )
+            purged += deleted
+            if deleted < batch_size:
+                break
+            await asyncio.sleep(0)
+    return archived, purged
+
+
+def start_archival_loop(
+    bot: discord.Client,
+    conn,
+    *,
+    policy: Optional[RetentionPolicy] = None,
+) -> asyncio.Task:
+    async def _loop():
+        while not bot.is_closed():
+            current = policy or _retention_policy
+            try:
+                await archive_once(conn, executors=getattr(bot, "executors", None), policy=current)
+            except Exception as e:
+                print(f"[WARN] Scheduled message archival failed: {e}")
+            await asyncio.sleep(current.interval_seconds)
+
+    return asyncio.create_task(_loop())
@@ -5,7 +5,12 @@ from typing import Optional
 import discord
 from discord import app_commands
 
+from delivery import send_image
+from executors import call_db
+
+from .archive import start_archival_loop
 from .dispatcher import start_scheduler_loop
+from .recurrence import DEFAULT_MISSED_POLICY, CronExpression
 from .storage import (
     cancel_scheduled_message,
     create_scheduled_message,
@@ -24,34 +29,40 @@ SCHEDULE_MAX_MINUTES = 60 * 24 * 7  # 7 days
 
 def setup_scheduling(bot: discord.Client) -> None:
     """
-    Register scheduling slash commands and start the background scheduler loop.
-    Expects `bot` to have `.tree` (CommandTree) and `.conn` (sqlite3 connection).
+    Register scheduling slash commands and start the background scheduler and archival loops.
+    Expects `bot` to have `.tree` (CommandTree) and `.conn` (db.Database or sqlite3 connection).
     """
     tree = bot.tree
     conn = bot.conn
+    executors = getattr(bot, "executors", None)
 
     init_scheduler_db(conn)
 
     async def _send_image_search(channel, conn_arg, query: str):
         from search import search_best_match
 
-        matches = search_best_match(conn_arg, query, limit=1)
+        matches = await call_db(executors, search_best_match, conn_arg, query, limit=1)
         if not matches:
             await channel.send("No matching image found.")
             return
-        row = matches[0]
-        await channel.send(file=discord.File(row["file_path"]))
+        await send_image(channel, conn_arg, matches[0], executors=executors)
 
     start_scheduler_loop(
         bot,
         conn,
         handlers={"image_search": _send_image_search},
     )
+    start_archival_loop(bot, conn)
 
     mode_choices = [
         app_commands.Choice(name="Text", value="text"),
         app_commands.Choice(name="Image (fuzzy search)", value="image_search"),
     ]
+    missed_choices = [
+        app_commands.Choice(name="Skip missed runs", value="skip"),
+        app_commands.Choice(name="Send once for missed runs", value="fire_once"),
+        app_commands.Choice(name="Send every missed run (up to 10)", value="fire_all"),
+    ]
 
     @tree.command(name="schedule", description="Schedule a message to be sent later")
     @app_commands.describe(
@@ -81,7 +92,9 @@ def setup_scheduling(bot: discord.Client) -> None:
         run_at = now + int(minutes) * 60
         kind = (mode.value if mode is not None else "text")
 
-        schedule_id = create_scheduled_message(
+        schedule_id = await call_db(
+            executors,
+            create_scheduled_message,
             conn,
             channel_id=channel_id,
             kind=kind,
@@ -140,7 +153,9 @@ def setup_scheduling(bot: discord.Client) -> None:
 
         channel_id = str(resolved_channel_id)
         kind = (mode.value if mode is not None else "text")
-        schedule_id = create_scheduled_message(
+        schedule_id = await call_db(
+            executors,
+            create_scheduled_message,
             conn,
             channel_id=channel_id,
             kind=kind,
@@ -164,6 +179,7 @@ def setup_scheduling(bot: discord.Client) -> None:
         content="Text to send (or fuzzy-search query if mode=image)",
         mode="Send text or post an image",
         channel="Target channel (default: current channel)",
+        missed="What to do about runs missed while the bot was offline",
     )
     @app_commands.choices(
         interval=[
@@ -172,6 +188,7 @@ def setup_scheduling(bot: discord.Client) -> None:
             app_commands.Choice(name="Every day", value="day"),
         ],
         mode=mode_choices,
+        missed=missed_choices,
     )
     async def schedule_repeat_cmd(
         interaction: discord.Interaction,
@@ -181,6 +198,7 @@ def setup_scheduling(bot: discord.Client) -> None:
         content: str,
         mode: Optional[app_commands.Choice[str]] = None,
         channel: Optional[discord.TextChannel] = None,
+        missed: Optional[app_commands.Choice[str]] = None,
     ):
         resolved_channel_id = channel.id if channel is not None else interaction.channel_id
         if resolved_channel_id is None:
@@ -205,13 +223,16 @@ def setup_scheduling(bot: discord.Client) -> None:
         kind = (mode.value if mode is not None else "text")
         repeat_interval = interval.value
 
-        schedule_id = create_scheduled_message(
+        schedule_id = await call_db(
+            executors,
+            create_scheduled_message,
             conn,
             channel_id=channel_id,
             kind=kind,
             content=content,
             run_at=run_at,
             repeat_interval=repeat_interval,
+            missed_policy=missed.value if missed is not None else DEFAULT_MISSED_POLICY,
             created_by=str(interaction.user.id) if interaction.user else None,
         )
 
@@ -221,6 +242,59 @@ def setup_scheduling(bot: discord.Client) -> None:
             ephemeral=True,
         )
 
+    @tree.command(name="schedule_cron", description="Repeat sending text or posting an image on a cron schedule")
+    @app_commands.describe(
+        expression="Cron expression in server local time: minute hour day month weekday (e.g. 0 9 * * 1-5)",
+        content="Text to send (or fuzzy-search query if mode=image)",
+        mode="Send text or post an image",
+        channel="Target channel (default: current channel)",
+        missed="What to do about runs missed while the bot was offline",
+    )
+    @app_commands.choices(mode=mode_choices, missed=missed_choices)
+    async def schedule_cron_cmd(
+        interaction: discord.Interaction,
+        expression: str,
+        content: str,
+        mode: Optional[app_commands.Choice[str]] = None,
+        channel: Optional[discord.TextChannel] = None,
+        missed: Optional[app_commands.Choice[str]] = None,
+    ):
+        resolved_channel_id = channel.id if channel is not None else interaction.channel_id
+        if resolved_channel_id is None:
+            await interaction.response.send_message(
+                "Cannot determine target channel (try using the channel option).",
+                ephemeral=True,
+            )
+            return
+
+        try:
+            cron = CronExpression(expression)
+            run_at = cron.next_after(int(time.time()))
+        except ScheduleTimeError as e:
+            await interaction.response.send_message(str(e), ephemeral=True)
+            return
+
+        channel_id = str(resolved_channel_id)
+        kind = (mode.value if mode is not None else "text")
+        schedule_id = await call_db(
+            executors,
+            create_scheduled_message,
+            conn,
+            channel_id=channel_id,
+            kind=kind,
+            content=content,
+            run_at=run_at,
+            cron=cron.text,
+            missed_policy=missed.value if missed is not None else DEFAULT_MISSED_POLICY,
+            created_by=str(interaction.user.id) if interaction.user else None,
+        )
+
+        await interaction.response.send_message(
+            f"Scheduled cron ({'image' if kind == 'image_search' else 'text'}) (id={schedule_id}) "
+            f"`{cron.text}`, first at <t:{run_at}:F> in <#{channel_id}>.",
+            ephemeral=True,
+        )
+
     @tree.command(name="schedule_list", description="List scheduled messages in this channel")
     @app_commands.describe(limit="Max items to show (1-20)")
     async def schedule_list_cmd(
@@ -235,7 +309,9 @@ def setup_scheduling(bot: discord.Client) -> None:
             return
 
         channel_id = str(interaction.channel_id)
-        rows = list_scheduled_messages(conn, channel_id=channel_id, limit=int(limit))
+        rows = await call_db(
+            executors, list_scheduled_messages, conn, channel_id=channel_id, limit=int(limit)
+        )
         if not rows:
             await interaction.response.send_message("No pending scheduled messages.", ephemeral=True)
             return
@@ -243,7 +319,7 @@ def setup_scheduling(bot: discord.Client) -> None:
         lines = []
         for r in rows:
             kind = r.get("kind") or "text"
-            repeat = r.get("repeat_interval")
+            repeat = f"cron `{r['cron']}`" if r.get("cron") else r.get("repeat_interval")
             preview = (r["content"][:60] + "…") if len(r["content"]) > 60 else r["content"]
             prefix = "img" if kind == "image_search" else "text"
             repeat_part = f" repeat={repeat}" if repeat else ""
@@ -257,7 +333,9 @@ def setup_scheduling(bot: discord.Client) -> None:
         interaction: discord.Interaction,
         schedule_id: int,
     ):
-        ok = cancel_scheduled_message(
+        ok = await call_db(
+            executors,
+            cancel_scheduled_message,
             conn,
             schedule_id=int(schedule_id),
             requester_id=str(interaction.user.id) if interaction.user else None,
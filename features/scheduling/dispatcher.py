@@ -1,19 +1,40 @@
 import asyncio
+import heapq
 import time
-from typing import Awaitable, Callable, Dict, Optional
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 
 import discord
 
-from .storage import claim_due_messages, mark_failed, mark_sent, reschedule_repeat
+from executors import call_db
+from write_queue import call_write
+
+from .recurrence import plan_catch_up, recurrence_for
+from .storage import (
+    DEFAULT_LEASE_SECONDS,
+    add_schedule_listener,
+    claim_due_messages,
+    default_worker_id,
+    fetch_pending_run_times,
+    mark_failed,
+    mark_sent,
+    remove_schedule_listener,
+    renew_leases,
+    reschedule_repeat,
+)
 
 
 ScheduledHandler = Callable[[discord.abc.Messageable, object, str], Awaitable[None]]
 
-_REPEAT_SECONDS = {
-    "minute": 60,
-    "hour": 60 * 60,
-    "day": 60 * 60 * 24,
-}
+DEFAULT_RESYNC_SECONDS = 300.0
+DEFAULT_DISPATCH_CONCURRENCY = 8
+# A send still running after this long is most likely discord.py sleeping
+# through a rate limit; it gives up its slot so other channels keep going.
+SLOW_SEND_SECONDS = 5.0
+
+# Claim size adapts to the backlog: the usual handful of rows per wakeup, up
+# to MAX_BATCH_SIZE when many are due at once (e.g. after downtime).
+MIN_BATCH_SIZE = 10
+MAX_BATCH_SIZE = 500
 
 
 async def dispatch_due_messages(
@@ -23,65 +44,286 @@ async def dispatch_due_messages(
     now: Optional[int] = None,
     batch_size: int = 10,
     handlers: Optional[Dict[str, ScheduledHandler]] = None,
+    max_concurrency: int = DEFAULT_DISPATCH_CONCURRENCY,
+    owner: Optional[str] = None,
+    lease_seconds: int = DEFAULT_LEASE_SECONDS,
 ) -> int:
+    """
+    Claim up to `batch_size` due schedules and send them. Channels are served
+    concurrently (Discord rate-limits sends per channel), at most
+    `max_concurrency` sends at a time; rows for the same channel go out one
+    after another in run_at order. Returns the number sent.
+
+    Claimed rows are leased to `owner` (default: this process) and the leases
+    are renewed while sends are in flight, so several dispatchers can share
+    one database and a crashed one's rows are picked up once its leases lapse.
+    """
     if now is None:
         now = int(time.time())
+    owner = owner or default_worker_id()
 
-    claimed = claim_due_messages(conn, now=now, limit=batch_size)
+    executors = getattr(bot, "executors", None)
+    writes = getattr(bot, "writes", None)
+
+    claimed = await call_db(
+        executors, claim_due_messages, conn, now=now, limit=batch_size, owner=owner, lease_seconds=lease_seconds
+    )
     if not claimed:
         return 0
 
-    sent_count = 0
-    for row in claimed:
+    # Status updates are queued as we go and awaited together at the end, so a
+    # WriteQueue can commit the whole batch at once.
+    updates = []
+
+    def _update(fn, *args, **kwargs) -> None:
+        updates.append(asyncio.ensure_future(call_write(writes, executors, fn, conn, *args, owner=owner, **kwargs)))
+
+    in_flight = {int(row["id"]) for row in claimed}
+
+    async def _renew() -> None:
+        while True:
+            await asyncio.sleep(lease_seconds / 3)
+            try:
+                await call_write(
+                    writes, executors, renew_leases, conn, list(in_flight),
+                    owner=owner, now=int(time.time()), lease_seconds=lease_seconds,
+                )
+            except Exception as e:
+                print(f"[WARN] Failed to renew schedule leases: {e}")
+
+    # A slot is held while talking to Discord, but not for the whole of a long
+    # rate-limit wait (which discord.py sleeps through inside the send).
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def _limited(call: Callable[[], Awaitable[None]]) -> None:
+        async with semaphore:
+            send = asyncio.ensure_future(call())
+            try:
+                await asyncio.wait({send}, timeout=SLOW_SEND_SECONDS)
+            except asyncio.CancelledError:
+                send.cancel()
+                raise
+        await send
+
+    async def _deliver(row: Dict[str, object]) -> bool:
         schedule_id = int(row["id"])
         channel_id = int(row["channel_id"])
         content = row["content"]
         kind = row.get("kind") or "text"
-        repeat_interval = row.get("repeat_interval")
+        run_at = int(row["run_at"])
 
         channel = bot.get_channel(channel_id)
         if channel is None:
-            mark_failed(conn, schedule_id, error=f"Channel {channel_id} not found")
-            continue
+            _update(mark_failed, schedule_id, error=f"Channel {channel_id} not found")
+            return False
 
         try:
-            if kind == "text":
-                await channel.send(content)
+            recurrence = recurrence_for(
+                run_at=run_at, repeat_interval=row.get("repeat_interval"), cron=row.get("cron")
+            )
+            if recurrence is None:
+                sends, next_run_at = 1, None
             else:
-                if handlers is None or kind not in handlers:
-                    raise RuntimeError(f"Unsupported schedule kind: {kind}")
-                await handlers[kind](channel, conn, content)
-
-            if repeat_interval:
-                seconds = _REPEAT_SECONDS.get(repeat_interval)
-                if seconds is None:
-                    raise RuntimeError(f"Unsupported repeat interval: {repeat_interval}")
+                sends, next_run_at = plan_catch_up(
+                    recurrence, run_at=run_at, now=now, policy=row.get("missed_policy")
+                )
 
-                next_run_at = int(row["run_at"]) + seconds
-                while next_run_at <= now:
-                    next_run_at += seconds
+            for _ in range(sends):
+                if kind == "text":
+                    await _limited(lambda: channel.send(content))
+                else:
+                    if handlers is None or kind not in handlers:
+                        raise RuntimeError(f"Unsupported schedule kind: {kind}")
+                    await _limited(lambda: handlers[kind](channel, conn, content))
 
-                reschedule_repeat(conn, schedule_id, sent_at=now, next_run_at=next_run_at)
-                await channel.send(f"Sent at <t:{now}:F>. Next at <t:{next_run_at}:F>.")
-            else:
-                mark_sent(conn, schedule_id, sent_at=now)
-            sent_count += 1
+            if next_run_at is None:
+                _update(mark_sent, schedule_id, sent_at=now)
+                return True
+            _update(reschedule_repeat, schedule_id, sent_at=now, next_run_at=next_run_at)
+            if not sends:
+                return False  # missed runs skipped
+            await _limited(lambda: channel.send(f"Sent at <t:{now}:F>. Next at <t:{next_run_at}:F>."))
+            return True
         except Exception as e:
-            mark_failed(conn, schedule_id, error=str(e))
+            _update(mark_failed, schedule_id, error=str(e))
+            return False
+
+    by_channel: Dict[str, List[Dict[str, object]]] = {}
+    for row in claimed:  # claimed in run_at order
+        by_channel.setdefault(row["channel_id"], []).append(row)
+
+    async def _drain(rows: List[Dict[str, object]]) -> int:
+        sent = 0
+        for row in rows:
+            sent += await _deliver(row)
+            in_flight.discard(int(row["id"]))
+        return sent
 
+    renewer = asyncio.ensure_future(_renew())
+    try:
+        sent_count = sum(await asyncio.gather(*(_drain(rows) for rows in by_channel.values())))
+    finally:
+        renewer.cancel()
+
+    for result in await asyncio.gather(*updates, return_exceptions=True):
+        if isinstance(result, Exception):
+            print(f"[WARN] Failed to record schedule status: {result}")
     return sent_count
 
 
+class Scheduler:
+    """
+    Sleeps until the next pending schedule is due instead of polling.
+
+    Upcoming (run_at, id) pairs are kept in a min-heap; the loop sleeps until
+    the earliest one, then runs dispatch_due_messages. Creating, canceling or
+    rescheduling a schedule on `conn` updates the heap through a storage
+    listener and wakes the loop, so a schedule made for "in 1 minute" is not
+    missed and nothing touches the database while nothing is due. The heap is
+    rebuilt from the database every `resync_seconds` as a safety net (rows
+    written by another process, a missed notification).
+
+    Each wakeup claims every due row the heap knows of, in batches of
+    `min_batch_size`..`max_batch_size`, so a backlog drains in a few claims.
+    Rows another worker is sending sit in the heap at their lease expiry, so
+    they are reclaimed if that worker dies.
+    """
+
+    def __init__(
+        self,
+        bot: discord.Client,
+        conn,
+        *,
+        handlers: Optional[Dict[str, ScheduledHandler]] = None,
+        min_batch_size: int = MIN_BATCH_SIZE,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_concurrency: int = DEFAULT_DISPATCH_CONCURRENCY,
+        owner: Optional[str] = None,
+        lease_seconds: int = DEFAULT_LEASE_SECONDS,
+        resync_seconds: float = DEFAULT_RESYNC_SECONDS,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.bot = bot
+        self.conn = conn
+        self.handlers = handlers
+        self.min_batch_size = max(1, min_batch_size)
+        self.max_batch_size = max(self.min_batch_size, max_batch_size)
+        self.max_concurrency = max_concurrency
+        self.owner = owner or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.resync_seconds = resync_seconds
+        self.clock = clock
+
+        self._heap: List[Tuple[int, int]] = []
+        self._run_at: Dict[int, int] = {}  # id -> run_at; heap entries not matching it are stale
+        self._wake = asyncio.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    # -- heap --------------------------------------------------------
+
+    def _set(self, schedule_id: int, run_at: Optional[int]) -> None:
+        if run_at is None:
+            self._run_at.pop(schedule_id, None)
+        else:
+            self._run_at[schedule_id] = run_at
+            heapq.heappush(self._heap, (run_at, schedule_id))
+        self._wake.set()
+
+    def _on_change(self, conn, schedule_id: int, run_at: Optional[int]) -> None:
+        # Storage listeners fire on whichever thread committed (often the db pool).
+        if conn is not self.conn or self._loop is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._set, schedule_id, run_at)
+
+    def next_run_at(self) -> Optional[int]:
+        while self._heap:
+            run_at, schedule_id = self._heap[0]
+            if self._run_at.get(schedule_id) == run_at:
+                return run_at
+            heapq.heappop(self._heap)
+        return None
+
+    def _pop_due(self, now: int) -> int:
+        due = 0
+        while self.next_run_at() is not None and self._heap[0][0] <= now:
+            _, schedule_id = heapq.heappop(self._heap)
+            del self._run_at[schedule_id]
+            due += 1
+        return due
+
+    @property
+    def pending(self) -> int:
+        return len(self._run_at)
+
+    async def resync(self) -> None:
+        executors = getattr(self.bot, "executors", None)
+        rows = await call_db(executors, fetch_pending_run_times, self.conn)
+        self._run_at = dict(rows)
+        self._heap = [(run_at, schedule_id) for schedule_id, run_at in rows]
+        heapq.heapify(self._heap)
+
+    # -- loop --------------------------------------------------------
+
+    async def _dispatch(self, now: int) -> None:
+        # A reschedule_repeat during dispatch pushes the row back onto the heap.
+        remaining = self._pop_due(now)
+        while True:
+            batch_size = min(self.max_batch_size, max(self.min_batch_size, remaining))
+            await dispatch_due_messages(
+                self.bot,
+                self.conn,
+                now=now,
+                batch_size=batch_size,
+                handlers=self.handlers,
+                max_concurrency=self.max_concurrency,
+                owner=self.owner,
+                lease_seconds=self.lease_seconds,
+            )
+            remaining -= batch_size
+            if remaining <= 0:
+                return
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        add_schedule_listener(self._on_change)
+        try:
+            next_resync = 0.0
+            while not self.bot.is_closed():
+                now = self.clock()
+                if now >= next_resync:
+                    try:
+                        await self.resync()
+                    except Exception as e:
+                        print(f"[WARN] Scheduler resync failed: {e}")
+                    next_resync = now + self.resync_seconds
+
+                run_at = self.next_run_at()
+                if run_at is not None and run_at <= now:
+                    try:
+                        await self._dispatch(int(now))
+                    except Exception as e:
+                        print(f"[WARN] Scheduled dispatch failed: {e}")
+                    continue
+
+                timeout = next_resync - now
+                if run_at is not None:
+                    timeout = min(timeout, run_at - now)
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), max(0.0, timeout))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            remove_schedule_listener(self._on_change)
+            self._loop = None
+
+
 def start_scheduler_loop(
     bot: discord.Client,
     conn,
     *,
-    poll_interval_seconds: float = 5.0,
+    resync_seconds: float = DEFAULT_RESYNC_SECONDS,
     handlers: Optional[Dict[str, ScheduledHandler]] = None,
 ) -> asyncio.Task:
-    async def _loop():
-        while not bot.is_closed():
-            await dispatch_due_messages(bot, conn, handlers=handlers)
-            await asyncio.sleep(poll_interval_seconds)
-
-    return asyncio.create_task(_loop())
+    scheduler = Scheduler(bot, conn, handlers=handlers, resync_seconds=resync_seconds)
+    return asyncio.create_task(scheduler.run())
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, tzinfo
+from typing import List, Optional, Tuple
+
+from .time_utils import ScheduleTimeError
+
+
+REPEAT_INTERVALS = {
+    "minute": 60,
+    "hour": 60 * 60,
+    "day": 60 * 60 * 24,
+}
+
+# What a repeat schedule does about occurrences that passed while the bot was down:
+#   skip      - send only if the latest occurrence is at most MISSED_GRACE_SECONDS old
+#   fire_once - send once for all of them (the original behavior)
+#   fire_all  - send once per missed occurrence, at most FIRE_ALL_CAP times
+MISSED_POLICIES = ("skip", "fire_once", "fire_all")
+DEFAULT_MISSED_POLICY = "fire_once"
+MISSED_GRACE_SECONDS = 60
+FIRE_ALL_CAP = 10
+
+
+class Recurrence(ABC):
+    """Occurrence times of a repeat schedule, as unix epoch seconds."""
+
+    @abstractmethod
+    def next_after(self, ts: int) -> int:
+        """First occurrence strictly after `ts`."""
+
+    def count_between(self, start: int, end: int, cap: int) -> int:
+        """Occurrences in [start, end] (`start` being one), at most `cap`."""
+        if end < start:
+            return 0
+        count, ts = 1, start
+        while count < cap:
+            ts = self.next_after(ts)
+            if ts > end:
+                break
+            count += 1
+        return count
+
+
+class IntervalRecurrence(Recurrence):
+    """Every `seconds`, in phase with `anchor`."""
+
+    def __init__(self, anchor: int, seconds: int):
+        self.anchor = anchor
+        self.seconds = seconds
+
+    def next_after(self, ts: int) -> int:
+        steps = max(0, (ts - self.anchor) // self.seconds + 1)
+        return self.anchor + steps * self.seconds
+
+    def count_between(self, start: int, end: int, cap: int) -> int:
+        if end < start:
+            return 0
+        return min(cap, (end - start) // self.seconds + 1)
+
+
+# (name, low, high) of the five cron fields
+_CRON_FIELDS = (
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day of month", 1, 31),
+    ("month", 1, 12),
+    ("day of week", 0, 7),  # 0 and 7 are both Sunday
+)
+
+# Longest gap between two fires of a satisfiable expression (Feb 29 on a
+# given weekday can take 28 years); past this the expression never fires.
+_CRON_MAX_DAYS = 366 * 29
+
+
+def _parse_cron_field(text: str, name: str, low: int, high: int) -> List[int]:
+    values = set()
+    for part in text.split(","):
+        base, _, step_text = part.partition("/")
+        try:
+            step = int(step_text) if step_text else 1
+            if base == "*":
+                start, stop = low, high
+            elif "-" in base:
+                start_text, stop_text = base.split("-", 1)
+                start, stop = int(start_text), int(stop_text)
+            else:
+                start = int(base)
+                stop = high if step_text else start
+        except ValueError:
+            raise ScheduleTimeError(f"Invalid cron {name}: {part!r}") from None
+        if step < 1 or not low <= start <= stop <= high:
+            raise ScheduleTimeError(f"Cron {name} out of range ({low}-{high}): {part!r}")
+        values.update(range(start, stop + 1, step))
+    return sorted(values)
+
+
+class CronExpression(Recurrence):
+    """
+    Standard five-field cron expression (`minute hour day-of-month month
+    day-of-week`) with `*`, lists, ranges and `/step`, evaluated in the bot's
+    local timezone (or `tz`). As in cron, when both day fields are restricted
+    a day matching either one fires.
+    """
+
+    def __init__(self, text: str, tz: Optional[tzinfo] = None):
+        fields = text.split()
+        if len(fields) != 5:
+            raise ScheduleTimeError("Cron expressions have 5 fields: minute hour day month weekday")
+        self.text = " ".join(fields)
+        self.tz = tz
+        parsed = [_parse_cron_field(f, *spec) for f, spec in zip(fields, _CRON_FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = {d % 7 for d in weekdays}  # cron Sunday=0, Python Sunday=6
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    def _day_matches(self, day: datetime) -> bool:
+        if day.month not in self.months:
+            return False
+        dom = day.day in self.days
+        dow = (day.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return dom and dow
+        return dom or dow
+
+    def next_after(self, ts: int) -> int:
+        start = datetime.fromtimestamp(ts, self.tz).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.replace(hour=0, minute=0)
+        for _ in range(_CRON_MAX_DAYS):
+            if self._day_matches(day):
+                first_day = day.date() == start.date()
+                for hour in self.hours:
+                    if first_day and hour < start.hour:
+                        continue
+                    for minute in self.minutes:
+                        if first_day and hour == start.hour and minute < start.minute:
+                            continue
+                        return int(day.replace(hour=hour, minute=minute).timestamp())
+            day += timedelta(days=1)
+        raise ScheduleTimeError(f"Cron expression never fires: {self.text}")
+
+
+def recurrence_for(
+    *,
+    run_at: int,
+    repeat_interval: Optional[str] = None,
+    cron: Optional[str] = None,
+    tz: Optional[tzinfo] = None,
+) -> Optional[Recurrence]:
+    """Recurrence of a schedule row, or None for a one-shot schedule."""
+    if cron:
+        return CronExpression(cron, tz)
+    if repeat_interval:
+        seconds = REPEAT_INTERVALS.get(repeat_interval)
+        if seconds is None:
+            raise ScheduleTimeError(f"Unsupported repeat interval: {repeat_interval}")
+        return IntervalRecurrence(run_at, seconds)
+    return None
+
+
+def plan_catch_up(
+    recurrence: Recurrence,
+    *,
+    run_at: int,
+    now: int,
+    policy: Optional[str] = None,
+    cap: int = FIRE_ALL_CAP,
+    grace: int = MISSED_GRACE_SECONDS,
+) -> Tuple[int, int]:
+    """
+    (sends, next_run_at) for a repeat schedule due at `run_at` and handled at
+    `now`: how many times to send under missed-run `policy`, and its next
+    occurrence after `now`. Neither walks the missed occurrences one by one
+    (fire_all counts at most `cap` of them).
+    """
+    policy = policy or DEFAULT_MISSED_POLICY
+    if policy not in MISSED_POLICIES:
+        raise ScheduleTimeError(f"Unsupported missed-run policy: {policy}")
+
+    if policy == "fire_all":
+        sends = max(1, recurrence.count_between(run_at, now, cap))
+    elif policy == "skip":
+        # Is there an occurrence within the grace period (the current one, on time)?
+        window_start = max(run_at, now - grace)
+        on_time = window_start == run_at or recurrence.next_after(window_start - 1) <= now
+        sends = 1 if on_time else 0
+    else:
+        sends = 1
+    return sends, recurrence.next_after(now)
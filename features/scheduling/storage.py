@@ -1,5 +1,11 @@
+import os
+import socket
 import sqlite3
-from typing import Any, Dict, Iterable, List, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from db import after_commit, ensure_column, reader, transaction, writer
+
+from .recurrence import DEFAULT_MISSED_POLICY
 
 
 SCHEMA = """
@@ -10,49 +16,181 @@ CREATE TABLE IF NOT EXISTS scheduled_messages (
     content     TEXT NOT NULL,
     run_at      INTEGER NOT NULL, -- unix epoch seconds
     repeat_interval TEXT, -- NULL | minute | hour | day
+    cron        TEXT, -- NULL | five-field cron expression (run_at is its next fire time)
+    missed_policy TEXT NOT NULL DEFAULT 'fire_once', -- skip | fire_once | fire_all (repeats only)
     created_by  TEXT,
     status      TEXT NOT NULL DEFAULT 'pending', -- pending | sending | sent | canceled | failed
     error       TEXT,
     created_at  INTEGER NOT NULL DEFAULT (CAST(strftime('%s','now') AS INTEGER)),
-    sent_at     INTEGER
+    sent_at     INTEGER,
+    lease_owner TEXT, -- worker holding a 'sending' row
+    lease_expires_at INTEGER, -- after this a 'sending' row may be reclaimed
+    finished_at INTEGER -- when it became sent / failed / canceled
+);
+
+-- Finished schedules, moved out of scheduled_messages by archive_finished_messages.
+CREATE TABLE IF NOT EXISTS scheduled_messages_archive (
+    id          INTEGER PRIMARY KEY,
+    channel_id  TEXT NOT NULL,
+    kind        TEXT NOT NULL,
+    content     TEXT NOT NULL,
+    run_at      INTEGER NOT NULL,
+    repeat_interval TEXT,
+    cron        TEXT,
+    missed_policy TEXT NOT NULL,
+    created_by  TEXT,
+    status      TEXT NOT NULL,
+    error       TEXT,
+    created_at  INTEGER NOT NULL,
+    sent_at     INTEGER,
+    finished_at INTEGER,
+    archived_at INTEGER NOT NULL
 );
 
-CREATE INDEX IF NOT EXISTS idx_scheduled_messages_status_run_at
-    ON scheduled_messages(status, run_at);
+CREATE INDEX IF NOT EXISTS idx_scheduled_messages_archive_finished_at
+    ON scheduled_messages_archive(finished_at);
+"""
+
+# Created after the column upgrades in init_scheduler_db. Partial indexes keep
+# the dispatcher's lookups proportional to the live (pending / sending) rows,
+# however many finished rows are waiting to be archived.
+INDEXES = """
+DROP INDEX IF EXISTS idx_scheduled_messages_status_run_at;
+
+CREATE INDEX IF NOT EXISTS idx_scheduled_messages_pending_run_at
+    ON scheduled_messages(run_at) WHERE status = 'pending';
+
+CREATE INDEX IF NOT EXISTS idx_scheduled_messages_pending_channel
+    ON scheduled_messages(channel_id, run_at) WHERE status = 'pending';
+
+CREATE INDEX IF NOT EXISTS idx_scheduled_messages_sending_lease
+    ON scheduled_messages(lease_expires_at) WHERE status = 'sending';
+
+CREATE INDEX IF NOT EXISTS idx_scheduled_messages_finished_at
+    ON scheduled_messages(finished_at) WHERE status IN ('sent', 'failed', 'canceled');
 """
 
+FINISHED_STATUSES = ("sent", "failed", "canceled")
+
+
+# A claimed row stays 'sending' for this long unless its worker renews the lease;
+# after that any worker may claim it again (so delivery is at-least-once).
+DEFAULT_LEASE_SECONDS = 120
+
+_COLUMNS = (
+    "id, channel_id, kind, content, run_at, repeat_interval, cron, missed_policy,"
+    " created_by, status, error, created_at, sent_at"
+)
+
+
+def default_worker_id() -> str:
+    """Lease owner id for this process."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def init_scheduler_db(conn) -> None:
+    with writer(conn) as db:
+        db.executescript(SCHEMA)
+        ensure_column(db, table="scheduled_messages", column="kind", ddl="TEXT NOT NULL DEFAULT 'text'")
+        ensure_column(db, table="scheduled_messages", column="repeat_interval", ddl="TEXT")
+        ensure_column(db, table="scheduled_messages", column="cron", ddl="TEXT")
+        ensure_column(
+            db,
+            table="scheduled_messages",
+            column="missed_policy",
+            ddl=f"TEXT NOT NULL DEFAULT '{DEFAULT_MISSED_POLICY}'",
+        )
+        ensure_column(db, table="scheduled_messages", column="lease_owner", ddl="TEXT")
+        ensure_column(db, table="scheduled_messages", column="lease_expires_at", ddl="INTEGER")
+        ensure_column(db, table="scheduled_messages", column="finished_at", ddl="INTEGER")
+        db.execute(
+            """
+            UPDATE scheduled_messages SET finished_at = COALESCE(sent_at, created_at)
+            WHERE finished_at IS NULL AND status IN ('sent', 'failed', 'canceled')
+            """
+        )
+        db.executescript(INDEXES)
+        db.commit()
+
+
+# ------------------------------------------------------------------
+# Change listeners
+# ------------------------------------------------------------------
 
-def init_scheduler_db(conn: sqlite3.Connection) -> None:
-    conn.executescript(SCHEMA)
-    _ensure_column(conn, table="scheduled_messages", column="kind", ddl="TEXT NOT NULL DEFAULT 'text'")
-    _ensure_column(conn, table="scheduled_messages", column="repeat_interval", ddl="TEXT")
-    conn.commit()
+# Called as listener(conn, schedule_id, run_at) after a schedule becomes pending
+# at run_at, or with run_at=None once it is done (sent, failed or canceled). Lets
+# the dispatcher's in-memory queue (see dispatcher.Scheduler) wake up on time.
+# May be called from any thread.
+ScheduleListener = Callable[[Any, int, Optional[int]], None]
+
+_schedule_listeners: List[ScheduleListener] = []
+
+
+def add_schedule_listener(listener: ScheduleListener) -> None:
+    if listener not in _schedule_listeners:
+        _schedule_listeners.append(listener)
+
+
+def remove_schedule_listener(listener: ScheduleListener) -> None:
+    if listener in _schedule_listeners:
+        _schedule_listeners.remove(listener)
+
+
+def _notify_schedule(conn, schedule_id: int, run_at: Optional[int]) -> None:
+    for listener in list(_schedule_listeners):
+        try:
+            listener(conn, schedule_id, run_at)
+        except Exception as e:
+            print(f"[WARN] Schedule listener failed: {e}")
 
 
 def create_scheduled_message(
-    conn: sqlite3.Connection,
+    conn,
     *,
     channel_id: str,
     kind: str = "text",
     content: str,
     run_at: int,
     repeat_interval: Optional[str] = None,
+    cron: Optional[str] = None,
+    missed_policy: str = DEFAULT_MISSED_POLICY,
     created_by: Optional[str],
 ) -> int:
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO scheduled_messages (channel_id, kind, content, run_at, repeat_interval, created_by)
-        VALUES (?, ?, ?, ?, ?, ?)
-        """,
-        (channel_id, kind, content, run_at, repeat_interval, created_by),
-    )
-    conn.commit()
-    return int(cur.lastrowid)
+    with transaction(conn) as db:
+        cur = db.cursor()
+        cur.execute(
+            """
+            INSERT INTO scheduled_messages
+                (channel_id, kind, content, run_at, repeat_interval, cron, missed_policy, created_by)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (channel_id, kind, content, run_at, repeat_interval, cron, missed_policy, created_by),
+        )
+        schedule_id = int(cur.lastrowid)
+        after_commit(db, lambda: _notify_schedule(conn, schedule_id, run_at))
+        return schedule_id
+
+
+def fetch_pending_run_times(conn) -> List[Tuple[int, int]]:
+    """
+    (id, due_at) of every schedule a worker may claim at due_at: pending rows
+    at their run_at, 'sending' rows when their lease expires.
+    """
+    with reader(conn) as db:
+        return [
+            (int(r[0]), int(r[1]))
+            for r in db.execute(
+                """
+                SELECT id, run_at FROM scheduled_messages WHERE status = 'pending'
+                UNION ALL
+                SELECT id, COALESCE(lease_expires_at, 0) FROM scheduled_messages WHERE status = 'sending'
+                """
+            )
+        ]
 
 
 def list_scheduled_messages(
-    conn: sqlite3.Connection,
+    conn,
     *,
     channel_id: Optional[str] = None,
     created_by: Optional[str] = None,
@@ -73,23 +211,24 @@ def list_scheduled_messages(
 
     where_sql = ("WHERE " + " AND ".join(where)) if where else ""
 
-    cur = conn.cursor()
-    cur.execute(
-        f"""
-        SELECT id, channel_id, kind, content, run_at, repeat_interval, created_by, status, error, created_at, sent_at
-        FROM scheduled_messages
-        {where_sql}
-        ORDER BY run_at ASC
-        LIMIT ?
-        """,
-        (*params, limit),
-    )
-    rows = cur.fetchall()
-    return [_row_to_dict(cur, row) for row in rows]
+    with reader(conn) as db:
+        cur = db.cursor()
+        cur.execute(
+            f"""
+            SELECT {_COLUMNS}
+            FROM scheduled_messages
+            {where_sql}
+            ORDER BY run_at ASC
+            LIMIT ?
+            """,
+            (*params, limit),
+        )
+        rows = cur.fetchall()
+        return [_row_to_dict(cur, row) for row in rows]
 
 
 def cancel_scheduled_message(
-    conn: sqlite3.Connection,
+    conn,
     *,
     schedule_id: int,
     requester_id: Optional[str] = None,
@@ -98,134 +237,233 @@ def cancel_scheduled_message(
     Cancel a scheduled message if it's still pending.
     If requester_id is provided, only cancel if created_by matches.
     """
-    cur = conn.cursor()
-    if requester_id is None:
+    with transaction(conn) as db:
+        cur = db.cursor()
+        if requester_id is None:
+            cur.execute(
+                """
+                UPDATE scheduled_messages
+                SET status = 'canceled', finished_at = CAST(strftime('%s','now') AS INTEGER)
+                WHERE id = ? AND status = 'pending'
+                """,
+                (schedule_id,),
+            )
+        else:
+            cur.execute(
+                """
+                UPDATE scheduled_messages
+                SET status = 'canceled', finished_at = CAST(strftime('%s','now') AS INTEGER)
+                WHERE id = ? AND status = 'pending' AND created_by = ?
+                """,
+                (schedule_id, requester_id),
+            )
+        if cur.rowcount <= 0:
+            return False
+        after_commit(db, lambda: _notify_schedule(conn, schedule_id, None))
+        return True
+
+
+def claim_due_messages(
+    conn,
+    *,
+    now: int,
+    limit: int = 10,
+    owner: Optional[str] = None,
+    lease_seconds: int = DEFAULT_LEASE_SECONDS,
+) -> List[Dict[str, Any]]:
+    """
+    Atomically claim due messages for `owner` (default: this process): due
+    'pending' rows, and 'sending' rows whose lease has expired (their worker
+    died mid-send), become 'sending' leased until now + lease_seconds.
+    Returns the claimed rows.
+    """
+    owner = owner or default_worker_id()
+    with writer(conn) as db:
+        cur = db.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        # Two index-backed lookups rather than one OR, which would scan the table.
         cur.execute(
             """
-            UPDATE scheduled_messages
-            SET status = 'canceled'
-            WHERE id = ? AND status = 'pending'
+            SELECT id FROM (
+                SELECT id, run_at FROM scheduled_messages
+                WHERE status = 'pending' AND run_at <= ?
+                UNION ALL
+                SELECT id, run_at FROM scheduled_messages
+                WHERE status = 'sending' AND (lease_expires_at IS NULL OR lease_expires_at <= ?)
+            )
+            ORDER BY run_at ASC
+            LIMIT ?
             """,
-            (schedule_id,),
+            (now, now, limit),
         )
-    else:
+        ids = [int(r[0]) for r in cur.fetchall()]
+        if not ids:
+            db.commit()
+            return []
+
+        placeholders = ",".join("?" for _ in ids)
         cur.execute(
-            """
+            f"""
             UPDATE scheduled_messages
-            SET status = 'canceled'
-            WHERE id = ? AND status = 'pending' AND created_by = ?
+            SET status = 'sending', lease_owner = ?, lease_expires_at = ?
+            WHERE id IN ({placeholders})
             """,
-            (schedule_id, requester_id),
+            (owner, now + lease_seconds, *ids),
         )
-    conn.commit()
-    return cur.rowcount > 0
 
+        cur.execute(
+            f"""
+            SELECT {_COLUMNS}
+            FROM scheduled_messages
+            WHERE id IN ({placeholders})
+            ORDER BY run_at ASC
+            """,
+            ids,
+        )
+        rows = cur.fetchall()
+        db.commit()
+        return [_row_to_dict(cur, row) for row in rows]
 
-def claim_due_messages(
-    conn: sqlite3.Connection,
+
+def renew_leases(
+    conn,
+    schedule_ids: Iterable[int],
     *,
+    owner: Optional[str] = None,
     now: int,
-    limit: int = 10,
-) -> List[Dict[str, Any]]:
-    """
-    Atomically claim due messages by moving them from 'pending' -> 'sending'.
-    Returns the claimed rows.
-    """
-    cur = conn.cursor()
-    cur.execute("BEGIN IMMEDIATE")
-    cur.execute(
-        """
-        SELECT id
-        FROM scheduled_messages
-        WHERE status = 'pending' AND run_at <= ?
-        ORDER BY run_at ASC
-        LIMIT ?
-        """,
-        (now, limit),
-    )
-    ids = [int(r[0]) for r in cur.fetchall()]
+    lease_seconds: int = DEFAULT_LEASE_SECONDS,
+) -> int:
+    """Extend `owner`'s leases on `schedule_ids`; returns how many it still held."""
+    ids = list(schedule_ids)
     if not ids:
-        conn.commit()
-        return []
-
+        return 0
     placeholders = ",".join("?" for _ in ids)
-    cur.execute(
-        f"""
-        UPDATE scheduled_messages
-        SET status = 'sending'
-        WHERE id IN ({placeholders}) AND status = 'pending'
-        """,
-        ids,
-    )
-
-    cur.execute(
-        f"""
-        SELECT id, channel_id, kind, content, run_at, repeat_interval, created_by, status, error, created_at, sent_at
-        FROM scheduled_messages
-        WHERE id IN ({placeholders})
-        ORDER BY run_at ASC
-        """,
-        ids,
-    )
-    rows = cur.fetchall()
-    conn.commit()
-    return [_row_to_dict(cur, row) for row in rows]
-
-
-def mark_sent(conn: sqlite3.Connection, schedule_id: int, *, sent_at: int) -> None:
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE scheduled_messages
-        SET status = 'sent', sent_at = ?
-        WHERE id = ? AND status = 'sending'
-        """,
-        (sent_at, schedule_id),
-    )
-    conn.commit()
+    with transaction(conn) as db:
+        cur = db.execute(
+            f"""
+            UPDATE scheduled_messages
+            SET lease_expires_at = ?
+            WHERE id IN ({placeholders}) AND status = 'sending' AND lease_owner = ?
+            """,
+            (now + lease_seconds, *ids, owner or default_worker_id()),
+        )
+        return cur.rowcount
+
+
+# Completing a claim releases its lease. Given an `owner`, the update only
+# applies while that worker still holds the lease, so a worker that stalled
+# past its lease cannot overwrite the outcome of the worker that reclaimed it.
+
+def _lease_guard(owner: Optional[str]) -> Tuple[str, tuple]:
+    return (" AND lease_owner = ?", (owner,)) if owner is not None else ("", ())
+
+
+def mark_sent(conn, schedule_id: int, *, sent_at: int, owner: Optional[str] = None) -> None:
+    guard, guard_params = _lease_guard(owner)
+    with transaction(conn) as db:
+        cur = db.execute(
+            f"""
+            UPDATE scheduled_messages
+            SET status = 'sent', sent_at = ?, finished_at = ?, lease_owner = NULL, lease_expires_at = NULL
+            WHERE id = ? AND status = 'sending'{guard}
+            """,
+            (sent_at, sent_at, schedule_id, *guard_params),
+        )
+        if cur.rowcount > 0:
+            after_commit(db, lambda: _notify_schedule(conn, schedule_id, None))
 
 
 def reschedule_repeat(
-    conn: sqlite3.Connection,
+    conn,
     schedule_id: int,
     *,
     sent_at: int,
     next_run_at: int,
+    owner: Optional[str] = None,
 ) -> None:
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE scheduled_messages
-        SET status = 'pending', run_at = ?, sent_at = ?, error = NULL
-        WHERE id = ? AND status = 'sending'
-        """,
-        (next_run_at, sent_at, schedule_id),
-    )
-    conn.commit()
-
-
-def mark_failed(conn: sqlite3.Connection, schedule_id: int, *, error: str) -> None:
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE scheduled_messages
-        SET status = 'failed', error = ?
-        WHERE id = ? AND status = 'sending'
-        """,
-        (error, schedule_id),
-    )
-    conn.commit()
+    guard, guard_params = _lease_guard(owner)
+    with transaction(conn) as db:
+        cur = db.execute(
+            f"""
+            UPDATE scheduled_messages
+            SET status = 'pending', run_at = ?, sent_at = ?, error = NULL,
+                lease_owner = NULL, lease_expires_at = NULL
+            WHERE id = ? AND status = 'sending'{guard}
+            """,
+            (next_run_at, sent_at, schedule_id, *guard_params),
+        )
+        if cur.rowcount > 0:
+            after_commit(db, lambda: _notify_schedule(conn, schedule_id, next_run_at))
+
+
+def mark_failed(conn, schedule_id: int, *, error: str, owner: Optional[str] = None) -> None:
+    guard, guard_params = _lease_guard(owner)
+    with transaction(conn) as db:
+        cur = db.execute(
+            f"""
+            UPDATE scheduled_messages
+            SET status = 'failed', error = ?, finished_at = CAST(strftime('%s','now') AS INTEGER),
+                lease_owner = NULL, lease_expires_at = NULL
+            WHERE id = ? AND status = 'sending'{guard}
+            """,
+            (error, schedule_id, *guard_params),
+        )
+        if cur.rowcount > 0:
+            after_commit(db, lambda: _notify_schedule(conn, schedule_id, None))
+
+
+# ------------------------------------------------------------------
+# Archival
+# ------------------------------------------------------------------
+
+_ARCHIVED_COLUMNS = _COLUMNS + ", finished_at"
+
+
+def archive_finished_messages(conn, *, finished_before: int, now: int, limit: int = 500) -> int:
+    """
+    Move up to `limit` schedules that finished before `finished_before` into
+    scheduled_messages_archive. Returns how many were moved.
+    """
+    with transaction(conn) as db:
+        ids = [
+            r[0]
+            for r in db.execute(
+                """
+                SELECT id FROM scheduled_messages
+                WHERE status IN ('sent', 'failed', 'canceled') AND finished_at < ?
+                LIMIT ?
+                """,
+                (finished_before, limit),
+            )
+        ]
+        if not ids:
+            return 0
+        placeholders = ",".join("?" for _ in ids)
+        db.execute(
+            f"""
+            INSERT OR REPLACE INTO scheduled_messages_archive ({_ARCHIVED_COLUMNS}, archived_at)
+            SELECT {_ARCHIVED_COLUMNS}, ? FROM scheduled_messages WHERE id IN ({placeholders})
+            """,
+            (now, *ids),
+        )
+        db.execute(f"DELETE FROM scheduled_messages WHERE id IN ({placeholders})", ids)
+        return len(ids)
+
+
+def purge_archived_messages(conn, *, finished_before: int, limit: int = 500) -> int:
+    """Delete up to `limit` archived schedules that finished before `finished_before`."""
+    with transaction(conn) as db:
+        cur = db.execute(
+            """
+            DELETE FROM scheduled_messages_archive WHERE id IN (
+                SELECT id FROM scheduled_messages_archive WHERE finished_at < ? LIMIT ?
+            )
+            """,
+            (finished_before, limit),
+        )
+        return cur.rowcount
 
 
 def _row_to_dict(cur: sqlite3.Cursor, row: Iterable[Any]) -> Dict[str, Any]:
     col_names = [desc[0] for desc in cur.description]
     return {col: row[idx] for idx, col in enumerate(col_names)}
-
-
-def _ensure_column(conn: sqlite3.Connection, *, table: str, column: str, ddl: str) -> None:
-    cur = conn.cursor()
-    cur.execute(f"PRAGMA table_info({table})")
-    existing = {r[1] for r in cur.fetchall()}
-    if column in existing:
-        return
-    cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
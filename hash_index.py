@@ -0,0 +1,297 @@
+# hash_index.py
+from typing import Dict, List, Optional, Tuple
+
+from storage import (
+    add_insert_listener,
+    fetch_hash_bands,
+    fetch_image_hashes,
+    fetch_images_without_bands,
+    save_hash_bands,
+)
+
+DUPLICATE_HASH_DISTANCE = 6  # max Hamming distance (of 64 bits) treated as a repost
+
+HASH_KINDS = ("phash", "dhash", "whash")
+BANDS = 4  # bands per 64-bit hash
+BAND_BITS = 16
+SIMILAR_MAX_DISTANCE = 20  # max mean Hamming distance per hash kind for /img_like
+
+
+def parse_hash(image_hash: Optional[str]) -> Optional[int]:
+    """64-bit int from a hex phash string, or None for placeholders/garbage."""
+    if not image_hash or len(image_hash) != 16:
+        return None
+    try:
+        return int(image_hash, 16)
+    except ValueError:
+        return None
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _flip_variants(value: int, bits: int, max_flips: int):
+    """`value` and every value within `max_flips` bit flips of it (over `bits` bits)."""
+    variants = [value]
+    frontier = [(value, -1)]
+    for _ in range(max_flips):
+        next_frontier = []
+        for v, last in frontier:
+            for b in range(last + 1, bits):
+                flipped = v ^ (1 << b)
+                variants.append(flipped)
+                next_frontier.append((flipped, b))
+        frontier = next_frontier
+    return variants
+
+
+class MultiIndexHash:
+    """
+    Multi-index hashing over 64-bit hashes under Hamming distance.
+
+    Each hash is split into CHUNKS 16-bit chunks, each with its own exact-match
+    table. By pigeonhole, two hashes within distance r agree to within r // CHUNKS
+    bits on at least one chunk, so a query only probes the few bucket keys near
+    its own chunks and verifies those candidates, instead of scanning every hash.
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = 16
+
+    __slots__ = ("_tables", "_values", "_size")
+
+    def __init__(self):
+        self._tables: List[Dict[int, List[int]]] = [{} for _ in range(self.CHUNKS)]
+        self._values: Dict[int, int] = {}  # item id -> hash
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _chunks(self, value: int) -> List[int]:
+        mask = (1 << self.CHUNK_BITS) - 1
+        return [(value >> (i * self.CHUNK_BITS)) & mask for i in range(self.CHUNKS)]
+
+    def add(self, value: int, item_id: int) -> None:
+        self._size += 1
+        self._values[item_id] = value
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            table.setdefault(chunk, []).append(item_id)
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, int]]:
+        """All (distance, id) within `max_distance`, closest first."""
+        chunk_radius = max_distance // self.CHUNKS
+        seen = set()
+        found = []
+        for table, chunk in zip(self._tables, self._chunks(value)):
+            for key in _flip_variants(chunk, self.CHUNK_BITS, chunk_radius):
+                for item_id in table.get(key, ()):
+                    if item_id in seen:
+                        continue
+                    seen.add(item_id)
+                    d = hamming(value, self._values[item_id])
+                    if d <= max_distance:
+                        found.append((d, item_id))
+
+        found.sort()
+        return found
+
+
+class NearDuplicateIndex:
+    """Resident multi-index hash of every stored image's phash, for near-duplicate lookups."""
+
+    def __init__(self, conn=None):
+        self.conn = conn
+        self.hashes = MultiIndexHash()
+
+    @classmethod
+    def load(cls, conn) -> "NearDuplicateIndex":
+        index = cls(conn)
+        for img_id, image_hash in fetch_image_hashes(conn):
+            index.add(img_id, image_hash)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    def add(self, img_id: int, image_hash: Optional[str]) -> None:
+        value = parse_hash(image_hash)
+        if value is not None:
+            self.hashes.add(value, img_id)
+
+    def nearest(self, image_hash: Optional[str], max_distance: int) -> Optional[int]:
+        """Id of the closest stored image within `max_distance`, or None."""
+        value = parse_hash(image_hash)
+        if value is None:
+            return None
+        matches = self.hashes.search(value, max_distance)
+        return matches[0][1] if matches else None
+
+
+def row_hashes(row) -> Dict[str, Optional[str]]:
+    """Hash strings of an images row, keyed by kind (phash lives in image_hash)."""
+    return {
+        "phash": row.get("image_hash"),
+        "dhash": row.get("dhash"),
+        "whash": row.get("whash"),
+    }
+
+
+def hash_bands(hashes: Dict[str, Optional[str]]) -> List[Tuple[str, int, int]]:
+    """(kind, band, value) for every valid hash: each 64-bit hash cut into BANDS slices."""
+    mask = (1 << BAND_BITS) - 1
+    bands = []
+    for kind in HASH_KINDS:
+        value = parse_hash(hashes.get(kind))
+        if value is None:
+            continue
+        for band in range(BANDS):
+            bands.append((kind, band, (value >> (band * BAND_BITS)) & mask))
+    return bands
+
+
+class BandIndex:
+    """
+    Locality-sensitive banding index for reverse image search.
+
+    Every phash/dhash/whash is cut into BANDS bands; images sharing any band
+    value with the query become candidates, which are then ranked by their mean
+    Hamming distance over the hash kinds both sides have. The bands are
+    persisted in `image_hash_bands`, so startup only reads them back.
+    """
+
+    def __init__(self, conn=None):
+        self.conn = conn
+        self._buckets: Dict[Tuple[str, int, int], List[int]] = {}
+        self._hashes: Dict[int, Dict[str, int]] = {}  # image id -> {kind: 64-bit hash}
+
+    @classmethod
+    def load(cls, conn) -> "BandIndex":
+        index = cls(conn)
+        for image_id, kind, band, value in fetch_hash_bands(conn):
+            index._add_band(image_id, kind, band, value)
+            parts = index._hashes.setdefault(image_id, {})
+            parts[kind] = parts.get(kind, 0) | (value << (band * BAND_BITS))
+
+        # Backfill rows stored before banding existed (phash only for old rows).
+        for image_id, phash, dhash, whash in fetch_images_without_bands(conn):
+            hashes = {"phash": phash, "dhash": dhash, "whash": whash}
+            bands = hash_bands(hashes)
+            if bands:
+                save_hash_bands(conn, image_id, bands)
+                index.add(image_id, hashes)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def _add_band(self, image_id: int, kind: str, band: int, value: int) -> None:
+        self._buckets.setdefault((kind, band, value), []).append(image_id)
+
+    def add(self, image_id: int, hashes: Dict[str, Optional[str]]) -> None:
+        bands = hash_bands(hashes)
+        if not bands:
+            return
+        for kind, band, value in bands:
+            self._add_band(image_id, kind, band, value)
+        self._hashes[image_id] = {
+            kind: parse_hash(hashes.get(kind))
+            for kind in HASH_KINDS
+            if parse_hash(hashes.get(kind)) is not None
+        }
+
+    def query(
+        self,
+        hashes: Dict[str, Optional[str]],
+        limit: int = 10,
+        max_distance: float = SIMILAR_MAX_DISTANCE,
+    ) -> List[Tuple[float, int]]:
+        """(mean distance, image id) of the closest images, best first."""
+        query_values = {kind: parse_hash(hashes.get(kind)) for kind in HASH_KINDS}
+        query_values = {k: v for k, v in query_values.items() if v is not None}
+
+        candidates = set()
+        for key in hash_bands(hashes):
+            candidates.update(self._buckets.get(key, ()))
+
+        scored = []
+        for image_id in candidates:
+            stored = self._hashes.get(image_id, {})
+            shared = [kind for kind in query_values if kind in stored]
+            if not shared:
+                continue
+            distance = sum(hamming(query_values[k], stored[k]) for k in shared) / len(shared)
+            if distance <= max_distance:
+                scored.append((distance, image_id))
+
+        scored.sort()
+        return scored[:limit]
+
+
+# Same per-connection registry as search.py.
+_indexes: Dict[int, NearDuplicateIndex] = {}
+_band_indexes: Dict[int, BandIndex] = {}
+_max_distance = DUPLICATE_HASH_DISTANCE
+
+
+def set_duplicate_distance(max_distance: int) -> None:
+    global _max_distance
+    _max_distance = max_distance
+
+
+def get_duplicate_distance() -> int:
+    return _max_distance
+
+
+def load_hash_index(conn) -> NearDuplicateIndex:
+    """(Re)build the resident phash index for `conn`. Call once at startup."""
+    index = NearDuplicateIndex.load(conn)
+    _indexes[id(conn)] = index
+    return index
+
+
+def get_hash_index(conn) -> NearDuplicateIndex:
+    index = _indexes.get(id(conn))
+    if index is None or index.conn is not conn:
+        index = load_hash_index(conn)
+    return index
+
+
+def find_near_duplicate(conn, image_hash: Optional[str], max_distance: Optional[int] = None) -> Optional[int]:
+    if max_distance is None:
+        max_distance = _max_distance
+    if max_distance <= 0:
+        return None
+    return get_hash_index(conn).nearest(image_hash, max_distance)
+
+
+def load_band_index(conn) -> BandIndex:
+    """(Re)build the resident band index for `conn`. Call once at startup."""
+    index = BandIndex.load(conn)
+    _band_indexes[id(conn)] = index
+    return index
+
+
+def get_band_index(conn) -> BandIndex:
+    index = _band_indexes.get(id(conn))
+    if index is None or index.conn is not conn:
+        index = load_band_index(conn)
+    return index
+
+
+def find_similar(conn, hashes: Dict[str, Optional[str]], limit: int = 10) -> List[Tuple[float, int]]:
+    return get_band_index(conn).query(hashes, limit=limit)
+
+
+def _on_image_inserted(conn, row) -> None:
+    index = _indexes.get(id(conn))
+    if index is not None and index.conn is conn:
+        index.add(row["id"], row.get("image_hash"))
+
+    bands = _band_indexes.get(id(conn))
+    if bands is not None and bands.conn is conn:
+        bands.add(row["id"], row_hashes(row))
+
+
+add_insert_listener(_on_image_inserted)
@@ -0,0 +1,165 @@
+# image_store.py
+"""
+Content-addressed image files.
+
+Files are named by the SHA-256 of their bytes and sharded two levels deep,
+`ab/cd/abcd….png`, so no directory grows past a few hundred entries and
+identical bytes are stored once. The DB keeps the path relative to the store
+root; `resolve_image_path` turns any stored file_path back into a real path.
+
+Run as a script to move images saved under the old flat layout
+(`IMAGE_FOLDER/{message_id}_{filename}` plus `.txt` OCR sidecars) into the
+store:  python image_store.py
+"""
+import hashlib
+import os
+import re
+import tempfile
+from typing import Optional, Tuple
+
+
+DEFAULT_EXTENSION = ".png"
+
+# Originals are <sha256>.<ext>; send derivatives (derivatives.py) sit next to them.
+_STORE_PATH = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.send)?\.[a-z0-9]{1,5}$")
+_EXTENSION = re.compile(r"^\.[a-z0-9]{1,5}$")
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def normalize_extension(filename: Optional[str]) -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext == ".jpeg":
+        ext = ".jpg"
+    return ext if _EXTENSION.match(ext) else DEFAULT_EXTENSION
+
+
+def is_store_path(file_path: str) -> bool:
+    return bool(_STORE_PATH.match(file_path.replace(os.sep, "/")))
+
+
+class ImageStore:
+    """Sharded, content-addressed files under `root`."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path_for(self, data: bytes, filename: Optional[str] = None) -> str:
+        """Store-relative path (`ab/cd/<sha256><ext>`) for `data`."""
+        digest = content_hash(data)
+        return f"{digest[:2]}/{digest[2:4]}/{digest}{normalize_extension(filename)}"
+
+    def resolve(self, file_path: str) -> str:
+        """
+        Real path of a stored file_path. Absolute paths are returned as-is;
+        store paths are joined to the root; anything else is a pre-store flat
+        file, looked up by basename in the root like the bot always did.
+        """
+        if os.path.isabs(file_path):
+            return file_path
+        if is_store_path(file_path):
+            return os.path.join(self.root, *file_path.split("/"))
+        return os.path.join(self.root, os.path.basename(file_path))
+
+    def write(self, file_path: str, data: bytes) -> None:
+        """Write `data` at store path `file_path` unless those bytes are already there."""
+        path = self.resolve(file_path)
+        if os.path.exists(path):
+            return
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Write-then-rename, so readers never see a half-written file.
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def put(self, data: bytes, filename: Optional[str] = None) -> str:
+        file_path = self.path_for(data, filename)
+        self.write(file_path, data)
+        return file_path
+
+    def remove(self, file_path: str) -> None:
+        try:
+            os.remove(self.resolve(file_path))
+        except FileNotFoundError:
+            pass
+
+
+# Store used to resolve paths when sending; set from IMAGE_FOLDER at startup.
+_store: Optional[ImageStore] = None
+
+
+def set_image_store(store: Optional[ImageStore]) -> None:
+    global _store
+    _store = store
+
+
+def get_image_store() -> Optional[ImageStore]:
+    return _store
+
+
+def resolve_image_path(file_path: str) -> str:
+    return _store.resolve(file_path) if _store is not None else file_path
+
+
+# ------------------------------------------------------------------
+# Migration from the flat layout
+# ------------------------------------------------------------------
+
+def migrate_to_store(conn, store: ImageStore) -> Tuple[int, int]:
+    """
+    Move every image row not yet in the store into it and point file_path at
+    the store path. Old files and their `.txt` sidecars are deleted once the
+    row is updated. Safe to re-run. Returns (migrated, missing).
+    """
+    from storage import fetch_all_images, update_image_file_path
+
+    migrated = missing = 0
+    for row in fetch_all_images(conn, columns=("id", "file_path")):
+        old_path = row["file_path"]
+        if is_store_path(old_path):
+            continue
+        source = store.resolve(old_path)
+        if not os.path.exists(source):
+            print(f"[WARN] Image #{row['id']} missing on disk: {source}")
+            missing += 1
+            continue
+
+        with open(source, "rb") as f:
+            data = f.read()
+        new_path = store.put(data, source)
+        update_image_file_path(conn, row["id"], new_path)
+        migrated += 1
+
+        for leftover in (source, source + ".txt"):
+            if os.path.exists(leftover) and os.path.abspath(leftover) != os.path.abspath(store.resolve(new_path)):
+                os.remove(leftover)
+    return migrated, missing
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    from db import Database
+    from storage import init_db
+
+    load_dotenv()
+    db_path, image_folder = os.getenv("DB_PATH"), os.getenv("IMAGE_FOLDER")
+    if not db_path or not image_folder:
+        raise SystemExit("DB_PATH and IMAGE_FOLDER must be set (see .env.example)")
+
+    database = Database(db_path)
+    init_db(database)
+    done, lost = migrate_to_store(database, ImageStore(image_folder))
+    database.close()
+    print(f"Migrated {done} image(s); {lost} missing on disk.")
@@ -1,14 +1,26 @@
 # main_bot.py
 import os
-import sqlite3
+import aiohttp
 import discord
 from discord import app_commands
 from dotenv import load_dotenv
 
-from bot import index_image_from_message
-from storage import init_db, get_image_by_id, get_random_image
-from search import search_best_match
+from bot import index_attachments_async, format_ingest_summary, decode_and_hash, find_similar_images, format_select_option
+from delivery import is_url_fresh, respond_with_image, send_image, set_http_session
+from db import Database
+from executors import BotExecutors
+from derivatives import DerivativePolicy, set_derivative_policy
+from image_store import ImageStore, resolve_image_path, set_image_store
+from hash_index import load_hash_index, load_band_index, set_duplicate_distance, DUPLICATE_HASH_DISTANCE
+from ocr import ResizePolicy, set_resize_policy
+from ocr_service import OcrService
+from storage import init_db, get_random_image
+from shuffle_bag import draw_shuffled_image
+from search import search_best_match, load_search_index, get_search_index
+from write_queue import WriteQueue
+from triggers import SearchGate, parse_channel_modes, DEFAULT_TRIGGER_MODE, DEFAULT_PREFIX
 from features.scheduling import setup_scheduling
+from features.scheduling.archive import RetentionPolicy, set_retention_policy
 
 # ----------------------
 # Load environment
@@ -19,6 +31,30 @@ TOKEN = os.getenv("DISCORD_TOKEN")
 GUILD_ID = os.getenv("DISCORD_GUILD_ID")
 DB_PATH = os.getenv("DB_PATH")
 IMAGE_FOLDER = os.getenv("IMAGE_FOLDER")
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))
+DB_READERS = int(os.getenv("DB_READERS", str(DB_WORKERS)))
+WRITE_BATCH_MAX = int(os.getenv("WRITE_BATCH_MAX", "64"))
+WRITE_BATCH_DELAY_MS = int(os.getenv("WRITE_BATCH_DELAY_MS", "20"))
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", "2"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "1"))
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "4"))
+DUPLICATE_DISTANCE = int(os.getenv("DUPLICATE_DISTANCE", str(DUPLICATE_HASH_DISTANCE)))
+OCR_MAX_BATCH = int(os.getenv("OCR_MAX_BATCH", "8"))
+OCR_BATCH_WINDOW_MS = int(os.getenv("OCR_BATCH_WINDOW_MS", "50"))
+OCR_UPSCALE_BELOW = int(os.getenv("OCR_UPSCALE_BELOW", str(ResizePolicy.upscale_below)))
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", str(ResizePolicy.max_side)))
+OCR_MAX_PIXELS = int(os.getenv("OCR_MAX_PIXELS", str(ResizePolicy.max_pixels)))
+DERIVATIVE_MAX_BYTES = int(os.getenv("DERIVATIVE_MAX_BYTES", str(DerivativePolicy.max_bytes)))
+DERIVATIVE_CACHE_MAX_BYTES = int(os.getenv("DERIVATIVE_CACHE_MAX_BYTES", str(DerivativePolicy.cache_max_bytes)))
+SCHEDULE_RETENTION_DAYS = float(os.getenv("SCHEDULE_RETENTION_DAYS", str(RetentionPolicy.finished_days)))
+SCHEDULE_ARCHIVE_RETENTION_DAYS = float(
+    os.getenv("SCHEDULE_ARCHIVE_RETENTION_DAYS", str(RetentionPolicy.archive_days))
+)
+SEARCH_TRIGGER_MODE = os.getenv("SEARCH_TRIGGER_MODE", DEFAULT_TRIGGER_MODE)
+SEARCH_TRIGGER_CHANNELS = parse_channel_modes(os.getenv("SEARCH_TRIGGER_CHANNELS"))
+SEARCH_TRIGGER_PREFIX = os.getenv("SEARCH_TRIGGER_PREFIX", DEFAULT_PREFIX)
+SEARCH_USER_PER_MINUTE = float(os.getenv("SEARCH_USER_PER_MINUTE", "6"))
+SEARCH_CHANNEL_PER_MINUTE = float(os.getenv("SEARCH_CHANNEL_PER_MINUTE", "30"))
 
 if not TOKEN:
     raise RuntimeError("DISCORD_TOKEN missing in .env")
@@ -30,21 +66,40 @@ if not IMAGE_FOLDER:
     raise RuntimeError("IMAGE_FOLDER missing in .env")
 
 os.makedirs(IMAGE_FOLDER, exist_ok=True)
+image_store = ImageStore(IMAGE_FOLDER)
+set_image_store(image_store)
+set_derivative_policy(
+    DerivativePolicy(max_bytes=DERIVATIVE_MAX_BYTES, cache_max_bytes=DERIVATIVE_CACHE_MAX_BYTES)
+)
+
+set_duplicate_distance(DUPLICATE_DISTANCE)
+set_retention_policy(
+    RetentionPolicy(finished_days=SCHEDULE_RETENTION_DAYS, archive_days=SCHEDULE_ARCHIVE_RETENTION_DAYS)
+)
+
+# OCR worker processes receive this when they start (see ocr_service).
+set_resize_policy(ResizePolicy(
+    upscale_below=OCR_UPSCALE_BELOW,
+    max_side=OCR_MAX_SIDE,
+    max_pixels=OCR_MAX_PIXELS,
+))
 
 # ----------------------
 # Dropdown UI
 # ----------------------
 class ImageSelect(discord.ui.Select):
-    def __init__(self, matches):
+    def __init__(self, matches, distances=None):
         self.matches = matches
+        distances = distances or {}
 
-        options = [
-            discord.SelectOption(
-                label=row["index_text"][:50] or "(no text)",
+        options = []
+        for row in matches:
+            label, description = format_select_option(row, distances.get(row["id"]))
+            options.append(discord.SelectOption(
+                label=label,
                 value=str(row["id"]),
-            )
-            for row in matches
-        ]
+                description=description,
+            ))
 
         super().__init__(
             placeholder="Please choose an image:",
@@ -57,28 +112,27 @@ class ImageSelect(discord.ui.Select):
         selected_id = int(self.values[0])
         row = next(r for r in self.matches if r["id"] == selected_id)
 
-        file_path = row["file_path"]
-
-        if not os.path.isabs(file_path):
-            file_path = os.path.join(IMAGE_FOLDER, os.path.basename(file_path))
+        if is_url_fresh(row.get("attachment_url")):
+            await respond_with_image(interaction, bot.conn, row, executors=bot.executors)
+            return
 
-        
-        if not os.path.exists(file_path):
+        file_path = resolve_image_path(row["file_path"])
+        exists = await bot.executors.run_io(os.path.exists, file_path)
+        if not exists:
             await interaction.response.send_message(
                 "[!] The image file does not exist.",
                 ephemeral=True,
             )
             return
 
-        await interaction.response.send_message(
-            file=discord.File(file_path),
-            ephemeral=False,
+        await respond_with_image(
+            interaction, bot.conn, row, executors=bot.executors, file_path=file_path
         )
 
 class ImageSelectView(discord.ui.View):
-    def __init__(self, matches):
+    def __init__(self, matches, distances=None):
         super().__init__(timeout=30)
-        self.add_item(ImageSelect(matches))
+        self.add_item(ImageSelect(matches, distances))
 
 # ----------------------
 # Discord bot class
@@ -90,12 +144,41 @@ class MyBot(discord.Client):
         super().__init__(intents=intents)
 
         self.tree = app_commands.CommandTree(self)
+        self.executors = BotExecutors(
+            db_workers=DB_WORKERS, cpu_workers=CPU_WORKERS, serialize_db=False
+        )
+        self.ocr = OcrService(
+            workers=OCR_WORKERS,
+            max_batch_size=OCR_MAX_BATCH,
+            batch_window=OCR_BATCH_WINDOW_MS / 1000,
+        )
+        # Opened in setup_hook: OCR worker processes import this module, and
+        # must not open the database or load the indexes themselves.
+        self.conn = None
+        self.writes = None
+        self.http_session = None
 
-        self.conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        self.conn.execute("PRAGMA journal_mode=WAL;")
+    async def setup_hook(self):
+        # One session for attachment URL checks rather than a handshake per send.
+        self.http_session = aiohttp.ClientSession()
+        set_http_session(self.http_session)
+
+        # Serialized writer + pooled WAL readers; see db.Database.
+        self.conn = Database(DB_PATH, readers=DB_READERS)
         init_db(self.conn)
+        self.writes = WriteQueue(
+            self.conn,
+            self.executors,
+            max_batch=WRITE_BATCH_MAX,
+            max_delay=WRITE_BATCH_DELAY_MS / 1000,
+        )
+        load_search_index(self.conn)
+        load_hash_index(self.conn)
+        load_band_index(self.conn)
+
+        await self.ocr.start()
+        await self.writes.start()
 
-    async def setup_hook(self):
         # Register feature commands BEFORE syncing, otherwise Discord won't see them.
         setup_scheduling(self)
 
@@ -108,28 +191,44 @@ class MyBot(discord.Client):
             await self.tree.sync()
             print("Global slash commands synced")
 
+    async def close(self):
+        await super().close()
+        await self.ocr.close()
+        if self.writes is not None:
+            await self.writes.close()
+        self.executors.shutdown(wait=False)
+        if self.conn is not None:
+            self.conn.close()
+        if self.http_session is not None:
+            await self.http_session.close()
+
 
 bot = MyBot()
 tree = bot.tree
 
+search_gate = SearchGate(
+    default_mode=SEARCH_TRIGGER_MODE,
+    channel_modes=SEARCH_TRIGGER_CHANNELS,
+    prefix=SEARCH_TRIGGER_PREFIX,
+    vocabulary=lambda text: get_search_index(bot.conn).vocabulary_overlap(text),
+    user_per_minute=SEARCH_USER_PER_MINUTE,
+    channel_per_minute=SEARCH_CHANNEL_PER_MINUTE,
+)
+
 # ----------------------
 # /img slash command
 # ----------------------
 @tree.command(name="img", description="Search for an indexed image")
 @app_commands.describe(query="Keyword to search image")
 async def img_cmd(interaction: discord.Interaction, query: str):
-    matches = search_best_match(bot.conn, query, limit=10)
+    matches = await bot.executors.run_db(search_best_match, bot.conn, query, limit=10)
 
     if not matches:
         await interaction.response.send_message("No image found.", ephemeral=True)
         return
 
     if len(matches) == 1:
-        row = matches[0]
-        await interaction.response.send_message(
-            file=discord.File(row["file_path"]),
-            ephemeral=False,
-        )
+        await respond_with_image(interaction, bot.conn, matches[0], executors=bot.executors)
         return
 
     view = ImageSelectView(matches)
@@ -140,48 +239,74 @@ async def img_cmd(interaction: discord.Interaction, query: str):
     )
 
 # ----------------------
-# Message handler
+# /img_like slash command
 # ----------------------
-@bot.event
-async def on_message(message: discord.Message):
-    if message.author.bot:
+@tree.command(name="img_like", description="Find indexed images that look like an attached image")
+@app_commands.describe(image="Image to search with")
+async def img_like_cmd(interaction: discord.Interaction, image: discord.Attachment):
+    if not (image.content_type and "image" in image.content_type):
+        await interaction.response.send_message("Please attach an image.", ephemeral=True)
         return
 
-    # 1. Image upload → index it
-    if message.attachments:
-        for attachment in message.attachments:
-            if attachment.content_type and "image" in attachment.content_type:
-                file_path = os.path.join(
-                    IMAGE_FOLDER, f"{message.id}_{attachment.filename}"
-                )
+    await interaction.response.defer(ephemeral=True, thinking=True)
 
-                await attachment.save(file_path)
+    data = await image.read()
+    _img, hashes = await bot.executors.run_cpu(decode_and_hash, data)
+    similar = await bot.executors.run_db(find_similar_images, bot.conn, hashes, limit=10)
 
-                img_id = index_image_from_message(bot.conn, message, file_path)
+    if not similar:
+        await interaction.followup.send("No similar image found.", ephemeral=True)
+        return
 
-                if img_id < 0:
-                    existing_id = -img_id
-                    await message.channel.send("⚠️ This image has already been indexed. Duplicate ignored.")
-                    return
+    matches = [row for _, row in similar]
+    view = ImageSelectView(matches, {row["id"]: distance for distance, row in similar})
+    await interaction.followup.send(
+        f"Found {len(matches)} similar images, please select:",
+        view=view,
+        ephemeral=True,
+    )
 
-                row = get_image_by_id(bot.conn, img_id)
+# ----------------------
+# Message handler
+# ----------------------
+@bot.event
+async def on_message(message: discord.Message):
+    if message.author.bot:
+        return
+
+    # 1. Image upload(s) → index them all, reply once
+    image_attachments = [
+        a for a in message.attachments
+        if a.content_type and "image" in a.content_type
+    ]
+    if image_attachments:
+        results = await index_attachments_async(
+            bot.executors,
+            bot.conn,
+            message,
+            image_attachments,
+            image_store,
+            ocr_service=bot.ocr,
+            concurrency=INGEST_CONCURRENCY,
+            writes=bot.writes,
+        )
+        await message.channel.send(format_ingest_summary(results))
+        return
 
-                ocr_text = (row.get("ocr_text") if row else None) or "(none)"
-                await message.channel.send(f"Image indexed!\nOCR: {ocr_text}")
-                return
-    # 2. Text message → keyword search
-    text = message.content.strip()
-    if text:
-        matches = search_best_match(bot.conn, text, limit=10)
+    # 2. Text message → keyword search, if the trigger gate lets it through
+    bot_user_id = bot.user.id if bot.user else None
+    trigger = search_gate.check(message, bot_user_id=bot_user_id)
+    if trigger is not None:
+        matches = await bot.executors.run_db(search_best_match, bot.conn, trigger.query, limit=10)
 
         if not matches:
-            await message.channel.send("No matching image found.")
+            # Stay quiet on vocabulary-triggered misses; that was probably just chat.
+            if trigger.explicit:
+                await message.channel.send("No matching image found.")
             return
 
         if len(matches) == 1:
-            await message.channel.send(
-                file=discord.File(matches[0]["file_path"])
-            )
+            await send_image(message.channel, bot.conn, matches[0], executors=bot.executors)
             return
 
         view = ImageSelectView(matches)
@@ -192,17 +317,18 @@ async def on_message(message: discord.Message):
 
 
 @tree.command(name="random", description="Send a random indexed image")
-async def random_cmd(interaction: discord.Interaction):
-    row = get_random_image(bot.conn)
+@app_commands.describe(shuffle="Don't repeat an image in this channel until all have been shown")
+async def random_cmd(interaction: discord.Interaction, shuffle: bool = False):
+    if shuffle:
+        row = await bot.executors.run_db(draw_shuffled_image, bot.conn, str(interaction.channel_id))
+    else:
+        row = await bot.executors.run_db(get_random_image, bot.conn)
 
     if not row:
         await interaction.response.send_message("No image found.", ephemeral=True)
         return
 
-    await interaction.response.send_message(
-        file=discord.File(row["file_path"]),
-        ephemeral=False,
-    )
+    await respond_with_image(interaction, bot.conn, row, executors=bot.executors)
 
 # ----------------------
 # Start bot
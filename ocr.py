@@ -1,11 +1,63 @@
 # ocr.py - PaddleOCR version (TDD-compatible + OpenCV-safe)
 
+import math
+from dataclasses import dataclass
+
 from paddleocr import PaddleOCR
 import cv2
+import numpy as np
 
 _reader = None  # lazy-loaded OCR reader
 
 
+@dataclass(frozen=True)
+class ResizePolicy:
+    """
+    How preprocess_image scales an image before OCR.
+
+    - Images whose longest side is below `upscale_below` are upscaled by
+      `upscale_factor` (small text OCRs better when enlarged).
+    - The longest side is capped at `max_side` and the total pixel count at
+      `max_pixels`, so large screenshots are downscaled instead of quadrupled.
+    """
+    upscale_below: int = 1200
+    upscale_factor: float = 2.0
+    max_side: int = 4000
+    max_pixels: int = 8_000_000
+
+    def scale_for(self, height: int, width: int) -> float:
+        longest = max(height, width)
+        if longest <= 0:
+            return 1.0
+
+        scale = self.upscale_factor if longest < self.upscale_below else 1.0
+        if longest * scale > self.max_side:
+            scale = self.max_side / longest
+        if height * width * scale * scale > self.max_pixels:
+            scale = math.sqrt(self.max_pixels / (height * width))
+        return scale
+
+
+# The original behaviour: always upscale 2x.
+FIXED_2X_POLICY = ResizePolicy(
+    upscale_below=2**31,
+    upscale_factor=2.0,
+    max_side=2**31,
+    max_pixels=2**62,
+)
+
+_resize_policy = ResizePolicy()
+
+
+def set_resize_policy(policy: ResizePolicy) -> None:
+    global _resize_policy
+    _resize_policy = policy
+
+
+def get_resize_policy() -> ResizePolicy:
+    return _resize_policy
+
+
 def get_reader():
     """
     Lazy load PaddleOCR reader.
@@ -22,7 +74,20 @@ def get_reader():
     return _reader
 
 
-def preprocess_image(path: str):
+def resize_for_ocr(img, policy: ResizePolicy | None = None):
+    """Scale `img` according to `policy` (default: the configured policy)."""
+    policy = policy or _resize_policy
+    height, width = img.shape[:2]
+    scale = policy.scale_for(height, width)
+    if abs(scale - 1.0) < 1e-3:
+        return img
+
+    # Upscale helps OCR accuracy on small text; INTER_AREA avoids aliasing when shrinking.
+    interpolation = cv2.INTER_LINEAR if scale > 1 else cv2.INTER_AREA
+    return cv2.resize(img, None, fx=scale, fy=scale, interpolation=interpolation)
+
+
+def preprocess_image(path: str, policy: ResizePolicy | None = None):
     """
     Load and prep image.
     This is mockable in tests.
@@ -35,10 +100,33 @@ def preprocess_image(path: str):
         print("[OCR Error] Cannot open:", path)
         return None
 
-    # Upscale helps OCR accuracy
-    img = cv2.resize(img, None, fx=2, fy=2)
+    return resize_for_ocr(img, policy)
+
+
+def decode_image(data: bytes):
+    """Decode encoded image bytes (PNG/JPEG/...) into a BGR array, or None."""
+    if not data:
+        return None
+    buf = np.frombuffer(data, dtype=np.uint8)
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
 
-    return img
+def prepare_source(source):
+    """
+    OCR input from a file path, encoded image bytes, or an already-decoded
+    BGR array, so callers that hold the decoded image don't pay for a second
+    decode. OCR worker processes get bytes: a few MB to pickle instead of
+    the tens of MB of a decoded photo.
+    """
+    if source is None:
+        return None
+    if isinstance(source, str):
+        return preprocess_image(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = decode_image(bytes(source))
+        if source is None:
+            return None
+    return resize_for_ocr(source)
 
 def extract_lines(img: cv2.typing.MatLike) -> list[str]:
     reader = get_reader()
@@ -48,14 +136,48 @@ def extract_lines(img: cv2.typing.MatLike) -> list[str]:
         texts.extend(res.get("rec_texts", []))
     return texts
 
-def extract_text(path: str) -> str:
+def extract_lines_batch(imgs: list) -> list[list[str]]:
+    """Run one predict call over several images; one list of lines per input."""
+    reader = get_reader()
+    results = reader.predict(imgs)
+    return [list(res.get("rec_texts", [])) for res in results]
+
+
+def extract_text_batch(sources: list) -> list[str]:
+    """
+    Batched extract_text: one model call for all loadable images.
+    `sources` may mix file paths, encoded image bytes and decoded arrays.
+    Returns one string per input, "" for images that failed to load.
+    """
+    texts = [""] * len(sources)
+    try:
+        loaded = []
+        for i, source in enumerate(sources):
+            processed = prepare_source(source)
+            if processed is not None:
+                loaded.append((i, processed))
+
+        if not loaded:
+            return texts
+
+        batch = extract_lines_batch([img for _, img in loaded])
+        for (i, _), lines in zip(loaded, batch):
+            texts[i] = " ".join(lines).strip()
+        return texts
+
+    except Exception as e:
+        print("[OCR Error]", e)
+        return texts
+
+
+def extract_text(path) -> str:
     """
-    Run OCR and return text.
+    Run OCR and return text. `path` may also be a decoded BGR array.
     Real model loads only on first call.
     Fully mockable during pytest.
     """
     try:
-        processed = preprocess_image(path)
+        processed = prepare_source(path)
         if processed is None:
             return ""
 
@@ -0,0 +1,193 @@
+# ocr_service.py
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional
+
+import ocr
+
+
+DEFAULT_OCR_WORKERS = 1
+DEFAULT_MAX_BATCH_SIZE = 8
+DEFAULT_BATCH_WINDOW_SECONDS = 0.05
+
+
+def _init_worker(policy: ocr.ResizePolicy) -> None:
+    """Process-pool initializer: load the PaddleOCR model once per worker."""
+    ocr.set_resize_policy(policy)
+    ocr.get_reader()
+
+
+def _mp_context():
+    # The pool starts (and may be rebuilt) after discord.py and the executor
+    # pools have started threads, and forking a multi-threaded process can
+    # deadlock on locks held at fork time. A fork server is a fresh,
+    # single-threaded process that imports the main module and ocr once, then
+    # forks the workers; spawn where fork servers are unavailable.
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["__main__", "ocr"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+class OcrService:
+    """
+    Out-of-process OCR.
+
+    Jobs go into an asyncio queue and callers get an asyncio.Future for the text.
+    One consumer task per worker feeds a ProcessPoolExecutor whose workers each
+    load the model once, so OCR scales across cores without holding the GIL or
+    blocking the Discord gateway.
+
+    Consumers micro-batch: after taking a job they wait up to `batch_window`
+    seconds for more (at most `max_batch_size`), run a single batched predict
+    and fan the per-image texts back out to the callers' futures.
+    """
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_OCR_WORKERS,
+        *,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+        batch_window: float = DEFAULT_BATCH_WINDOW_SECONDS,
+        executor: Optional[Executor] = None,
+        batch_fn: Callable[[List[Any]], List[str]] = ocr.extract_text_batch,
+        initializer: Callable[[ocr.ResizePolicy], None] = _init_worker,
+    ):
+        self.workers = workers
+        self.max_batch_size = max(1, max_batch_size)
+        self.batch_window = batch_window
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._batch_fn = batch_fn
+        self._initializer = initializer
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.restarts = 0
+        self.batches = 0
+        self.last_latency = 0.0
+        self._total_latency = 0.0
+        self._total_wait = 0.0
+
+    async def start(self) -> None:
+        if self._queue is not None:
+            return
+        if self._executor is None:
+            self._executor = self._new_executor()
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+
+    def _new_executor(self) -> Executor:
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=_mp_context(),
+            initializer=self._initializer,
+            initargs=(ocr.get_resize_policy(),),
+        )
+
+    def _restart(self, broken: Executor) -> None:
+        """Replace a broken pool (a worker died or failed to load the model)."""
+        if not self._owns_executor or self._executor is not broken:
+            return  # not ours to rebuild, or another consumer already did
+        self._executor = self._new_executor()
+        self.restarts += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @property
+    def depth(self) -> int:
+        """Jobs waiting in the queue (not yet handed to a worker)."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def submit(self, source: Any) -> "asyncio.Future[str]":
+        if self._queue is None:
+            raise RuntimeError("OcrService.start() has not been called")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((source, future, time.perf_counter()))
+        return future
+
+    async def extract_text(self, source: Any) -> str:
+        return await self.submit(source)
+
+    async def _next_batch(self) -> list:
+        batch = [await self._queue.get()]
+        if self.max_batch_size > 1 and self.batch_window > 0 and self._queue.qsize() < self.max_batch_size - 1:
+            await asyncio.sleep(self.batch_window)
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _consume(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            sources = [source for source, _, _ in batch]
+            started_at = time.perf_counter()
+            self.in_flight += len(batch)
+            self.batches += 1
+            executor = self._executor
+            ok = False
+            try:
+                texts = await loop.run_in_executor(executor, self._batch_fn, sources)
+                ok = True
+            except BrokenProcessPool as e:
+                # Like a failed OCR call in-process: log it and index without text.
+                print(f"[WARN] OCR worker pool broke, restarting it: {e}")
+                self._restart(executor)
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_result("")
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future, _), text in zip(batch, texts):
+                    if not future.done():
+                        future.set_result(text)
+            finally:
+                self.in_flight -= len(batch)
+                for _, _, enqueued_at in batch:
+                    self._record(enqueued_at, started_at, ok)
+                    self._queue.task_done()
+
+    def _record(self, enqueued_at: float, started_at: float, ok: bool) -> None:
+        if not ok:
+            self.failed += 1
+            return
+        finished_at = time.perf_counter()
+        self.completed += 1
+        self.last_latency = finished_at - enqueued_at
+        self._total_latency += self.last_latency
+        self._total_wait += started_at - enqueued_at
+
+    def stats(self) -> Dict[str, float]:
+        done = self.completed or 1
+        return {
+            "depth": self.depth,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "restarts": self.restarts,
+            "batches": self.batches,
+            "avg_batch_size": (self.completed + self.failed) / (self.batches or 1),
+            "last_latency": self.last_latency,
+            "avg_latency": self._total_latency / done,
+            "avg_wait": self._total_wait / done,
+        }
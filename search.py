@@ -1,31 +1,219 @@
 # search.py
-from typing import List, Dict, Any
-from rapidfuzz import fuzz
-from storage import fetch_all_images
+import math
+import re
+from typing import List, Dict, Any, Iterable, Optional, Sequence
+
+import numpy as np
+from rapidfuzz import fuzz, process
+from storage import (
+    add_insert_listener,
+    fetch_fts_candidate_ids,
+    fetch_index_texts,
+    get_images_by_ids,
+    has_fts,
+)
 
 MIN_SCORE = 50  # Minimum score to consider a match
+FTS_CANDIDATES = 200  # Max rows pulled from the trigram prefilter for rescoring
+SCORE_WORKERS = -1  # rapidfuzz worker threads for batch scoring (-1 = all cores)
+
+
+# Han, kana and hangul: written without spaces, so each character is a term.
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_TERM_RE = re.compile(rf"[{_CJK}]|[^\W_{_CJK}]+")
+
+
+def text_terms(text: str) -> set:
+    """Distinct lower-cased words (single characters for CJK scripts)."""
+    return set(_TERM_RE.findall(text.lower()))
+
 
-def search_best_match(conn, query: str, limit: int = 1) -> List[Dict[str, Any]]:
+def score_texts(query: str, texts: Sequence[str]) -> np.ndarray:
     """
-    Return up to `limit` best-matching image records based on fuzzy text matching.
-    Only results with score >= MIN_SCORE are considered valid matches.
+    Score `query` against every text in one native batch call per scorer.
+    Returns max(partial_ratio, WRatio) per text; scores below MIN_SCORE are 0.
+    """
+    if not texts:
+        return np.zeros(0, dtype=np.float32)
+
+    kwargs = {"score_cutoff": MIN_SCORE, "workers": SCORE_WORKERS}
+    partial = process.cdist([query], texts, scorer=fuzz.partial_ratio, **kwargs)[0]
+    weighted = process.cdist([query], texts, scorer=fuzz.WRatio, **kwargs)[0]
+    return np.maximum(partial, weighted)
+
+
+def top_k(scores: np.ndarray, limit: int) -> List[int]:
+    """Positions of the `limit` best scores >= MIN_SCORE, best first (ties keep input order)."""
+    hits = np.flatnonzero(scores >= MIN_SCORE)
+    if len(hits) > limit:
+        # Select the winners in O(n) so only they get fully sorted; ties on the
+        # cutoff score go to the earliest rows, as a full stable sort would.
+        hit_scores = scores[hits]
+        kth = np.partition(hit_scores, len(hits) - limit)[len(hits) - limit]
+        above = hits[hit_scores > kth]
+        ties = hits[hit_scores == kth][: limit - len(above)]
+        hits = np.sort(np.concatenate([above, ties]))
+    order = np.argsort(-scores[hits], kind="stable")
+    return hits[order].tolist()
+
+
+# ------------------------------------------------------------------
+# Resident search index
+# ------------------------------------------------------------------
+
+class SearchIndex:
+    """
+    In-memory copy of the searchable image texts.
+    Loaded once from SQLite, then kept current through storage insert listeners,
+    so queries never have to re-read the images table.
+
+    Only ids and texts are resident, in two parallel lists, so the whole corpus
+    (or the FTS5 trigram candidate subset, for queries of 3+ characters) is
+    scored in a single rapidfuzz batch call. Full rows are fetched by id for
+    the few winners only.
     """
-    rows = list(fetch_all_images(conn))
-    if not rows:
-        return []
 
-    scored = []
-    for row in rows:
-        text = row.get("index_text") or ""
-        if not text:
-            continue
+    def __init__(self, conn=None):
+        self.conn = conn
+        self.use_fts = conn is not None and has_fts(conn)
+        self._ids: List[int] = []
+        self._texts: List[str] = []
+        self._pos: Dict[int, int] = {}  # image id -> position in _ids/_texts
+        self._doc_freq: Dict[str, int] = {}  # term -> texts containing it, for cheap pre-checks
+
+    @classmethod
+    def load(cls, conn) -> "SearchIndex":
+        index = cls(conn)
+        for img_id, index_text in fetch_index_texts(conn):
+            index._append(img_id, index_text)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, row: Dict[str, Any]) -> None:
+        if row.get("index_text"):
+            self._append(row["id"], row["index_text"])
+
+    def _append(self, img_id: int, index_text: str) -> None:
+        # Ids before texts, positions last: a concurrent search (reader threads
+        # do not hold the writer lock) never sees a text without its id.
+        position = len(self._ids)
+        self._ids.append(img_id)
+        self._texts.append(index_text)
+        self._pos[img_id] = position
+        for term in text_terms(index_text):
+            self._doc_freq[term] = self._doc_freq.get(term, 0) + 1
+
+    def vocabulary_overlap(self, query: str) -> float:
+        """
+        IDF-weighted fraction of the query's terms that occur in the corpus.
+        Words found in most texts ("the", "lol") count for little, so chat only
+        passes when its rarer words match. Dict lookups only, so it can reject
+        chatter without scoring anything.
+        """
+        terms = text_terms(query)
+        n = len(self._ids)
+        known = total = 0.0
+        for term in terms:
+            df = self._doc_freq.get(term, 0)
+            weight = math.log(1 + n / (df or 0.5))  # unseen terms weigh the most
+            total += weight
+            if df:
+                known += weight
+        return known / total if total else 0.0
 
-        score1 = fuzz.partial_ratio(query, text)
-        score2 = fuzz.WRatio(query, text)
-        score = max(score1, score2)
+    def _candidates(self, query: str) -> Optional[List[int]]:
+        """Positions to rescore, or None for the whole corpus."""
+        if not self.use_fts:
+            return None
 
-        if score >= MIN_SCORE:
-            scored.append((score, row))
+        ids = fetch_fts_candidate_ids(self.conn, query, FTS_CANDIDATES)
+        if ids is None:
+            # Too short to trigram: full scan.
+            return None
+        return [self._pos[i] for i in ids if i in self._pos]
 
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return [row for _, row in scored[:limit]]
+    def candidate_ids(self, query: str) -> Optional[List[int]]:
+        """Ids a search for `query` would score, or None for the whole corpus."""
+        positions = self._candidates(query)
+        return None if positions is None else [self._ids[p] for p in positions]
+
+    def search_ids(
+        self,
+        query: str,
+        limit: int = 1,
+        candidate_ids: Optional[Iterable[int]] = None,
+    ) -> List[int]:
+        """Ids of the best matches, best first."""
+        if candidate_ids is not None:
+            positions = [self._pos[i] for i in candidate_ids if i in self._pos]
+        else:
+            positions = self._candidates(query)
+        if positions is None:
+            texts = self._texts
+        else:
+            texts = [self._texts[p] for p in positions]
+
+        best = top_k(score_texts(query, texts), limit)
+        if positions is not None:
+            best = [positions[b] for b in best]
+        return [self._ids[p] for p in best]
+
+    def search(
+        self,
+        query: str,
+        limit: int = 1,
+        candidate_ids: Optional[Iterable[int]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Full rows of the best matches, best first."""
+        return get_images_by_ids(self.conn, self.search_ids(query, limit, candidate_ids))
+
+
+# One index per connection. The index keeps its connection alive, so the id() key
+# cannot be recycled by another connection while the entry exists.
+_indexes: Dict[int, SearchIndex] = {}
+
+
+def load_search_index(conn) -> SearchIndex:
+    """(Re)build the resident index for `conn`. Call once at startup."""
+    index = SearchIndex.load(conn)
+    _indexes[id(conn)] = index
+    return index
+
+
+def get_search_index(conn) -> SearchIndex:
+    index = _indexes.get(id(conn))
+    if index is None or index.conn is not conn:
+        index = load_search_index(conn)
+    return index
+
+
+def drop_search_index(conn) -> None:
+    index = _indexes.get(id(conn))
+    if index is not None and index.conn is conn:
+        del _indexes[id(conn)]
+
+
+def _on_image_inserted(conn, row: Dict[str, Any]) -> None:
+    index = _indexes.get(id(conn))
+    if index is not None and index.conn is conn:
+        index.add(row)
+
+
+add_insert_listener(_on_image_inserted)
+
+
+def search_best_match(
+    conn,
+    query: str,
+    limit: int = 1,
+    *,
+    candidate_ids: Optional[Iterable[int]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Return up to `limit` best-matching image records based on fuzzy text matching.
+    Only results with score >= MIN_SCORE are considered valid matches.
+    If `candidate_ids` is given, only those images are scored.
+    """
+    return get_search_index(conn).search(query, limit=limit, candidate_ids=candidate_ids)
@@ -0,0 +1,69 @@
+# shuffle_bag.py
+import random
+from typing import Any, Dict, Optional, Tuple
+
+from db import transaction
+from storage import (
+    delete_shuffle_slots,
+    get_image_by_id,
+    get_image_id_range,
+    get_shuffle_slot,
+    load_shuffle_cycle,
+    save_shuffle_cycle,
+    set_shuffle_slot,
+)
+
+
+def _new_cycle(conn, channel_id: str, lo: int, hi: int) -> Tuple[int, int, int]:
+    delete_shuffle_slots(conn, channel_id)
+    return hi - lo + 1, lo, hi
+
+
+def _slot(conn, channel_id: str, base: int, position: int) -> int:
+    image_id = get_shuffle_slot(conn, channel_id, position)
+    return base + position if image_id is None else image_id
+
+
+def draw_shuffled_image(conn, channel_id: str, rng: Optional[random.Random] = None) -> Optional[Dict[str, Any]]:
+    """
+    Random image for `channel_id` that has not been drawn there since the bag
+    was last emptied; once every image has been drawn a new cycle starts.
+    Images added mid-cycle join the current cycle. The bag is persisted per
+    channel, so cycles survive restarts.
+
+    The bag is a Fisher-Yates shuffle of the id range advanced one step per
+    draw (see storage.SHUFFLE_SCHEMA): only swapped positions are stored, so a
+    draw reads and writes a couple of rows however full the bag is. Ids of
+    deleted images are drawn like any other and skipped.
+    """
+    rng = rng or random
+    # One transaction: concurrent draws for a channel cannot hand out the same id.
+    with transaction(conn):
+        id_range = get_image_id_range(conn)
+        if id_range is None:
+            return None
+        lo, hi = id_range
+
+        remaining, base, top = load_shuffle_cycle(conn, channel_id) or (0, lo, hi)
+        if remaining > 0 and hi > top:
+            # Images added since the last draw join the undrawn positions.
+            for image_id in range(top + 1, hi + 1):
+                set_shuffle_slot(conn, channel_id, remaining, image_id)
+                remaining += 1
+            top = hi
+
+        row = None
+        while row is None:
+            if remaining == 0:
+                remaining, base, top = _new_cycle(conn, channel_id, lo, hi)
+            position = rng.randrange(remaining)
+            last = remaining - 1
+            image_id = _slot(conn, channel_id, base, position)
+            if position != last:
+                set_shuffle_slot(conn, channel_id, position, _slot(conn, channel_id, base, last))
+            delete_shuffle_slots(conn, channel_id, last)
+            remaining = last
+            row = get_image_by_id(conn, image_id)
+
+        save_shuffle_cycle(conn, channel_id, remaining, base, top)
+    return row
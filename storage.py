@@ -1,6 +1,9 @@
 # storage.py
+import random
 import sqlite3
-from typing import Optional, Iterable, Dict, Any
+from typing import Optional, Iterable, Dict, Any, Callable, List, Sequence
+
+from db import after_commit, ensure_column, reader, transaction, writer
 
 
 SCHEMA = """
@@ -11,6 +14,10 @@ CREATE TABLE IF NOT EXISTS images (
     message_id        TEXT NOT NULL,
     file_path         TEXT NOT NULL,
     image_hash        TEXT UNIQUE,
+    dhash             TEXT,
+    whash             TEXT,
+    attachment_id     TEXT,
+    attachment_url    TEXT,
     user_text         TEXT,
     ocr_text          TEXT,
     index_text        TEXT NOT NULL,
@@ -19,18 +26,268 @@ CREATE TABLE IF NOT EXISTS images (
 """
 
 
-def init_db(conn: sqlite3.Connection) -> None:
+IMAGE_COLUMNS = (
+    "id",
+    "uploader_id",
+    "channel_id",
+    "message_id",
+    "file_path",
+    "image_hash",
+    "dhash",
+    "whash",
+    "attachment_id",
+    "attachment_url",
+    "user_text",
+    "ocr_text",
+    "index_text",
+    "created_at",
+)
+
+
+# Trigram full-text mirror of images.index_text, used as a candidate prefilter
+# for fuzzy search. External-content table: the text lives only in `images`.
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(
+    index_text,
+    content='images',
+    content_rowid='id',
+    tokenize='trigram'
+);
+
+CREATE TRIGGER IF NOT EXISTS images_fts_ai AFTER INSERT ON images BEGIN
+    INSERT INTO images_fts(rowid, index_text) VALUES (new.id, new.index_text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS images_fts_ad AFTER DELETE ON images BEGIN
+    INSERT INTO images_fts(images_fts, rowid, index_text) VALUES ('delete', old.id, old.index_text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS images_fts_au AFTER UPDATE OF index_text ON images BEGIN
+    INSERT INTO images_fts(images_fts, rowid, index_text) VALUES ('delete', old.id, old.index_text);
+    INSERT INTO images_fts(rowid, index_text) VALUES (new.id, new.index_text);
+END;
+"""
+
+FTS_MAX_TRIGRAMS = 64  # cap on OR-terms per MATCH expression
+
+
+# Locality-sensitive banding of the perceptual hashes (see hash_index.BandIndex):
+# one row per (hash kind, band number, band value) of each image.
+BANDS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_hash_bands (
+    image_id    INTEGER NOT NULL,
+    kind        TEXT NOT NULL, -- phash | dhash | whash
+    band        INTEGER NOT NULL,
+    value       INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_image_hash_bands_lookup
+    ON image_hash_bands(kind, band, value);
+
+CREATE INDEX IF NOT EXISTS idx_image_hash_bands_image
+    ON image_hash_bands(image_id);
+"""
+
+
+# Per-channel shuffle cycles for /random (see shuffle_bag.py): a lazy
+# Fisher-Yates shuffle of the image ids. Positions [0, remaining) hold the ids
+# not drawn yet: position p holds base + p unless shuffle_slots says otherwise.
+SHUFFLE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shuffle_cycles (
+    channel_id  TEXT PRIMARY KEY,
+    remaining   INTEGER NOT NULL,
+    base        INTEGER NOT NULL,
+    top         INTEGER NOT NULL,
+    updated_at  TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS shuffle_slots (
+    channel_id  TEXT NOT NULL,
+    position    INTEGER NOT NULL,
+    image_id    INTEGER NOT NULL,
+    PRIMARY KEY (channel_id, position)
+) WITHOUT ROWID;
+"""
+
+# Send-sized renditions of large images (see derivatives.py), for LRU eviction.
+DERIVATIVES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_derivatives (
+    image_id    INTEGER PRIMARY KEY,
+    file_path   TEXT NOT NULL,
+    bytes       INTEGER NOT NULL,
+    last_used   INTEGER NOT NULL -- unix epoch seconds
+);
+
+CREATE INDEX IF NOT EXISTS idx_image_derivatives_last_used
+    ON image_derivatives(last_used);
+"""
+
+RANDOM_ID_ATTEMPTS = 8  # probes of the id space before falling back to the next id
+
+
+def init_db(conn) -> None:
     """Create tables if they don't exist."""
-    conn.execute(SCHEMA)
+    with writer(conn) as db:
+        db.execute(SCHEMA)
+        ensure_column(db, table="images", column="dhash", ddl="TEXT")
+        ensure_column(db, table="images", column="whash", ddl="TEXT")
+        ensure_column(db, table="images", column="attachment_id", ddl="TEXT")
+        ensure_column(db, table="images", column="attachment_url", ddl="TEXT")
+        db.commit()
+        db.executescript(BANDS_SCHEMA)
+        db.executescript(SHUFFLE_SCHEMA)
+        db.executescript(DERIVATIVES_SCHEMA)
+        _init_fts(db)
+
+
+def _init_fts(conn: sqlite3.Connection) -> None:
+    """
+    Create the FTS5 trigram table and its sync triggers.
+    Silently skipped when the SQLite build lacks FTS5 / the trigram tokenizer;
+    search then falls back to a full scan.
+    """
+    existed = has_fts(conn)
+    try:
+        conn.executescript(FTS_SCHEMA)
+    except sqlite3.OperationalError as e:
+        print(f"[WARN] FTS5 trigram index unavailable: {e}")
+        return
+
+    if not existed:
+        # Backfill rows inserted before the FTS table existed.
+        conn.execute("INSERT INTO images_fts(images_fts) VALUES ('rebuild')")
     conn.commit()
 
 
+def has_fts(conn) -> bool:
+    with reader(conn) as db:
+        cur = db.cursor()
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'images_fts'")
+        return cur.fetchone() is not None
+
+
+# ------------------------------------------------------------------
+# Row conversion
+# ------------------------------------------------------------------
+
+class ImageRecord:
+    """
+    One `images` row.
+
+    Slotted, so a record costs a fixed handful of pointers instead of a dict,
+    and built from a column list computed once per query rather than per row.
+    Supports the mapping calls callers already use (`row["x"]`, `row.get`,
+    `row["x"] = v`, `keys()`); columns outside a query's projection are absent.
+    """
+
+    __slots__ = IMAGE_COLUMNS
+
+    def __init__(self, **values: Any):
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    @classmethod
+    def from_row(cls, columns: Sequence[str], values: Sequence[Any]) -> "ImageRecord":
+        record = cls.__new__(cls)
+        for name, value in zip(columns, values):
+            setattr(record, name, value)
+        return record
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        try:
+            setattr(self, key, value)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and hasattr(self, key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+    def keys(self) -> List[str]:
+        return [name for name in IMAGE_COLUMNS if hasattr(self, name)]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, ImageRecord):
+            other = dict(other.items())
+        return isinstance(other, dict) and dict(self.items()) == other
+
+    __hash__ = None
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in self.keys()]
+
+    def __repr__(self) -> str:
+        return f"ImageRecord({dict(self.items())!r})"
+
+
+def _select_columns(columns: Sequence[str]) -> str:
+    unknown = set(columns) - set(IMAGE_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown image columns: {sorted(unknown)}")
+    return ", ".join(columns)
+
+
+def _records(cur: sqlite3.Cursor) -> List[ImageRecord]:
+    columns = [desc[0] for desc in cur.description]
+    return [ImageRecord.from_row(columns, row) for row in cur.fetchall()]
+
+
+def _record(cur: sqlite3.Cursor) -> Optional[ImageRecord]:
+    row = cur.fetchone()
+    if row is None:
+        return None
+    return ImageRecord.from_row([desc[0] for desc in cur.description], row)
+
+
+# ------------------------------------------------------------------
+# Insert listeners
+# ------------------------------------------------------------------
+
+# Called as listener(conn, row) after a new image row has been committed.
+# Lets in-memory indexes (see search.py) stay in sync without re-reading the table.
+InsertListener = Callable[[Any, Dict[str, Any]], None]
+
+_insert_listeners: List[InsertListener] = []
+
+
+def add_insert_listener(listener: InsertListener) -> None:
+    if listener not in _insert_listeners:
+        _insert_listeners.append(listener)
+
+
+def remove_insert_listener(listener: InsertListener) -> None:
+    if listener in _insert_listeners:
+        _insert_listeners.remove(listener)
+
+
+def _notify_insert(conn, row: Dict[str, Any]) -> None:
+    for listener in list(_insert_listeners):
+        try:
+            listener(conn, row)
+        except Exception as e:
+            print(f"[WARN] Insert listener failed: {e}")
+
+
 # ------------------------------------------------------------------
 # Insert / Save
 # ------------------------------------------------------------------
 
 def save_image_record(
-    conn: sqlite3.Connection,
+    conn,
     uploader_id: str,
     channel_id: str,
     message_id: str,
@@ -38,6 +295,10 @@ def save_image_record(
     user_text: Optional[str],
     ocr_text: Optional[str],
     image_hash: str | None = None,
+    dhash: str | None = None,
+    whash: str | None = None,
+    attachment_id: str | None = None,
+    attachment_url: str | None = None,
 ) -> int:
     """
     Save one image row.
@@ -46,59 +307,215 @@ def save_image_record(
     index_parts = [t for t in (user_text, ocr_text) if t]
     index_text = " ".join(index_parts) if index_parts else ""
 
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO images (
-            uploader_id, channel_id, message_id,
-            file_path, image_hash, user_text, ocr_text, index_text
+    with transaction(conn) as db:
+        cur = db.cursor()
+        cur.execute(
+            """
+            INSERT INTO images (
+                uploader_id, channel_id, message_id,
+                file_path, image_hash, dhash, whash,
+                attachment_id, attachment_url, user_text, ocr_text, index_text
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                uploader_id,
+                channel_id,
+                message_id,
+                file_path,
+                image_hash,
+                dhash,
+                whash,
+                attachment_id,
+                attachment_url,
+                user_text,
+                ocr_text,
+                index_text,
+            ),
+        )
+        img_id = cur.lastrowid
+        row = {
+            "id": img_id,
+            "uploader_id": uploader_id,
+            "channel_id": channel_id,
+            "message_id": message_id,
+            "file_path": file_path,
+            "image_hash": image_hash,
+            "dhash": dhash,
+            "whash": whash,
+            "attachment_id": attachment_id,
+            "attachment_url": attachment_url,
+            "user_text": user_text,
+            "ocr_text": ocr_text,
+            "index_text": index_text,
+        }
+        # In-memory indexes only hear about rows that actually committed.
+        after_commit(db, lambda: _notify_insert(conn, row))
+    return img_id
+
+
+def update_image_attachment(
+    conn,
+    img_id: int,
+    attachment_id: str,
+    attachment_url: str,
+) -> None:
+    """Remember the Discord attachment that currently serves this image."""
+    with transaction(conn) as db:
+        db.execute(
+            "UPDATE images SET attachment_id = ?, attachment_url = ? WHERE id = ?",
+            (attachment_id, attachment_url, img_id),
         )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            uploader_id,
-            channel_id,
-            message_id,
-            file_path,
-            image_hash,
-            user_text,
-            ocr_text,
-            index_text,
-        ),
-    )
-    conn.commit()
-    return cur.lastrowid
+
+
+def clear_image_attachment(conn, img_id: int) -> None:
+    """Forget an attachment URL that no longer serves the image (e.g. its message was deleted)."""
+    with transaction(conn) as db:
+        db.execute("UPDATE images SET attachment_id = NULL, attachment_url = NULL WHERE id = ?", (img_id,))
+
+
+def update_image_file_path(conn, img_id: int, file_path: str) -> None:
+    with transaction(conn) as db:
+        db.execute("UPDATE images SET file_path = ? WHERE id = ?", (file_path, img_id))
 
 
 # ------------------------------------------------------------------
 # Fetch helpers
 # ------------------------------------------------------------------
 
-def get_image_by_hash(conn: sqlite3.Connection, image_hash: str):
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT * FROM images WHERE image_hash = ?",
-        (image_hash,),
-    )
-    row = cur.fetchone()
-    if not row:
-        return None
-    return _row_to_dict(cur, row)
+def get_image_by_hash(conn, image_hash: str) -> Optional[ImageRecord]:
+    with reader(conn) as db:
+        cur = db.cursor()
+        cur.execute(
+            f"SELECT {_select_columns(IMAGE_COLUMNS)} FROM images WHERE image_hash = ?",
+            (image_hash,),
+        )
+        return _record(cur)
 
-def get_image_by_id(conn: sqlite3.Connection, img_id: int) -> Optional[Dict[str, Any]]:
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM images WHERE id = ?", (img_id,))
-    row = cur.fetchone()
-    if not row:
-        return None
-    return _row_to_dict(cur, row)
+def get_image_by_id(conn, img_id: int) -> Optional[ImageRecord]:
+    with reader(conn) as db:
+        cur = db.cursor()
+        cur.execute(f"SELECT {_select_columns(IMAGE_COLUMNS)} FROM images WHERE id = ?", (img_id,))
+        return _record(cur)
+
+
+def fetch_image_hashes(conn) -> List[tuple]:
+    """(id, image_hash) for every row that has a hash."""
+    with reader(conn) as db:
+        cur = db.cursor()
+        cur.execute("SELECT id, image_hash FROM images WHERE image_hash IS NOT NULL")
+        return cur.fetchall()
+
+
+def get_images_by_ids(
+    conn,
+    img_ids: List[int],
+    columns: Sequence[str] = IMAGE_COLUMNS,
+) -> List[ImageRecord]:
+    """Rows for `img_ids`, in the given order (missing ids are skipped)."""
+    if not img_ids:
+        return []
+    if "id" not in columns:
+        columns = ("id", *columns)
+    placeholders = ",".join("?" for _ in img_ids)
+    with reader(conn) as db:
+        cur = db.cursor()
+        cur.execute(
+            f"SELECT {_select_columns(columns)} FROM images WHERE id IN ({placeholders})",
+            list(img_ids),
+        )
+        by_id = {row.id: row for row in _records(cur)}
+    return [by_id[i] for i in img_ids if i in by_id]
+
+
+# ------------------------------------------------------------------
+# Perceptual hash bands
+# ------------------------------------------------------------------
+
+def save_hash_bands(conn, image_id: int, bands: List[tuple]) -> None:
+    """Persist (kind, band, value) rows for one image."""
+    with transaction(conn) as db:
+        db.executemany(
+            "INSERT INTO image_hash_bands (image_id, kind, band, value) VALUES (?, ?, ?, ?)",
+            [(image_id, kind, band, value) for kind, band, value in bands],
+        )
 
 
-def fetch_all_images(conn: sqlite3.Connection) -> Iterable[Dict[str, Any]]:
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM images")
-    rows = cur.fetchall()
-    return [_row_to_dict(cur, r) for r in rows]
+def fetch_hash_bands(conn) -> List[tuple]:
+    """All (image_id, kind, band, value) rows."""
+    with reader(conn) as db:
+        cur = db.cursor()
+        cur.execute("SELECT image_id, kind, band, value FROM image_hash_bands")
+        return cur.fetchall()
+
+
+def fetch_images_without_bands(conn) -> List[tuple]:
+    """(id, image_hash, dhash, whash) of images with no band rows yet."""
+    with reader(conn) as db:
+        cur = db.cursor()
+        cur.execute(
+            """
+            SELECT i.id, i.image_hash, i.dhash, i.whash
+            FROM images i
+            WHERE NOT EXISTS (SELECT 1 FROM image_hash_bands b WHERE b.image_id = i.id)
+            """
+        )
+        return cur.fetchall()
+
+
+def fetch_all_images(conn, columns: Sequence[str] = IMAGE_COLUMNS) -> Iterable[ImageRecord]:
+    """Every image row, restricted to `columns`."""
+    with reader(conn) as db:
+        cur = db.cursor()
+        cur.execute(f"SELECT {_select_columns(columns)} FROM images")
+        return _records(cur)
+
+
+def fetch_index_texts(conn) -> List[tuple]:
+    """(id, index_text) of every searchable row: all the search index keeps."""
+    with reader(conn) as db:
+        cur = db.cursor()
+        cur.execute("SELECT id, index_text FROM images WHERE index_text != ''")
+        return cur.fetchall()
+
+
+def _query_trigrams(query: str) -> List[str]:
+    text = query.lower()
+    seen: Dict[str, None] = {}
+    for i in range(len(text) - 2):
+        seen.setdefault(text[i:i + 3], None)
+        if len(seen) >= FTS_MAX_TRIGRAMS:
+            break
+    return list(seen)
+
+
+def fetch_fts_candidate_ids(
+    conn,
+    query: str,
+    limit: int,
+) -> Optional[List[int]]:
+    """
+    Return ids of rows sharing at least one trigram with `query`, best bm25 rank first.
+    Returns None when the query is too short to trigram (< 3 chars),
+    so callers know to fall back to a full scan.
+    """
+    trigrams = _query_trigrams(query)
+    if not trigrams:
+        return None
+
+    match = " OR ".join('"' + t.replace('"', '""') + '"' for t in trigrams)
+    with reader(conn) as db:
+        cur = db.cursor()
+        cur.execute(
+            """
+            SELECT rowid FROM images_fts
+            WHERE images_fts MATCH ?
+            ORDER BY rank
+            LIMIT ?
+            """,
+            (match, limit),
+        )
+        return [int(r[0]) for r in cur.fetchall()]
 
 
 # ------------------------------------------------------------------
@@ -106,7 +523,7 @@ def fetch_all_images(conn: sqlite3.Connection) -> Iterable[Dict[str, Any]]:
 # ------------------------------------------------------------------
 
 def insert_image_for_test(
-    conn: sqlite3.Connection,
+    conn,
     uploader_id: str,
     channel_id: str,
     message_id: str,
@@ -116,41 +533,183 @@ def insert_image_for_test(
     """
     Used ONLY in tests to create dummy entries.
     """
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO images (
-            uploader_id, channel_id, message_id,
-            file_path, user_text, ocr_text, index_text
+    with transaction(conn) as db:
+        cur = db.cursor()
+        cur.execute(
+            """
+            INSERT INTO images (
+                uploader_id, channel_id, message_id,
+                file_path, user_text, ocr_text, index_text
+            )
+            VALUES (?, ?, ?, ?, NULL, NULL, ?)
+            """,
+            (uploader_id, channel_id, message_id, file_path, index_text),
         )
-        VALUES (?, ?, ?, ?, NULL, NULL, ?)
-        """,
-        (uploader_id, channel_id, message_id, file_path, index_text),
-    )
-    conn.commit()
-    return cur.lastrowid
+        img_id = cur.lastrowid
+        row = {
+            "id": img_id,
+            "uploader_id": uploader_id,
+            "channel_id": channel_id,
+            "message_id": message_id,
+            "file_path": file_path,
+            "image_hash": None,
+            "dhash": None,
+            "whash": None,
+            "attachment_id": None,
+            "attachment_url": None,
+            "user_text": None,
+            "ocr_text": None,
+            "index_text": index_text,
+        }
+        # In-memory indexes only hear about rows that actually committed.
+        after_commit(db, lambda: _notify_insert(conn, row))
+    return img_id
 
 
 
 
 # ------------------------------------------------------------------
-# Row conversion
+# Random selection
+# ------------------------------------------------------------------
+
+def get_image_id_range(conn) -> Optional[tuple]:
+    """(min id, max id) of stored images, or None when empty. Two rowid lookups."""
+    with reader(conn) as db:
+        lo, hi = db.execute("SELECT MIN(id), MAX(id) FROM images").fetchone()
+    return None if lo is None else (lo, hi)
+
+
+def get_random_image(conn, rng: Optional[random.Random] = None) -> Optional[ImageRecord]:
+    """
+    Return a random image record, or None if no images are stored.
+
+    Picks a random id between MIN(id) and MAX(id) and retries on holes left by
+    deleted rows; after RANDOM_ID_ATTEMPTS misses it takes the next id up.
+    Each probe is a primary-key lookup, unlike ORDER BY RANDOM() which sorts
+    the whole table.
+    """
+    rng = rng or random
+    id_range = get_image_id_range(conn)
+    if id_range is None:
+        return None
+    lo, hi = id_range
+
+    for _ in range(RANDOM_ID_ATTEMPTS):
+        row = get_image_by_id(conn, rng.randint(lo, hi))
+        if row is not None:
+            return row
+
+    with reader(conn) as db:
+        cur = db.cursor()
+        cur.execute(
+            f"SELECT {_select_columns(IMAGE_COLUMNS)} FROM images WHERE id >= ? ORDER BY id LIMIT 1",
+            (rng.randint(lo, hi),),
+        )
+        return _record(cur)
+
+
+# ------------------------------------------------------------------
+# Shuffle cycles
 # ------------------------------------------------------------------
 
-def _row_to_dict(cur: sqlite3.Cursor, row: sqlite3.Row) -> Dict[str, Any]:
-    col_names = [desc[0] for desc in cur.description]
-    return {col: row[idx] for idx, col in enumerate(col_names)}
+def load_shuffle_cycle(conn, channel_id: str) -> Optional[tuple]:
+    """(remaining, base, top) of the channel's current cycle, or None."""
+    with reader(conn) as db:
+        return db.execute(
+            "SELECT remaining, base, top FROM shuffle_cycles WHERE channel_id = ?", (channel_id,)
+        ).fetchone()
+
+
+def save_shuffle_cycle(conn, channel_id: str, remaining: int, base: int, top: int) -> None:
+    with transaction(conn) as db:
+        db.execute(
+            """
+            INSERT INTO shuffle_cycles (channel_id, remaining, base, top) VALUES (?, ?, ?, ?)
+            ON CONFLICT(channel_id) DO UPDATE SET
+                remaining = excluded.remaining, base = excluded.base, top = excluded.top,
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            (channel_id, remaining, base, top),
+        )
+
+
+def get_shuffle_slot(conn, channel_id: str, position: int) -> Optional[int]:
+    with reader(conn) as db:
+        row = db.execute(
+            "SELECT image_id FROM shuffle_slots WHERE channel_id = ? AND position = ?", (channel_id, position)
+        ).fetchone()
+    return row[0] if row else None
+
+
+def set_shuffle_slot(conn, channel_id: str, position: int, image_id: int) -> None:
+    with transaction(conn) as db:
+        db.execute(
+            "INSERT OR REPLACE INTO shuffle_slots (channel_id, position, image_id) VALUES (?, ?, ?)",
+            (channel_id, position, image_id),
+        )
+
+
+def delete_shuffle_slots(conn, channel_id: str, from_position: int = 0) -> None:
+    """Drop the channel's slots at `from_position` and above."""
+    with transaction(conn) as db:
+        db.execute(
+            "DELETE FROM shuffle_slots WHERE channel_id = ? AND position >= ?", (channel_id, from_position)
+        )
 
 
 # ------------------------------------------------------------------
-# Random selection
+# Send derivatives
 # ------------------------------------------------------------------
 
-def get_random_image(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
-    """Return a random image record, or None if no images are stored."""
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM images ORDER BY RANDOM() LIMIT 1")
-    row = cur.fetchone()
-    if not row:
-        return None
-    return _row_to_dict(cur, row)
+def get_derivative(conn, image_id: int) -> Optional[tuple]:
+    """(file_path, bytes, last_used) of the image's derivative, if one is recorded."""
+    with reader(conn) as db:
+        return db.execute(
+            "SELECT file_path, bytes, last_used FROM image_derivatives WHERE image_id = ?", (image_id,)
+        ).fetchone()
+
+
+def save_derivative(conn, image_id: int, file_path: str, size: int, now: int) -> None:
+    with transaction(conn) as db:
+        db.execute(
+            """
+            INSERT INTO image_derivatives (image_id, file_path, bytes, last_used) VALUES (?, ?, ?, ?)
+            ON CONFLICT(image_id) DO UPDATE SET
+                file_path = excluded.file_path, bytes = excluded.bytes, last_used = excluded.last_used
+            """,
+            (image_id, file_path, size, now),
+        )
+
+
+def touch_derivative(conn, image_id: int, now: int) -> None:
+    with transaction(conn) as db:
+        db.execute("UPDATE image_derivatives SET last_used = ? WHERE image_id = ?", (now, image_id))
+
+
+def delete_derivative(conn, image_id: int) -> None:
+    with transaction(conn) as db:
+        db.execute("DELETE FROM image_derivatives WHERE image_id = ?", (image_id,))
+
+
+def derivative_total_bytes(conn) -> int:
+    with reader(conn) as db:
+        return db.execute("SELECT COALESCE(SUM(bytes), 0) FROM image_derivatives").fetchone()[0]
+
+
+def pop_least_recent_derivatives(conn, free_bytes: int) -> List[str]:
+    """
+    Forget least-recently-used derivatives until at least `free_bytes` are
+    released; returns their file paths for the caller to delete.
+    """
+    paths: List[str] = []
+    with transaction(conn) as db:
+        cur = db.execute("SELECT image_id, file_path, bytes FROM image_derivatives ORDER BY last_used, image_id")
+        evicted = []
+        for image_id, file_path, size in cur:
+            if free_bytes <= 0:
+                break
+            evicted.append(image_id)
+            paths.append(file_path)
+            free_bytes -= size
+        db.executemany("DELETE FROM image_derivatives WHERE image_id = ?", [(i,) for i in evicted])
+    return paths
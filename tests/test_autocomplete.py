@@ -0,0 +1,47 @@
+# tests/test_autocomplete.py
+from autocomplete import AutocompleteCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_longest_prefix_hit_and_counters():
+    cache = AutocompleteCache(clock=FakeClock())
+    cache.put("u1", "ca", [{"id": 1}, {"id": 2}])
+    cache.put("u1", "cat", [{"id": 1}])
+
+    assert cache.get("u1", "cats").prefix == "cat"
+    assert cache.get("u1", "cab").prefix == "ca"
+    assert cache.get("u2", "cat") is None
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = AutocompleteCache(ttl=10, clock=clock)
+    cache.put("u1", "cat", [{"id": 1}])
+
+    clock.now = 9.9
+    assert cache.get("u1", "cat") is not None
+
+    clock.now = 10.0
+    assert cache.get("u1", "cat") is None
+    assert len(cache) == 0
+
+
+def test_lru_eviction():
+    cache = AutocompleteCache(max_entries=2, clock=FakeClock())
+    cache.put("u1", "a", [])
+    cache.put("u1", "b", [])
+    cache.get("u1", "a")  # refresh "a"
+    cache.put("u1", "c", [])
+
+    assert cache.get("u1", "b") is None
+    assert cache.get("u1", "a") is not None
+    assert cache.stats()["evictions"] == 1
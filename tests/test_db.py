@@ -0,0 +1,102 @@
+# tests/test_db.py
+import sqlite3
+import threading
+
+import pytest
+
+from db import Database, reader, transaction, writer
+from search import search_best_match
+from storage import init_db, insert_image_for_test, get_image_by_id
+
+
+@pytest.fixture
+def database(tmp_path):
+    db = Database(str(tmp_path / "images.db"), readers=2)
+    init_db(db)
+    yield db
+    db.close()
+
+
+def test_pragmas_applied(database):
+    with database.writer() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+    with database.reader() as conn:
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+
+
+def test_readers_are_read_only(database):
+    with database.reader() as conn:
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM images")
+
+
+def test_storage_functions_route_through_database(database):
+    img_id = insert_image_for_test(database, "u1", "c1", "m1", "/tmp/1.png", "cat on sofa")
+
+    assert get_image_by_id(database, img_id)["index_text"] == "cat on sofa"
+    assert search_best_match(database, "cat on sofa")[0]["id"] == img_id
+
+
+def test_reads_do_not_wait_for_writer(database):
+    insert_image_for_test(database, "u1", "c1", "m1", "/tmp/1.png", "cat on sofa")
+
+    holding = threading.Event()
+    release = threading.Event()
+
+    def hold_writer():
+        with database.writer() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE images SET index_text = 'dog' WHERE id = 1")
+            holding.set()
+            release.wait(5)
+            conn.commit()
+
+    t = threading.Thread(target=hold_writer)
+    t.start()
+    try:
+        assert holding.wait(5)
+        # Writer lock and the SQLite write lock are both held; reads still see the last commit.
+        assert get_image_by_id(database, 1)["index_text"] == "cat on sofa"
+    finally:
+        release.set()
+        t.join()
+    assert get_image_by_id(database, 1)["index_text"] == "dog"
+
+
+def test_writer_rolls_back_on_error(database):
+    with pytest.raises(RuntimeError):
+        with writer(database) as conn:
+            conn.execute(
+                "INSERT INTO images (uploader_id, channel_id, message_id, file_path, index_text) "
+                "VALUES ('u', 'c', 'm', '/tmp/x.png', 'x')"
+            )
+            raise RuntimeError("boom")
+
+    with reader(database) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM images").fetchone()[0] == 0
+
+
+def test_in_memory_database_reads_through_writer():
+    db = Database(":memory:")
+    init_db(db)
+    img_id = insert_image_for_test(db, "u1", "c1", "m1", "/tmp/1.png", "cat")
+    assert get_image_by_id(db, img_id)["index_text"] == "cat"
+    db.close()
+
+
+def test_nested_transaction_rolls_back_only_inner_block(database):
+    with transaction(database):
+        insert_image_for_test(database, "u1", "c1", "m1", "/tmp/1.png", "kept")
+        with pytest.raises(RuntimeError):
+            with transaction(database) as conn:
+                conn.execute(
+                    "INSERT INTO images (uploader_id, channel_id, message_id, file_path, index_text) "
+                    "VALUES ('u', 'c', 'm2', '/tmp/2.png', 'dropped')"
+                )
+                raise RuntimeError("boom")
+
+    with reader(database) as conn:
+        texts = [r[0] for r in conn.execute("SELECT index_text FROM images")]
+    assert texts == ["kept"]
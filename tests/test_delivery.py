@@ -0,0 +1,186 @@
+# tests/test_delivery.py
+import time
+from collections import OrderedDict
+
+import pytest
+
+import delivery
+from delivery import is_url_fresh, send_image, respond_with_image, url_resolves
+from storage import insert_image_for_test, get_image_by_id, update_image_attachment
+
+
+def _cdn_url(expires_at: int) -> str:
+    return f"https://cdn.discordapp.com/attachments/1/2/a.png?ex={expires_at:x}&is=0&hm=abc"
+
+
+class FakeDiscordFile:
+    def __init__(self, path):
+        self.path = path
+
+
+class FakeAttachment:
+    def __init__(self, attachment_id, url):
+        self.id = attachment_id
+        self.url = url
+
+
+class FakeSentMessage:
+    def __init__(self, attachments):
+        self.attachments = attachments
+
+
+class FakeChannel:
+    def __init__(self, upload_url):
+        self.sent = []
+        self.upload_url = upload_url
+
+    async def send(self, content=None, file=None, embed=None):
+        self.sent.append({"content": content, "file": file, "embed": embed})
+        return FakeSentMessage([FakeAttachment(555, self.upload_url)] if file else [])
+
+
+@pytest.fixture(autouse=True)
+def live_urls(monkeypatch):
+    """Recorded URLs resolve unless a test says otherwise (no network in tests)."""
+    checked = []
+
+    async def fake_url_resolves(url):
+        checked.append(url)
+        return True
+
+    monkeypatch.setattr("delivery.url_resolves", fake_url_resolves)
+    return checked
+
+
+def test_url_freshness():
+    now = int(time.time())
+    assert is_url_fresh(_cdn_url(now + 86400), now=now)
+    assert not is_url_fresh(_cdn_url(now + 60), now=now)
+    assert is_url_fresh("https://example.com/a.png", now=now)
+    assert not is_url_fresh(None)
+
+
+@pytest.mark.asyncio
+async def test_send_uploads_then_reuses_url(conn, monkeypatch, live_urls):
+    monkeypatch.setattr("discord.File", FakeDiscordFile)
+    img_id = insert_image_for_test(conn, "u", "c", "m", "/tmp/a.png", "cat")
+    row = get_image_by_id(conn, img_id)
+
+    channel = FakeChannel(_cdn_url(int(time.time()) + 86400))
+
+    await send_image(channel, conn, row)
+    assert channel.sent[0]["file"].path == "/tmp/a.png"
+    assert get_image_by_id(conn, img_id)["attachment_url"] == channel.upload_url
+
+    await send_image(channel, conn, row)
+    assert channel.sent[1]["file"] is None
+    assert channel.sent[1]["embed"].image.url == channel.upload_url
+    assert live_urls == [channel.upload_url]
+
+
+@pytest.mark.asyncio
+async def test_stale_url_falls_back_to_upload(conn, monkeypatch):
+    monkeypatch.setattr("discord.File", FakeDiscordFile)
+    img_id = insert_image_for_test(conn, "u", "c", "m", "/tmp/a.png", "cat")
+    row = dict(get_image_by_id(conn, img_id), attachment_url=_cdn_url(int(time.time()) - 10))
+
+    class FakeResponse:
+        def __init__(self):
+            self.sent = []
+
+        async def send_message(self, **kwargs):
+            self.sent.append(kwargs)
+
+    class FakeInteraction:
+        def __init__(self):
+            self.response = FakeResponse()
+
+        async def original_response(self):
+            return FakeSentMessage([FakeAttachment(9, "https://cdn.example/new.png")])
+
+    interaction = FakeInteraction()
+    await respond_with_image(interaction, conn, row)
+
+    assert interaction.response.sent[0]["file"].path == "/tmp/a.png"
+    assert get_image_by_id(conn, img_id)["attachment_id"] == "9"
+
+
+@pytest.mark.asyncio
+async def test_dead_url_is_forgotten_and_image_uploaded(conn, monkeypatch):
+    monkeypatch.setattr("discord.File", FakeDiscordFile)
+
+    async def deleted(url):
+        return False
+
+    monkeypatch.setattr("delivery.url_resolves", deleted)
+    img_id = insert_image_for_test(conn, "u", "c", "m", "/tmp/a.png", "cat")
+    dead_url = _cdn_url(int(time.time()) + 86400)
+    update_image_attachment(conn, img_id, "1", dead_url)
+    row = get_image_by_id(conn, img_id)
+
+    channel = FakeChannel(_cdn_url(int(time.time()) + 2 * 86400))
+    await send_image(channel, conn, row)
+
+    assert channel.sent[0]["embed"] is None
+    assert channel.sent[0]["file"].path == "/tmp/a.png"
+    assert get_image_by_id(conn, img_id)["attachment_url"] == channel.upload_url
+
+
+@pytest.mark.asyncio
+async def test_url_check_reuses_session_and_caches_hits(monkeypatch):
+    heads = []
+
+    class FakeSession:
+        closed = False
+
+    async def fake_head_status(session, url):
+        heads.append((session, url))
+        return 404 if "gone" in url else 200
+
+    session = FakeSession()
+    monkeypatch.setattr(delivery, "_head_status", fake_head_status)
+    monkeypatch.setattr(delivery, "_checked_urls", OrderedDict())
+    monkeypatch.setattr(delivery, "_http_session", session)
+
+    live = _cdn_url(int(time.time()) + 86400)
+    assert await url_resolves(live)
+    assert await url_resolves(live)
+    assert heads == [(session, live)]  # the second send trusted the recent check
+
+    gone = live + "&gone"
+    assert not await url_resolves(gone)
+    assert not await url_resolves(gone)
+    assert len(heads) == 3  # misses are never cached
+
+
+@pytest.mark.asyncio
+async def test_unchecked_url_is_checked_after_deferring(conn, monkeypatch):
+    img_id = insert_image_for_test(conn, "u", "c", "m", "/tmp/a.png", "cat")
+    url = _cdn_url(int(time.time()) + 86400)
+    update_image_attachment(conn, img_id, "1", url)
+    row = get_image_by_id(conn, img_id)
+    events = []
+
+    async def checked(url):
+        events.append("check")
+        return True
+
+    monkeypatch.setattr("delivery.url_resolves", checked)
+
+    class FakeResponse:
+        async def defer(self, **kwargs):
+            events.append("defer")
+
+        async def send_message(self, **kwargs):
+            events.append("send_message")
+
+    class FakeFollowup:
+        async def send(self, **kwargs):
+            events.append(("followup", kwargs["embed"].image.url))
+
+    class FakeInteraction:
+        response = FakeResponse()
+        followup = FakeFollowup()
+
+    await respond_with_image(FakeInteraction(), conn, row)
+    assert events == ["defer", "check", ("followup", url)]
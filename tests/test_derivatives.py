@@ -0,0 +1,184 @@
+# tests/test_derivatives.py
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from delivery import respond_with_image, send_image
+from derivatives import DerivativePolicy, ensure_derivative, evict_derivatives
+from storage import derivative_total_bytes, get_derivative, get_image_by_id, insert_image_for_test
+
+
+POLICY = DerivativePolicy(max_bytes=64 * 1024, max_side=512, min_side=64)
+
+
+def _noisy_png(path, side=600, seed=0):
+    rng = np.random.default_rng(seed)
+    Image.fromarray(rng.integers(0, 255, size=(side, side, 3), dtype=np.uint8)).save(path)
+    return str(path)
+
+
+def _row(conn, path):
+    img_id = insert_image_for_test(conn, "u", "c", "m", path, "cat")
+    return get_image_by_id(conn, img_id)
+
+
+def test_large_image_gets_derivative_within_budget(conn, tmp_path):
+    row = _row(conn, _noisy_png(tmp_path / "big.png"))
+    assert os.path.getsize(row["file_path"]) > POLICY.max_bytes
+
+    path = ensure_derivative(conn, row, policy=POLICY, now=100)
+    assert path == str(tmp_path / "big.send.webp")
+    assert os.path.getsize(path) <= POLICY.max_bytes
+    with Image.open(path) as img:
+        assert img.format == "WEBP"
+        assert max(img.size) <= POLICY.max_side
+    assert get_derivative(conn, row["id"]) == (path, os.path.getsize(path), 100)
+
+
+def test_derivative_is_reused(conn, tmp_path, monkeypatch):
+    row = _row(conn, _noisy_png(tmp_path / "big.png"))
+    path = ensure_derivative(conn, row, policy=POLICY, now=100)
+
+    monkeypatch.setattr("derivatives.encode_derivative", lambda *a: pytest.fail("re-encoded"))
+    assert ensure_derivative(conn, row, policy=POLICY, now=100 + 2 * 3600) == path
+    assert get_derivative(conn, row["id"])[2] == 100 + 2 * 3600
+
+
+def test_small_or_missing_image_has_no_derivative(conn, tmp_path):
+    small = tmp_path / "small.png"
+    Image.new("RGB", (32, 32)).save(small)
+    assert ensure_derivative(conn, _row(conn, str(small)), policy=POLICY) is None
+    assert ensure_derivative(conn, _row(conn, str(tmp_path / "gone.png")), policy=POLICY) is None
+    assert derivative_total_bytes(conn) == 0
+
+
+def test_eviction_drops_least_recently_used(conn, tmp_path):
+    rows = [_row(conn, _noisy_png(tmp_path / f"{i}.png", seed=i)) for i in range(3)]
+    paths = [ensure_derivative(conn, row, policy=POLICY, now=100 + i) for i, row in enumerate(rows)]
+    sizes = [os.path.getsize(p) for p in paths]
+
+    evicted = evict_derivatives(conn, cache_max_bytes=sizes[1] + sizes[2])
+    assert evicted == [paths[0]]
+    assert not os.path.exists(paths[0])
+    assert get_derivative(conn, rows[0]["id"]) is None
+    assert derivative_total_bytes(conn) == sizes[1] + sizes[2]
+
+
+class FakeDiscordFile:
+    def __init__(self, path):
+        self.path = path
+
+
+class FakeChannel:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, **kwargs):
+        self.sent.append(kwargs)
+
+
+@pytest.mark.asyncio
+async def test_send_uploads_derivative(conn, tmp_path, monkeypatch):
+    monkeypatch.setattr("discord.File", FakeDiscordFile)
+    monkeypatch.setattr("derivatives._derivative_policy", POLICY)
+    row = _row(conn, _noisy_png(tmp_path / "big.png"))
+
+    channel = FakeChannel()
+    await send_image(channel, conn, row)
+    assert channel.sent[0]["file"].path == str(tmp_path / "big.send.webp")
+
+
+class FakeFollowup:
+    def __init__(self, events):
+        self.events = events
+
+    async def send(self, **kwargs):
+        self.events.append(("followup", kwargs))
+
+
+class FakeResponse:
+    def __init__(self, events):
+        self.events = events
+
+    async def defer(self, **kwargs):
+        self.events.append(("defer", kwargs))
+
+    async def send_message(self, **kwargs):
+        self.events.append(("send_message", kwargs))
+
+
+class FakeInteraction:
+    def __init__(self):
+        self.events = []
+        self.response = FakeResponse(self.events)
+        self.followup = FakeFollowup(self.events)
+
+
+@pytest.mark.asyncio
+async def test_response_is_deferred_before_encoding(conn, tmp_path, monkeypatch):
+    monkeypatch.setattr("discord.File", FakeDiscordFile)
+    monkeypatch.setattr("derivatives._derivative_policy", POLICY)
+    row = _row(conn, _noisy_png(tmp_path / "big.png"))
+
+    interaction = FakeInteraction()
+    await respond_with_image(interaction, conn, row, ephemeral=True)
+    assert [name for name, _ in interaction.events] == ["defer", "followup"]
+    assert interaction.events[1][1]["file"].path == str(tmp_path / "big.send.webp")
+
+    # The derivative now exists, so the next response goes out directly.
+    interaction = FakeInteraction()
+    await respond_with_image(interaction, conn, row, ephemeral=True)
+    assert [name for name, _ in interaction.events] == ["send_message"]
+
+
+@pytest.mark.asyncio
+async def test_evicted_derivative_falls_back_to_original(conn, tmp_path, monkeypatch):
+    monkeypatch.setattr("derivatives._derivative_policy", POLICY)
+    source = _noisy_png(tmp_path / "big.png")
+    row = _row(conn, source)
+
+    async def evicted(*args, **kwargs):
+        # Chosen, then evicted before the upload opened it.
+        return str(tmp_path / "big.send.webp")
+
+    monkeypatch.setattr("delivery.send_path_async", evicted)
+
+    channel = FakeChannel()
+    await send_image(channel, conn, row)
+    file = channel.sent[0]["file"]
+    assert file.fp.name == source
+    file.close()
+
+
+@pytest.mark.asyncio
+async def test_cpu_pool_only_encodes(tmp_path, monkeypatch):
+    import sqlite3
+
+    from executors import BotExecutors
+    from storage import init_db
+
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    init_db(conn)
+    monkeypatch.setattr("discord.File", FakeDiscordFile)
+    monkeypatch.setattr("derivatives._derivative_policy", POLICY)
+    row = _row(conn, _noisy_png(tmp_path / "big.png"))
+    executors = BotExecutors(db_workers=1, cpu_workers=1)
+    on_cpu = []
+    real_run_cpu = executors.run_cpu
+
+    async def recording_run_cpu(fn, *args, **kwargs):
+        on_cpu.append((fn.__name__, args))
+        return await real_run_cpu(fn, *args, **kwargs)
+
+    monkeypatch.setattr(executors, "run_cpu", recording_run_cpu)
+
+    channel = FakeChannel()
+    await send_image(channel, conn, row, executors=executors)
+    executors.shutdown()
+
+    assert channel.sent[0]["file"].path == str(tmp_path / "big.send.webp")
+    # The encode gets paths only; derivative bookkeeping stays on the db pool.
+    assert on_cpu == [("write_derivative", (row["file_path"], None))]
+    assert get_derivative(conn, row["id"])[0] == str(tmp_path / "big.send.webp")
@@ -0,0 +1,35 @@
+# tests/test_executors.py
+import threading
+
+import pytest
+
+from executors import BotExecutors, call_db
+
+
+@pytest.fixture
+def executors():
+    ex = BotExecutors(db_workers=2, cpu_workers=1)
+    yield ex
+    ex.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_run_db_runs_off_loop_thread_holding_lock(executors):
+    loop_thread = threading.get_ident()
+
+    def probe():
+        # RLock._is_owned is private, so check by trying a non-blocking acquire from another thread.
+        acquired = []
+        t = threading.Thread(target=lambda: acquired.append(executors.conn_lock.acquire(blocking=False)))
+        t.start()
+        t.join()
+        return threading.get_ident(), acquired[0]
+
+    thread_id, other_could_acquire = await executors.run_db(probe)
+    assert thread_id != loop_thread
+    assert other_could_acquire is False
+
+
+@pytest.mark.asyncio
+async def test_call_db_runs_inline_without_executors():
+    assert await call_db(None, lambda a, b=0: a + b, 1, b=2) == 3
@@ -0,0 +1,116 @@
+# tests/test_hash_index.py
+import random
+
+import hash_index
+from bot import index_image_from_message, SimpleMessage
+from hash_index import MultiIndexHash, hamming, load_hash_index, find_near_duplicate
+from storage import save_image_record
+
+
+def test_multi_index_hash_matches_linear_scan():
+    rng = random.Random(0)
+    values = [rng.getrandbits(64) for _ in range(2000)]
+    index = MultiIndexHash()
+    for i, v in enumerate(values):
+        index.add(v, i)
+
+    query = values[123] ^ 0b1011  # 3 bits flipped
+    expected = sorted((hamming(query, v), i) for i, v in enumerate(values) if hamming(query, v) <= 11)
+    assert index.search(query, 11) == expected
+    assert index.search(query, 11)[0] == (3, 123)
+
+
+def test_multi_index_hash_checks_few_candidates_at_scale(monkeypatch):
+    rng = random.Random(1)
+    index = MultiIndexHash()
+    n = 100_000
+    for i in range(n):
+        index.add(rng.getrandbits(64), i)
+
+    checked = []
+    monkeypatch.setattr(hash_index, "hamming", lambda a, b: checked.append(b) or hamming(a, b))
+    for _ in range(100):
+        index.search(rng.getrandbits(64), 6)
+    # Each query verifies only the ids in a few buckets near its chunks,
+    # not a linear scan: well under 1% of the index.
+    assert len(checked) / 100 < n / 100
+
+
+def test_near_duplicate_found_after_insert(conn):
+    load_hash_index(conn)
+    img_id = save_image_record(
+        conn, uploader_id="u", channel_id="c", message_id="m",
+        file_path="/tmp/a.png", user_text="a", ocr_text=None,
+        image_hash="ffff0000ffff0000",
+    )
+
+    assert find_near_duplicate(conn, "ffff0000ffff0003", max_distance=2) == img_id
+    assert find_near_duplicate(conn, "ffff0000ffff0007", max_distance=2) is None
+    assert find_near_duplicate(conn, "ffff0000ffff0003", max_distance=0) is None
+    assert find_near_duplicate(conn, "invalid_image_hash", max_distance=2) is None
+
+
+def test_index_skips_ocr_for_near_duplicate(tmp_path, conn, monkeypatch):
+    hashes = iter(["ffff0000ffff0000", "ffff0000ffff0001"])
+    monkeypatch.setattr("bot.compute_image_hash", lambda path: next(hashes))
+    ocr_calls = []
+    monkeypatch.setattr("bot.extract_text", lambda path: ocr_calls.append(path) or "text")
+
+    msg = SimpleMessage(content="", author_id=1, channel_id=2, message_id=3)
+    first = tmp_path / "a.png"
+    first.write_bytes(b"a")
+    second = tmp_path / "b.png"
+    second.write_bytes(b"b")
+
+    id1 = index_image_from_message(conn, msg, str(first))
+    assert index_image_from_message(conn, msg, str(second)) == -id1
+    assert ocr_calls == [str(first)]
+    assert not second.exists()
+
+
+
+def test_band_index_finds_similar_and_backfills_old_rows(conn):
+    from hash_index import BandIndex, load_band_index, find_similar
+    from storage import fetch_hash_bands
+
+    # Row stored before banding existed: phash only, no band rows.
+    old_id = save_image_record(
+        conn, uploader_id="u", channel_id="c", message_id="m1",
+        file_path="/tmp/old.png", user_text=None, ocr_text=None,
+        image_hash="0123456789abcdef",
+    )
+    load_band_index(conn)
+    assert {r[0] for r in fetch_hash_bands(conn)} == {old_id}
+
+    new_id = save_image_record(
+        conn, uploader_id="u", channel_id="c", message_id="m2",
+        file_path="/tmp/new.png", user_text=None, ocr_text=None,
+        image_hash="fedcba9876543210", dhash="00000000ffffffff", whash=None,
+    )
+
+    query = {"phash": "0123456789abcdee", "dhash": None, "whash": None}
+    assert find_similar(conn, query) == [(1.0, old_id)]
+
+    query = {"phash": None, "dhash": "00000000fffffff0", "whash": None}
+    assert find_similar(conn, query) == [(4.0, new_id)]
+
+    # Bands survive a reload from SQLite alone.
+    assert BandIndex.load(conn).query({"phash": "0123456789abcdef"}) == [(0.0, old_id)]
+
+
+def test_similar_images_without_text_are_told_apart(conn):
+    from bot import find_similar_images, format_select_option
+
+    image_id = save_image_record(
+        conn, uploader_id="u", channel_id="c", message_id="m1",
+        file_path="/tmp/a.png", user_text=None, ocr_text=None,
+        image_hash="0123456789abcdef",
+    )
+    hash_index.load_band_index(conn)
+
+    [(distance, row)] = find_similar_images(conn, {"phash": "0123456789abcdee", "dhash": None, "whash": None})
+    assert (distance, row["id"]) == (1.0, image_id)
+    assert format_select_option(row, distance) == (
+        f"#{image_id} (no text)", f"#{image_id} · Hamming distance 1.0",
+    )
+    assert format_select_option(row) == (f"#{image_id} (no text)", None)
@@ -0,0 +1,46 @@
+# tests/test_image_store.py
+from pathlib import Path
+
+from image_store import ImageStore, is_store_path, migrate_to_store
+from storage import get_image_by_id, insert_image_for_test
+
+
+def test_put_shards_by_content_and_stores_bytes_once(tmp_path: Path):
+    store = ImageStore(str(tmp_path))
+
+    first = store.put(b"same bytes", "cat.PNG")
+    second = store.put(b"same bytes", "other-name.png")
+
+    assert first == second
+    assert is_store_path(first)
+    digest = first.rsplit("/", 1)[1].split(".")[0]
+    assert first == f"{digest[:2]}/{digest[2:4]}/{digest}.png"
+    assert Path(store.resolve(first)).read_bytes() == b"same bytes"
+    assert len([p for p in tmp_path.rglob("*") if p.is_file()]) == 1
+
+
+def test_resolve_handles_absolute_and_legacy_paths(tmp_path: Path):
+    store = ImageStore(str(tmp_path))
+
+    assert store.resolve("/abs/img.png") == "/abs/img.png"
+    assert store.resolve("data/images/123_cat.png") == str(tmp_path / "123_cat.png")
+
+
+def test_migrate_moves_flat_files_into_store(tmp_path: Path, conn):
+    store = ImageStore(str(tmp_path))
+    (tmp_path / "1_cat.png").write_bytes(b"cat bytes")
+    (tmp_path / "1_cat.png.txt").write_text("ocr")
+
+    moved = insert_image_for_test(conn, "u", "c", "1", "data/images/1_cat.png", "cat")
+    lost = insert_image_for_test(conn, "u", "c", "2", "data/images/2_gone.png", "gone")
+
+    assert migrate_to_store(conn, store) == (1, 1)
+
+    new_path = get_image_by_id(conn, moved)["file_path"]
+    assert is_store_path(new_path)
+    assert Path(store.resolve(new_path)).read_bytes() == b"cat bytes"
+    assert not (tmp_path / "1_cat.png").exists()
+    assert not (tmp_path / "1_cat.png.txt").exists()
+    assert get_image_by_id(conn, lost)["file_path"] == "data/images/2_gone.png"
+
+    assert migrate_to_store(conn, store) == (0, 1)  # re-running is a no-op
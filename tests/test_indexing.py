@@ -1,6 +1,8 @@
 # tests/test_indexing.py
 from pathlib import Path
 
+import pytest
+
 from bot import index_image_from_message, SimpleMessage
 from storage import get_image_by_id
 
@@ -48,3 +50,109 @@ def test_index_image_with_only_ocr(tmp_path: Path, conn, monkeypatch):
     assert row["ocr_text"] == "ocr only"
     assert row["index_text"] == "ocr only"
 
+
+
+def _png_bytes(seed: int) -> bytes:
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 255, size=(64, 64, 3), dtype=np.uint8)
+    ok, buf = cv2.imencode(".png", img)
+    assert ok
+    return buf.tobytes()
+
+
+@pytest.mark.asyncio
+async def test_index_attachment_decodes_once_and_skips_duplicate_write(tmp_path: Path, monkeypatch):
+    import numpy as np
+    import sqlite3
+
+    from bot import index_attachment_async
+    from executors import BotExecutors
+    from storage import init_db
+
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    init_db(conn)
+    executors = BotExecutors(db_workers=1, cpu_workers=1)
+
+    ocr_inputs = []
+
+    def fake_ocr(source):
+        ocr_inputs.append(source)
+        return "ocr words"
+
+    monkeypatch.setattr("bot.extract_text", fake_ocr)
+
+    data = _png_bytes(1)
+    message = SimpleMessage(content="", author_id=1, channel_id=2, message_id=3)
+
+    first = tmp_path / "first.png"
+    img_id = await index_attachment_async(executors, conn, message, data, str(first))
+    assert img_id > 0
+    assert first.read_bytes() == data
+    assert isinstance(ocr_inputs[0], np.ndarray)
+    row = get_image_by_id(conn, img_id)
+    assert row["dhash"] and row["whash"]
+
+    second = tmp_path / "second.png"
+    assert await index_attachment_async(executors, conn, message, data, str(second)) == -img_id
+    assert not second.exists()
+    assert len(ocr_inputs) == 1
+
+    executors.shutdown()
+    conn.close()
+
+
+@pytest.mark.asyncio
+async def test_index_attachments_indexes_all_and_summarizes(tmp_path: Path, monkeypatch):
+    import sqlite3
+
+    from bot import index_attachments_async, format_ingest_summary
+    from executors import BotExecutors
+    from storage import init_db
+
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    init_db(conn)
+    executors = BotExecutors(db_workers=1, cpu_workers=2)
+    monkeypatch.setattr("bot.extract_text", lambda source: "some text")
+
+    class FakeAttachment:
+        def __init__(self, filename, data):
+            self.filename = filename
+            self._data = data
+
+        async def read(self):
+            if self._data is None:
+                raise IOError("download failed")
+            return self._data
+
+    attachments = [
+        FakeAttachment("a.png", _png_bytes(1)),
+        FakeAttachment("b.png", _png_bytes(2)),
+        FakeAttachment("a_again.png", _png_bytes(1)),
+        FakeAttachment("broken.png", None),
+    ]
+    message = SimpleMessage(content="", author_id=1, channel_id=2, message_id=9)
+
+    results = await index_attachments_async(
+        executors, conn, message, attachments, str(tmp_path), concurrency=2
+    )
+
+    assert [r.filename for r in results] == ["a.png", "b.png", "a_again.png", "broken.png"]
+    assert results[0].image_id and results[1].image_id
+    assert results[2].duplicate and results[2].image_id == results[0].image_id
+    assert results[3].error == "download failed"
+
+    from image_store import ImageStore, is_store_path
+    stored = get_image_by_id(conn, results[0].image_id)["file_path"]
+    assert is_store_path(stored)
+    assert Path(ImageStore(str(tmp_path)).resolve(stored)).read_bytes() == _png_bytes(1)
+
+    summary = format_ingest_summary(results)
+    assert summary.splitlines()[0] == "Indexed 2 of 4 image(s):"
+    assert f"#{results[1].image_id} b.png: OCR: some text" in summary
+    assert "duplicate" in summary
+
+    executors.shutdown()
+    conn.close()
@@ -23,3 +23,53 @@ def test_extract_text_invalid_image(monkeypatch):
 
     text = ocr.extract_text("fake.png")
     assert text == ""
+
+
+def test_extract_text_batch_runs_one_predict(monkeypatch):
+    calls = []
+
+    class FakeReader:
+        def predict(self, imgs):
+            calls.append(list(imgs))
+            return [{"rec_texts": [f"text {img}"]} for img in imgs]
+
+    monkeypatch.setattr(ocr, "get_reader", lambda: FakeReader())
+    monkeypatch.setattr(ocr, "preprocess_image", lambda path: None if path == "bad.png" else path)
+
+    texts = ocr.extract_text_batch(["a.png", "bad.png", "b.png"])
+    assert texts == ["text a.png", "", "text b.png"]
+    assert calls == [["a.png", "b.png"]]
+
+
+def test_resize_policy_upscales_small_images():
+    policy = ocr.ResizePolicy(upscale_below=1000, upscale_factor=2.0, max_side=4000, max_pixels=10**8)
+    assert policy.scale_for(400, 600) == 2.0
+    assert policy.scale_for(1080, 1920) == 1.0
+
+
+def test_resize_policy_caps_side_and_pixels():
+    policy = ocr.ResizePolicy(upscale_below=1000, max_side=2000, max_pixels=3_000_000)
+    assert policy.scale_for(2160, 3840) == 2000 / 3840
+
+    scale = policy.scale_for(1900, 1900)
+    assert 1900 * 1900 * scale * scale <= 3_000_000 * 1.0001
+
+
+def test_resize_for_ocr_applies_policy():
+    import numpy as np
+
+    img = np.zeros((3000, 4000, 3), dtype=np.uint8)
+    policy = ocr.ResizePolicy(max_side=2000)
+    assert ocr.resize_for_ocr(img, policy).shape[:2] == (1500, 2000)
+    assert ocr.resize_for_ocr(img, ocr.FIXED_2X_POLICY).shape[:2] == (6000, 8000)
+
+
+def test_prepare_source_decodes_encoded_bytes():
+    import cv2
+    import numpy as np
+
+    img = np.zeros((1200, 1600, 3), dtype=np.uint8)
+    ok, buf = cv2.imencode(".png", img)
+    assert ok
+    assert ocr.prepare_source(buf.tobytes()).shape[:2] == (1200, 1600)
+    assert ocr.prepare_source(b"not an image") is None
@@ -0,0 +1,116 @@
+# tests/test_ocr_service.py
+import asyncio
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+from ocr_service import OcrService
+
+
+@pytest.mark.asyncio
+async def test_jobs_resolve_futures_and_report_stats():
+    release = threading.Event()
+
+    def fake_ocr(paths):
+        release.wait(timeout=5)
+        return [f"text of {path}" for path in paths]
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    service = OcrService(workers=1, max_batch_size=1, executor=executor, batch_fn=fake_ocr)
+    await service.start()
+
+    futures = [service.submit(f"img{i}.png") for i in range(3)]
+    await asyncio.sleep(0.05)
+    # One job is in the worker, the other two are queued.
+    assert service.in_flight == 1
+    assert service.depth == 2
+
+    release.set()
+    assert await asyncio.gather(*futures) == [f"text of img{i}.png" for i in range(3)]
+
+    stats = service.stats()
+    assert stats["completed"] == 3
+    assert stats["depth"] == 0
+    assert stats["avg_latency"] >= stats["avg_wait"] >= 0
+
+    await service.close()
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_worker_errors_propagate_to_caller():
+    def broken(_paths):
+        raise ValueError("bad image")
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    service = OcrService(workers=1, executor=executor, batch_fn=broken)
+    await service.start()
+
+    with pytest.raises(ValueError):
+        await service.extract_text("x.png")
+    assert service.failed == 1
+    assert service.completed == 0
+
+    await service.close()
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_runs_in_worker_process():
+    executor = ProcessPoolExecutor(max_workers=1)
+    service = OcrService(workers=1, executor=executor, batch_fn=sorted)
+    await service.start()
+
+    assert await service.extract_text("hello") == "hello"
+
+    await service.close()
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_jobs_are_batched_into_one_call():
+    calls = []
+
+    def fake_batch(paths):
+        calls.append(list(paths))
+        return [p.upper() for p in paths]
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    service = OcrService(workers=1, max_batch_size=4, batch_window=0.05, executor=executor, batch_fn=fake_batch)
+    await service.start()
+
+    futures = [service.submit(f"img{i}") for i in range(6)]
+    assert await asyncio.gather(*futures) == [f"IMG{i}" for i in range(6)]
+    assert calls == [["img0", "img1", "img2", "img3"], ["img4", "img5"]]
+    assert service.stats()["avg_batch_size"] == 3
+
+    await service.close()
+    executor.shutdown()
+
+
+def _fail_first_init(_policy):
+    # Each worker process starts from scratch, so the flag has to live on disk.
+    flag = os.environ["OCR_TEST_INIT_FLAG"]
+    if not os.path.exists(flag):
+        open(flag, "w").close()
+        raise RuntimeError("model failed to load")
+
+
+@pytest.mark.asyncio
+async def test_broken_pool_returns_empty_text_and_restarts(tmp_path, monkeypatch):
+    monkeypatch.setenv("OCR_TEST_INIT_FLAG", str(tmp_path / "init-failed"))
+    service = OcrService(workers=1, batch_fn=sorted, initializer=_fail_first_init)
+    await service.start()
+
+    assert await service.extract_text("x.png") == ""
+    assert service.failed == 1
+    assert service.completed == 0
+    assert service.restarts == 1
+
+    # The rebuilt pool's worker loads fine.
+    assert await service.extract_text("hello") == "hello"
+    assert service.completed == 1
+
+    await service.close()
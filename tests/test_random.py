@@ -152,3 +152,102 @@ async def test_run_random_command_sends_a_file(monkeypatch):
     assert isinstance(kwargs["file"], FakeFile)
     assert kwargs["file"].path == "/tmp/img.png"
 
+
+
+def _insert_images(conn, n):
+    return [
+        storage.insert_image_for_test(
+            conn, uploader_id="u", channel_id="c", message_id=str(i),
+            file_path=f"/tmp/img_{i}.png", index_text=f"img {i}",
+        )
+        for i in range(n)
+    ]
+
+
+def test_get_random_image_skips_holes_without_sorting():
+    import random
+
+    conn = make_conn()
+    ids = _insert_images(conn, 20)
+    conn.execute("DELETE FROM images WHERE id % 2 = 0")
+    conn.commit()
+
+    statements = []
+    conn.set_trace_callback(statements.append)
+    rng = random.Random(1)
+    seen = {storage.get_random_image(conn, rng)["id"] for _ in range(200)}
+
+    assert seen == {i for i in ids if i % 2}
+    assert not any("RANDOM()" in s for s in statements)
+
+
+def test_shuffle_bag_never_repeats_until_exhausted():
+    import random
+
+    from shuffle_bag import draw_shuffled_image
+
+    conn = make_conn()
+    ids = _insert_images(conn, 12)
+    rng = random.Random(7)
+
+    statements = []
+    conn.set_trace_callback(statements.append)
+    first_cycle = [draw_shuffled_image(conn, "chan", rng)["id"] for _ in ids]
+    assert sorted(first_cycle) == ids
+    # Draws stay cheap to the last one: no listing of every image id.
+    assert not any("SELECT id FROM images" in s for s in statements)
+
+    # Next cycle starts over; another channel has its own bag.
+    assert draw_shuffled_image(conn, "chan", rng)["id"] in ids
+    assert storage.load_shuffle_cycle(conn, "chan")[0] == len(ids) - 1
+    assert draw_shuffled_image(conn, "other", rng)["id"] in ids
+
+
+def test_shuffle_bag_skips_deleted_and_includes_new_images():
+    import random
+
+    from shuffle_bag import draw_shuffled_image
+
+    conn = make_conn()
+    ids = _insert_images(conn, 6)
+    rng = random.Random(3)
+    drawn = [draw_shuffled_image(conn, "chan", rng)["id"] for _ in range(2)]
+
+    gone = next(i for i in ids if i not in drawn)
+    conn.execute("DELETE FROM images WHERE id = ?", (gone,))
+    added = storage.insert_image_for_test(conn, "u", "c", "m", "/tmp/new.png", "new")
+
+    drawn += [draw_shuffled_image(conn, "chan", rng)["id"] for _ in range(4)]
+    assert sorted(drawn) == sorted([i for i in ids if i != gone] + [added])
+
+
+def test_shuffle_bag_survives_reopen(tmp_path):
+    from db import Database
+    from shuffle_bag import draw_shuffled_image
+
+    path = str(tmp_path / "images.db")
+    db = Database(path)
+    storage.init_db(db)
+    ids = _insert_images(db, 5)
+    drawn = {draw_shuffled_image(db, "chan")["id"] for _ in range(3)}
+    db.close()
+
+    db = Database(path)
+    assert storage.load_shuffle_cycle(db, "chan")[0] == 2
+    rest = {draw_shuffled_image(db, "chan")["id"] for _ in range(2)}
+    assert drawn | rest == set(ids)
+    db.close()
+
+
+@pytest.mark.asyncio
+async def test_run_random_command_shuffle(monkeypatch):
+    conn = make_conn()
+    _insert_images(conn, 1)
+    monkeypatch.setattr(bot.discord, "File", lambda path: path)
+
+    interaction = DummyInteraction()
+    interaction.channel_id = 42
+    await bot.run_random_command(interaction, conn, shuffle=True)
+
+    assert interaction.response.calls[0][1]["file"] == "/tmp/img_0.png"
+    assert storage.load_shuffle_cycle(conn, "42") is not None
@@ -0,0 +1,65 @@
+import pytest
+
+from features.scheduling.archive import DAY_SECONDS, RetentionPolicy, archive_once
+from features.scheduling.storage import (
+    cancel_scheduled_message,
+    claim_due_messages,
+    create_scheduled_message,
+    init_scheduler_db,
+    list_scheduled_messages,
+    mark_failed,
+    mark_sent,
+)
+
+
+def _finished(conn, n, *, sent_at):
+    ids = [
+        create_scheduled_message(conn, channel_id="1", content=f"m{i}", run_at=sent_at, created_by="u1")
+        for i in range(n)
+    ]
+    claim_due_messages(conn, now=sent_at, limit=n)
+    for schedule_id in ids:
+        mark_sent(conn, schedule_id, sent_at=sent_at)
+    return ids
+
+
+def _archived(conn):
+    return [r[0] for r in conn.execute("SELECT id FROM scheduled_messages_archive ORDER BY id")]
+
+
+@pytest.mark.asyncio
+async def test_archive_moves_only_old_finished_rows_in_batches(conn):
+    init_scheduler_db(conn)
+    now = 100 * DAY_SECONDS
+    old = _finished(conn, 5, sent_at=now - 10 * DAY_SECONDS)
+    recent = _finished(conn, 1, sent_at=now - DAY_SECONDS)
+    pending = create_scheduled_message(conn, channel_id="1", content="later", run_at=now + 60, created_by="u1")
+
+    policy = RetentionPolicy(finished_days=7, batch_size=2)
+    assert await archive_once(conn, policy=policy, now=now) == (5, 0)
+
+    assert _archived(conn) == old
+    remaining = {r["id"] for r in list_scheduled_messages(conn, include_non_pending=True)}
+    assert remaining == {*recent, pending}
+    row = conn.execute(
+        "SELECT status, content, sent_at, archived_at FROM scheduled_messages_archive WHERE id = ?", (old[0],)
+    ).fetchone()
+    assert row == ("sent", "m0", now - 10 * DAY_SECONDS, now)
+
+    # Nothing left to do; later, the archive itself is trimmed.
+    assert await archive_once(conn, policy=policy, now=now) == (0, 0)
+    purge = RetentionPolicy(finished_days=7, archive_days=30, batch_size=2)
+    assert await archive_once(conn, policy=purge, now=now + 21 * DAY_SECONDS) == (1, 5)
+    assert _archived(conn) == recent
+
+
+def test_canceled_and_failed_rows_record_when_they_finished(conn):
+    init_scheduler_db(conn)
+    canceled = create_scheduled_message(conn, channel_id="1", content="x", run_at=10**10, created_by="u1")
+    failed = create_scheduled_message(conn, channel_id="1", content="y", run_at=1, created_by="u1")
+    assert cancel_scheduled_message(conn, schedule_id=canceled)
+    claim_due_messages(conn, now=1)
+    mark_failed(conn, failed, error="boom")
+
+    finished = dict(conn.execute("SELECT id, finished_at FROM scheduled_messages"))
+    assert finished[canceled] is not None and finished[failed] is not None
@@ -1,3 +1,4 @@
+import asyncio
 import time
 
 import pytest
@@ -5,6 +6,7 @@ import pytest
 from features.scheduling.dispatcher import dispatch_due_messages
 from features.scheduling.storage import (
     init_scheduler_db,
+    cancel_scheduled_message,
     create_scheduled_message,
     list_scheduled_messages,
 )
@@ -151,3 +153,197 @@ async def test_dispatch_repeat_reschedules_and_announces_next(conn):
     rows = list_scheduled_messages(conn, include_non_pending=True)
     assert rows[0]["status"] == "pending"
     assert rows[0]["run_at"] > now
+
+
+class ClosableBot(FakeBot):
+    def is_closed(self):
+        return False
+
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_scheduler_wakes_on_create_and_stays_off_db_while_idle(conn, monkeypatch):
+    from features.scheduling import dispatcher
+    from features.scheduling.dispatcher import Scheduler
+
+    init_scheduler_db(conn)
+    claims = []
+    real_claim = dispatcher.claim_due_messages
+
+    def counting_claim(*args, **kwargs):
+        claims.append(kwargs["now"])
+        return real_claim(*args, **kwargs)
+
+    monkeypatch.setattr(dispatcher, "claim_due_messages", counting_claim)
+
+    clock = [1000.0]
+    channel = FakeChannel()
+    scheduler = Scheduler(ClosableBot({123: channel}), conn, clock=lambda: clock[0])
+    task = asyncio.create_task(scheduler.run())
+    try:
+        await _settle()
+        assert claims == []
+
+        create_scheduled_message(
+            conn, channel_id="123", content="now", run_at=1000, created_by="u1",
+        )
+        later_id = create_scheduled_message(
+            conn, channel_id="123", content="later", run_at=1060, created_by="u1",
+        )
+        await _settle()
+        assert channel.sent == [{"content": "now", "file": None}]
+        assert claims == [1000]
+        assert scheduler.next_run_at() == 1060
+
+        cancel_scheduled_message(conn, schedule_id=later_id)
+        await _settle()
+        assert scheduler.next_run_at() is None
+        assert scheduler.pending == 0
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+async def test_scheduler_resync_loads_pending_and_requeues_repeats(conn):
+    from features.scheduling.dispatcher import Scheduler
+
+    init_scheduler_db(conn)
+    now = int(time.time())
+    create_scheduled_message(
+        conn, channel_id="123", content="tick", run_at=now - 1, repeat_interval="minute", created_by="u1",
+    )
+
+    channel = FakeChannel()
+    scheduler = Scheduler(ClosableBot({123: channel}), conn, clock=lambda: now)
+    task = asyncio.create_task(scheduler.run())
+    try:
+        await _settle()
+        assert channel.sent[0]["content"] == "tick"
+        assert scheduler.next_run_at() == now - 1 + 60
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+async def test_dispatch_runs_channels_concurrently_in_order(conn, monkeypatch):
+    from features.scheduling import dispatcher
+
+    monkeypatch.setattr(dispatcher, "SLOW_SEND_SECONDS", 0.01)
+    init_scheduler_db(conn)
+    now = int(time.time())
+    release_slow = asyncio.Event()
+    log = []
+
+    class RateLimitedChannel(FakeChannel):
+        # discord.py sleeps through rate limits inside send()
+        async def send(self, content=None, file=None):
+            await release_slow.wait()
+            log.append(("slow", content))
+
+    class FastChannel(FakeChannel):
+        async def send(self, content=None, file=None):
+            log.append(("fast", content))
+            if len(log) == 3:
+                release_slow.set()
+
+    bot = FakeBot({1: RateLimitedChannel(), 2: FastChannel()})
+    for i, channel_id in enumerate(["1", "2", "2", "2", "1"]):
+        create_scheduled_message(
+            conn, channel_id=channel_id, content=f"m{i}", run_at=now - 10 + i, created_by="u1",
+        )
+
+    # One slot: channel 2 only gets through if the rate-limited send gives it up.
+    sent_count = await asyncio.wait_for(dispatch_due_messages(bot, conn, now=now, max_concurrency=1), 5)
+    assert sent_count == 5
+    # Channel 2 is not held up by channel 1, and each channel keeps run_at order.
+    assert log == [("fast", "m1"), ("fast", "m2"), ("fast", "m3"), ("slow", "m0"), ("slow", "m4")]
+    rows = list_scheduled_messages(conn, include_non_pending=True)
+    assert {r["status"] for r in rows} == {"sent"}
+
+
+@pytest.mark.asyncio
+async def test_scheduler_claims_backlog_in_one_batch(conn, monkeypatch):
+    from features.scheduling import dispatcher
+    from features.scheduling.dispatcher import Scheduler
+
+    init_scheduler_db(conn)
+    now = int(time.time())
+    for i in range(25):
+        create_scheduled_message(conn, channel_id=str(i % 3), content=f"m{i}", run_at=now - 1, created_by="u1")
+
+    limits = []
+    real_claim = dispatcher.claim_due_messages
+
+    def counting_claim(*args, **kwargs):
+        limits.append(kwargs["limit"])
+        return real_claim(*args, **kwargs)
+
+    monkeypatch.setattr(dispatcher, "claim_due_messages", counting_claim)
+
+    channels = {i: FakeChannel() for i in range(3)}
+    scheduler = Scheduler(ClosableBot(channels), conn, clock=lambda: now)
+    task = asyncio.create_task(scheduler.run())
+    try:
+        await _settle()
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    assert limits == [25]
+    assert sum(len(c.sent) for c in channels.values()) == 25
+
+
+@pytest.mark.asyncio
+async def test_dispatch_renews_leases_while_sending(conn, monkeypatch):
+    from features.scheduling import dispatcher
+
+    init_scheduler_db(conn)
+    now = int(time.time())
+    schedule_id = create_scheduled_message(conn, channel_id="1", content="slow", run_at=now - 1, created_by="u1")
+
+    renewed = []
+    real_renew = dispatcher.renew_leases
+
+    def recording_renew(conn_arg, ids, **kwargs):
+        renewed.append((list(ids), kwargs["owner"]))
+        return real_renew(conn_arg, ids, **kwargs)
+
+    monkeypatch.setattr(dispatcher, "renew_leases", recording_renew)
+
+    class SlowChannel(FakeChannel):
+        async def send(self, content=None, file=None):
+            await asyncio.sleep(0.5)
+            await super().send(content, file)
+
+    bot = FakeBot({1: SlowChannel()})
+    assert await dispatch_due_messages(bot, conn, now=now, owner="w1", lease_seconds=1) == 1
+    assert renewed and renewed[0] == ([schedule_id], "w1")
+    assert list_scheduled_messages(conn, include_non_pending=True)[0]["status"] == "sent"
+
+
+@pytest.mark.asyncio
+async def test_dispatch_repeat_after_outage_follows_missed_policy(conn):
+    init_scheduler_db(conn)
+    now = int(time.time())
+    outage = 3 * 60 * 60 + 600  # three hourly runs missed, the latest 10 minutes ago
+
+    for channel_id, policy in (("1", "fire_all"), ("2", "skip")):
+        create_scheduled_message(
+            conn, channel_id=channel_id, content=policy, run_at=now - outage,
+            repeat_interval="hour", missed_policy=policy, created_by="u1",
+        )
+
+    fire_all, skip = FakeChannel(), FakeChannel()
+    assert await dispatch_due_messages(FakeBot({1: fire_all, 2: skip}), conn, now=now) == 1
+
+    assert [m["content"] for m in fire_all.sent[:4]] == ["fire_all"] * 4
+    assert "Next at" in fire_all.sent[4]["content"]
+    assert skip.sent == []
+    rows = list_scheduled_messages(conn)
+    assert [r["run_at"] for r in rows] == [now - outage + 4 * 3600] * 2
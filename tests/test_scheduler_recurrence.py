@@ -0,0 +1,66 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from features.scheduling.recurrence import (
+    CronExpression,
+    IntervalRecurrence,
+    plan_catch_up,
+    recurrence_for,
+)
+from features.scheduling.time_utils import ScheduleTimeError
+
+
+def _ts(*args) -> int:
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp())
+
+
+def test_interval_catch_up_is_closed_form():
+    recurrence = IntervalRecurrence(anchor=1000, seconds=60)
+    now = 1000 + 60 * 1_000_000 + 5  # two years of per-minute runs missed
+
+    assert recurrence.next_after(now) == 1000 + 60 * 1_000_001
+    assert recurrence.next_after(999) == 1000
+    assert recurrence.count_between(1000, now, cap=10**9) == 1_000_001
+
+
+def test_missed_policies():
+    recurrence = recurrence_for(run_at=1000, repeat_interval="hour")
+    late = 1000 + 3 * 3600 + 600  # three runs missed, latest one 10 minutes ago
+
+    assert plan_catch_up(recurrence, run_at=1000, now=late, policy="fire_once") == (1, 1000 + 4 * 3600)
+    assert plan_catch_up(recurrence, run_at=1000, now=late, policy="fire_all") == (4, 1000 + 4 * 3600)
+    assert plan_catch_up(recurrence, run_at=1000, now=late, policy="fire_all", cap=2)[0] == 2
+    assert plan_catch_up(recurrence, run_at=1000, now=late, policy="skip")[0] == 0
+    # On time (within the grace period): skip still sends.
+    assert plan_catch_up(recurrence, run_at=1000, now=1030, policy="skip") == (1, 1000 + 3600)
+    assert plan_catch_up(recurrence, run_at=1000, now=1000 + 3600 + 30, policy="skip")[0] == 1
+
+    with pytest.raises(ScheduleTimeError):
+        plan_catch_up(recurrence, run_at=1000, now=late, policy="sometimes")
+
+
+def test_cron_next_fire():
+    weekdays_at_nine = CronExpression("0 9 * * 1-5", tz=timezone.utc)
+    friday_evening = _ts(2025, 6, 6, 18, 0)
+    assert weekdays_at_nine.next_after(friday_evening) == _ts(2025, 6, 9, 9, 0)  # Monday
+    assert weekdays_at_nine.next_after(_ts(2025, 6, 9, 8, 59, 30)) == _ts(2025, 6, 9, 9, 0)
+    assert weekdays_at_nine.next_after(_ts(2025, 6, 9, 9, 0)) == _ts(2025, 6, 10, 9, 0)
+
+    every_quarter_hour = CronExpression("*/15 * * * *", tz=timezone.utc)
+    assert every_quarter_hour.next_after(_ts(2025, 6, 9, 23, 50)) == _ts(2025, 6, 10, 0, 0)
+
+    leap_day = CronExpression("30 12 29 2 *", tz=timezone.utc)
+    assert leap_day.next_after(_ts(2025, 3, 1, 0, 0)) == _ts(2028, 2, 29, 12, 30)
+
+    # Both day fields restricted: either one matches, as in cron.
+    first_or_sunday = CronExpression("0 0 1 * 0", tz=timezone.utc)
+    assert first_or_sunday.next_after(_ts(2025, 6, 2, 0, 0)) == _ts(2025, 6, 8, 0, 0)
+
+
+def test_cron_rejects_bad_expressions():
+    for text in ("* * * *", "60 * * * *", "* * * * mon", "5-1 * * * *", "*/0 * * * *"):
+        with pytest.raises(ScheduleTimeError):
+            CronExpression(text)
+    with pytest.raises(ScheduleTimeError):
+        CronExpression("0 0 31 2 *").next_after(0)
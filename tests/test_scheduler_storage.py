@@ -73,3 +73,29 @@ def test_claim_due_and_mark_sent(conn):
     rows = list_scheduled_messages(conn, include_non_pending=True)
     assert rows[0]["status"] == "sent"
     assert rows[0]["sent_at"] == now
+
+
+def test_expired_lease_is_reclaimed_and_stale_owner_cannot_finish(conn):
+    from features.scheduling.storage import fetch_pending_run_times, renew_leases
+
+    init_scheduler_db(conn)
+    schedule_id = create_scheduled_message(
+        conn, channel_id="123", content="due", run_at=100, created_by="u1",
+    )
+
+    assert [r["id"] for r in claim_due_messages(conn, now=100, owner="a", lease_seconds=60)] == [schedule_id]
+    # Still leased to "a": nobody else can take it.
+    assert claim_due_messages(conn, now=150, owner="b", lease_seconds=60) == []
+    assert renew_leases(conn, [schedule_id], owner="a", now=150, lease_seconds=60) == 1
+    assert claim_due_messages(conn, now=200, owner="b", lease_seconds=60) == []
+    assert fetch_pending_run_times(conn) == [(schedule_id, 210)]
+
+    # "a" stops renewing; once the lease lapses "b" takes over.
+    assert [r["id"] for r in claim_due_messages(conn, now=210, owner="b", lease_seconds=60)] == [schedule_id]
+    assert renew_leases(conn, [schedule_id], owner="a", now=211) == 0
+
+    mark_sent(conn, schedule_id, sent_at=212, owner="a")
+    assert list_scheduled_messages(conn, include_non_pending=True)[0]["status"] == "sending"
+    mark_sent(conn, schedule_id, sent_at=213, owner="b")
+    row = list_scheduled_messages(conn, include_non_pending=True)[0]
+    assert (row["status"], row["sent_at"]) == ("sent", 213)
@@ -1,6 +1,9 @@
 # tests/test_search.py
-from storage import insert_image_for_test
-from search import search_best_match
+import numpy as np
+
+import search
+from storage import insert_image_for_test, save_image_record, fetch_fts_candidate_ids
+from search import search_best_match, load_search_index, get_search_index
 
 
 def test_search_picks_closest_text(conn):
@@ -18,3 +21,63 @@ def test_search_rejects_low_scores(conn):
     result = search_best_match(conn, "unrelated text")
     assert result == []
 
+
+
+def test_search_index_updates_on_insert_without_rescan(conn, monkeypatch):
+    insert_image_for_test(conn, "u1", "c1", "m1", "/tmp/1.png", "cat on sofa")
+    load_search_index(conn)
+
+    def fail_scan(_conn):
+        raise AssertionError("search must not rescan the images table")
+
+    monkeypatch.setattr("search.fetch_index_texts", fail_scan)
+
+    save_image_record(
+        conn,
+        uploader_id="u2",
+        channel_id="c1",
+        message_id="m2",
+        file_path="/tmp/2.png",
+        user_text="dog in garden",
+        ocr_text=None,
+    )
+
+    result = search_best_match(conn, "dog in garden")
+    assert result[0]["file_path"] == "/tmp/2.png"
+    assert len(get_search_index(conn)) == 2
+
+
+def test_search_uses_trigram_prefilter(conn, monkeypatch):
+    insert_image_for_test(conn, "u1", "c1", "m1", "/tmp/1.png", "cat on sofa")
+    insert_image_for_test(conn, "u2", "c1", "m2", "/tmp/2.png", "dog in garden")
+
+    assert fetch_fts_candidate_ids(conn, "sofa", 10) == [1]
+    assert fetch_fts_candidate_ids(conn, "ca", 10) is None
+
+    scored = []
+    real_score = search.score_texts
+
+    def spy(query, texts):
+        scored.extend(texts)
+        return real_score(query, texts)
+
+    monkeypatch.setattr(search, "score_texts", spy)
+    load_search_index(conn)
+
+    result = search_best_match(conn, "garden")
+    assert result[0]["index_text"] == "dog in garden"
+    assert scored == ["dog in garden"]
+
+
+def test_top_k_orders_best_first_and_keeps_ties_stable():
+    scores = np.array([60, 0, 90, 60, 75], dtype=np.float32)
+    assert search.top_k(scores, 3) == [2, 4, 0]
+    assert search.top_k(scores, 10) == [2, 4, 0, 3]
+
+
+def test_search_restricted_to_candidate_ids(conn):
+    insert_image_for_test(conn, "u1", "c1", "m1", "/tmp/1.png", "cat on sofa")
+    id2 = insert_image_for_test(conn, "u2", "c1", "m2", "/tmp/2.png", "cat on sofa too")
+
+    result = search_best_match(conn, "cat on sofa", limit=5, candidate_ids=[id2])
+    assert [r["id"] for r in result] == [id2]
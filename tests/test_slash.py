@@ -81,3 +81,91 @@ async def test_img_autocomplete(monkeypatch, conn):
     assert choices[1].name == "dog"
     assert choices[2].name == "bird"
 
+
+
+@pytest.mark.asyncio
+async def test_img_autocomplete_narrows_on_extended_prefix(monkeypatch, conn):
+    from bot import autocomplete_cache
+
+    autocomplete_cache.clear()
+    calls = []
+
+    def fake_search(conn_arg, query, limit=5, candidate_ids=None):
+        calls.append((query, candidate_ids))
+        return [{"id": 7, "index_text": "cat"}]
+
+    monkeypatch.setattr("bot.search_best_match", fake_search)
+
+    interaction = FakeInteraction()
+    interaction.user = type("User", (), {"id": 42})()
+
+    await run_img_autocomplete(interaction, conn, "ca")
+    await run_img_autocomplete(interaction, conn, "cat")
+    await run_img_autocomplete(interaction, conn, "cat")
+
+    assert calls == [("ca", None), ("cat", [7])]
+    assert interaction.response.sent[2]["choices"][0].name == "cat"
+    autocomplete_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_img_autocomplete_does_not_narrow_a_truncated_prefix(conn):
+    from bot import autocomplete_cache
+    from search import load_search_index, search_best_match
+    from storage import insert_image_for_test
+
+    autocomplete_cache.clear()
+    for i in range(200):
+        insert_image_for_test(conn, "u", "c", str(i), f"/tmp/{i}.png", f"filler {i} cats xyz")
+    target = insert_image_for_test(conn, "u", "c", "x", "/tmp/x.png", "cats xylophone concert")
+    load_search_index(conn)
+    assert search_best_match(conn, "cats xylophone")[0]["id"] == target
+
+    interaction = FakeInteraction()
+    interaction.user = type("User", (), {"id": 42})()
+    for typed in ("c", "ca", "cats", "cats xylophone"):
+        await run_img_autocomplete(interaction, conn, typed)
+
+    assert interaction.response.sent[-1]["choices"][0].name == "cats xylophone concert"
+    autocomplete_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_img_autocomplete_sees_images_indexed_since_the_prefix(conn):
+    from bot import autocomplete_cache
+    from search import load_search_index
+    from storage import insert_image_for_test
+
+    autocomplete_cache.clear()
+    insert_image_for_test(conn, "u", "c", "1", "/tmp/1.png", "sunset mountain")
+    load_search_index(conn)
+
+    interaction = FakeInteraction()
+    interaction.user = type("User", (), {"id": 42})()
+    await run_img_autocomplete(interaction, conn, "sunset")
+    insert_image_for_test(conn, "u", "c", "2", "/tmp/2.png", "sunset beach")
+    await run_img_autocomplete(interaction, conn, "sunset beach")
+
+    names = [choice.name for choice in interaction.response.sent[-1]["choices"]]
+    assert names[0] == "sunset beach"
+    autocomplete_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_img_autocomplete_without_user_is_not_cached(monkeypatch, conn):
+    from bot import autocomplete_cache
+
+    autocomplete_cache.clear()
+    calls = []
+
+    def fake_search(conn_arg, query, limit=5, candidate_ids=None):
+        calls.append((query, candidate_ids))
+        return [{"id": 7, "index_text": "cat"}]
+
+    monkeypatch.setattr("bot.search_best_match", fake_search)
+
+    await run_img_autocomplete(FakeInteraction(), conn, "cat")
+    await run_img_autocomplete(FakeInteraction(), conn, "cat")
+
+    assert calls == [("cat", None), ("cat", None)]  # both searched in full
+    assert len(autocomplete_cache) == 0
@@ -30,3 +30,20 @@ def test_fetch_all_images(conn):
     texts = sorted(r["index_text"] for r in rows)
     assert texts == ["cat on sofa", "dog in garden"]
 
+
+def test_image_records_support_projection_and_mapping_access(conn):
+    from storage import insert_image_for_test, get_images_by_ids
+
+    img_id = insert_image_for_test(conn, "u1", "c1", "m1", "/tmp/1.png", "cat on sofa")
+
+    (row,) = get_images_by_ids(conn, [img_id], columns=("index_text",))
+    assert row["id"] == img_id
+    assert row.get("index_text") == "cat on sofa"
+    assert "file_path" not in row
+    assert row.get("file_path") is None
+    assert not hasattr(row, "__dict__")
+
+    full = get_image_by_id(conn, img_id)
+    full["attachment_url"] = "https://cdn.example/1.png"
+    assert full["attachment_url"] == "https://cdn.example/1.png"
+    assert full.keys()[:3] == ["id", "uploader_id", "channel_id"]
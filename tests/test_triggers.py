@@ -0,0 +1,155 @@
+# tests/test_triggers.py
+import pytest
+
+from search import load_search_index
+from storage import insert_image_for_test
+from triggers import RateLimiter, SearchGate, parse_channel_modes
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeAuthor:
+    def __init__(self, author_id):
+        self.id = author_id
+
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+
+
+class FakeMessage:
+    def __init__(self, content, author_id=1, channel_id=10):
+        self.content = content
+        self.author = FakeAuthor(author_id)
+        self.channel = FakeChannel(channel_id)
+
+
+def test_vocabulary_precheck_gates_chatter(conn):
+    insert_image_for_test(conn, "u1", "c1", "m1", "/tmp/1.png", "cat on sofa")
+    index = load_search_index(conn)
+    gate = SearchGate(default_mode="vocab", vocabulary=index.vocabulary_overlap)
+
+    decision = gate.check(FakeMessage("cat sofa"))
+    assert decision is not None
+    assert decision.query == "cat sofa"
+    assert decision.explicit is False
+
+    assert gate.check(FakeMessage("anyone up for lunch?")) is None
+    assert gate.stats()["gated_vocab"] == 1
+    assert gate.stats()["executed"] == 1
+
+
+def test_vocabulary_precheck_rejects_everyday_chat(conn):
+    captions = [
+        "when the code works on the first try",
+        "this is fine dog sitting in a burning room",
+        "me explaining to my mom why i need a new gpu",
+        "nobody: absolutely nobody: me at 3am eating cereal",
+        "distracted boyfriend looking at another girl",
+        "is this a pigeon butterfly",
+        "one does not simply walk into mordor",
+        "grumpy cat says no",
+        "surprised pikachu face",
+        "when you see it you will lose your mind",
+        "i am once again asking for your support",
+        "woman yelling at cat at dinner table",
+        "shut up and take my money",
+    ]
+    for i, caption in enumerate(captions):
+        insert_image_for_test(conn, "u1", "c1", f"m{i}", f"/tmp/{i}.png", caption)
+    gate = SearchGate(default_mode="vocab", vocabulary=load_search_index(conn).vocabulary_overlap)
+
+    chat = [
+        "anyone up for lunch?",
+        "i think the meeting is at 3",
+        "lol that is so true",
+        "did you see the game last night",
+        "when are you coming home",
+        "is this the right channel",
+    ]
+    for line in chat:
+        assert gate.check(FakeMessage(line)) is None, line
+    assert gate.stats()["gated_vocab"] == len(chat)
+
+    for query in ["surprised pikachu", "grumpy cat", "mordor", "take my money"]:
+        assert gate.check(FakeMessage(query, author_id=query)) is not None, query
+
+
+def test_prefix_and_mention_are_explicit(conn):
+    gate = SearchGate(default_mode="vocab", prefix="?", vocabulary=lambda text: 0.0)
+
+    decision = gate.check(FakeMessage("?dog in garden"))
+    assert decision.query == "dog in garden"
+    assert decision.explicit is True
+
+    decision = gate.check(FakeMessage("<@42> dog in garden"), bot_user_id=42)
+    assert decision.query == "dog in garden"
+    assert decision.explicit is True
+
+
+def test_per_channel_modes():
+    gate = SearchGate(
+        default_mode="off",
+        channel_modes=parse_channel_modes("10:all, 20:prefix"),
+    )
+
+    assert gate.check(FakeMessage("hello", channel_id=10)).explicit is True
+    assert gate.check(FakeMessage("hello", channel_id=20)) is None
+    assert gate.check(FakeMessage("?hello", channel_id=20)).query == "hello"
+    assert gate.check(FakeMessage("hello", channel_id=30)) is None
+    assert gate.stats() == {"executed": 2, "gated": 2, "gated_mode": 2}
+
+    with pytest.raises(ValueError):
+        gate.set_channel_mode(40, "sometimes")
+
+
+def test_rate_limits_per_user_and_channel():
+    clock = FakeClock()
+    gate = SearchGate(default_mode="all", user_per_minute=2, channel_per_minute=3, clock=clock)
+
+    assert gate.check(FakeMessage("a cat", author_id=1))
+    assert gate.check(FakeMessage("a cat", author_id=1))
+    assert gate.check(FakeMessage("a cat", author_id=1)) is None  # user bucket empty
+    assert gate.check(FakeMessage("a cat", author_id=2))
+    assert gate.check(FakeMessage("a cat", author_id=3)) is None  # channel bucket empty
+
+    stats = gate.stats()
+    assert stats["gated_user_rate"] == 1
+    assert stats["gated_channel_rate"] == 1
+
+    clock.now += 30  # one user token and 1.5 channel tokens back
+    assert gate.check(FakeMessage("a cat", author_id=1))
+
+
+def test_rate_limiter_zero_means_unlimited():
+    limiter = RateLimiter(0)
+    assert all(limiter.allow("k") for _ in range(100))
+
+
+def test_channel_limit_does_not_spend_user_tokens():
+    clock = FakeClock()
+    gate = SearchGate(default_mode="all", user_per_minute=2, channel_per_minute=1, clock=clock)
+
+    assert gate.check(FakeMessage("a cat", author_id=1, channel_id=10))
+    assert gate.check(FakeMessage("a cat", author_id=2, channel_id=10)) is None  # channel bucket empty
+    assert gate.check(FakeMessage("a cat", author_id=2, channel_id=20))
+    assert gate.check(FakeMessage("a cat", author_id=2, channel_id=30))  # still had both tokens
+
+
+def test_rate_limiter_drops_idle_buckets():
+    clock = FakeClock()
+    limiter = RateLimiter(6, clock=clock)
+    for key in range(100):
+        assert limiter.allow(key)
+    assert len(limiter) == 100
+
+    clock.now += 11 * 60  # every bucket has refilled
+    assert limiter.allow("active")
+    assert len(limiter) == 1
@@ -0,0 +1,102 @@
+# tests/test_write_queue.py
+import asyncio
+import sqlite3
+
+import pytest
+
+from features.scheduling.storage import (
+    init_scheduler_db,
+    create_scheduled_message,
+    claim_due_messages,
+    mark_sent,
+    list_scheduled_messages,
+)
+from search import load_search_index
+from storage import save_image_record, get_image_by_id
+from write_queue import WriteQueue, call_write
+
+
+def _count_commits(conn):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    return lambda: sum(1 for s in statements if s.strip().upper() == "COMMIT")
+
+
+def _save(conn, n, image_hash=None):
+    return save_image_record(
+        conn, uploader_id="u", channel_id="c", message_id=str(n),
+        file_path=f"/tmp/{n}.png", user_text=f"image {n}", ocr_text=None, image_hash=image_hash,
+    )
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writes_share_one_commit(conn):
+    writes = WriteQueue(conn, max_delay=0.05)
+    await writes.start()
+    commits = _count_commits(conn)
+
+    ids = await asyncio.gather(*(writes.write(_save, n) for n in range(10)))
+    await writes.close()
+
+    assert commits() == 1
+    assert writes.stats()["batches"] == 1
+    assert [get_image_by_id(conn, i)["message_id"] for i in ids] == [str(n) for n in range(10)]
+
+
+@pytest.mark.asyncio
+async def test_failing_write_only_fails_its_caller(conn):
+    writes = WriteQueue(conn, max_delay=0.05)
+    await writes.start()
+
+    results = await asyncio.gather(
+        writes.write(_save, 1, "aaaaaaaaaaaaaaaa"),
+        writes.write(_save, 2, "aaaaaaaaaaaaaaaa"),  # same hash: UNIQUE violation
+        writes.write(_save, 3, "bbbbbbbbbbbbbbbb"),
+        return_exceptions=True,
+    )
+    await writes.close()
+
+    assert isinstance(results[1], sqlite3.IntegrityError)
+    assert get_image_by_id(conn, results[0])["message_id"] == "1"
+    assert get_image_by_id(conn, results[2])["message_id"] == "3"
+    assert writes.stats()["failed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_index_listeners_see_only_committed_rows(conn):
+    index = load_search_index(conn)
+    writes = WriteQueue(conn, max_delay=0.05)
+    await writes.start()
+
+    first = writes.submit(_save, 1)
+    await asyncio.sleep(0)
+    assert len(index) == 0  # still queued, nothing committed
+    await first
+    assert len(index) == 1
+    await writes.close()
+
+
+@pytest.mark.asyncio
+async def test_call_write_batches_scheduler_updates(conn):
+    init_scheduler_db(conn)
+    for i in range(3):
+        create_scheduled_message(conn, channel_id="1", content=f"m{i}", run_at=0, created_by="u")
+    claimed = claim_due_messages(conn, now=10, limit=10)
+
+    writes = WriteQueue(conn, max_delay=0.05)
+    await writes.start()
+    commits = _count_commits(conn)
+    await asyncio.gather(*(
+        call_write(writes, None, mark_sent, conn, row["id"], sent_at=10) for row in claimed
+    ))
+    await writes.close()
+
+    assert commits() == 1
+    rows = list_scheduled_messages(conn, include_non_pending=True)
+    assert {r["status"] for r in rows} == {"sent"}
+
+
+@pytest.mark.asyncio
+async def test_call_write_without_queue_writes_directly(conn):
+    img_id = await call_write(None, None, _save, conn, 1)
+    assert get_image_by_id(conn, img_id)["message_id"] == "1"
@@ -0,0 +1,189 @@
+# triggers.py
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, Dict, Hashable, Optional
+
+
+TRIGGER_MODES = ("all", "vocab", "prefix", "mention", "off")
+DEFAULT_TRIGGER_MODE = "vocab"
+DEFAULT_PREFIX = "?"
+VOCAB_MIN_OVERLAP = 0.6  # IDF-weighted share of message words that must exist in the corpus
+USER_SEARCHES_PER_MINUTE = 6
+CHANNEL_SEARCHES_PER_MINUTE = 30
+RATE_LIMIT_PRUNE_SECONDS = 10 * 60  # how often full (idle) buckets are dropped
+
+
+@dataclass(frozen=True)
+class TriggerDecision:
+    query: str
+    explicit: bool  # the user clearly asked for an image: reply even when nothing matches
+
+
+class RateLimiter:
+    """
+    Token bucket per key: `per_minute` sustained, bursts up to `burst`.
+    A bucket that has refilled completely is the same as no bucket, so those
+    are dropped every RATE_LIMIT_PRUNE_SECONDS to keep one-off keys from
+    accumulating.
+    """
+
+    def __init__(
+        self,
+        per_minute: float,
+        burst: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = per_minute / 60.0
+        self.burst = burst if burst is not None else max(1, int(per_minute))
+        self._clock = clock
+        self._buckets: Dict[Hashable, tuple] = {}  # key -> (tokens, last refill time)
+        self._pruned_at = clock()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _tokens(self, key: Hashable, now: float) -> float:
+        tokens, last = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - last) * self.rate)
+
+    def available(self, key: Hashable) -> bool:
+        """Whether `key` has a token, without spending it."""
+        return self.rate <= 0 or self._tokens(key, self._clock()) >= 1
+
+    def consume(self, key: Hashable) -> None:
+        """Spend one of `key`'s tokens (check available() first)."""
+        if self.rate <= 0:
+            return
+        now = self._clock()
+        self._buckets[key] = (self._tokens(key, now) - 1, now)
+        if now - self._pruned_at >= RATE_LIMIT_PRUNE_SECONDS:
+            self._prune(now)
+
+    def allow(self, key: Hashable) -> bool:
+        if not self.available(key):
+            return False
+        self.consume(key)
+        return True
+
+    def _prune(self, now: float) -> None:
+        self._pruned_at = now
+        full = [key for key in self._buckets if self._tokens(key, now) >= self.burst]
+        for key in full:
+            del self._buckets[key]
+
+
+class SearchGate:
+    """
+    Decides whether a plain chat message should run an image search.
+
+    Per-channel modes:
+    - all:     every message is a query (the original behaviour)
+    - vocab:   plain messages only when enough of their words (weighted
+               towards rare ones) occur in the indexed corpus; prefix/mention
+               invocations always pass
+    - prefix:  only messages starting with `prefix`
+    - mention: only messages mentioning the bot
+    - off:     never
+    Searches that pass are then rate limited per user and per channel.
+    """
+
+    def __init__(
+        self,
+        *,
+        default_mode: str = DEFAULT_TRIGGER_MODE,
+        channel_modes: Optional[Dict[str, str]] = None,
+        prefix: str = DEFAULT_PREFIX,
+        vocabulary: Optional[Callable[[str], float]] = None,
+        vocab_min_overlap: float = VOCAB_MIN_OVERLAP,
+        user_per_minute: float = USER_SEARCHES_PER_MINUTE,
+        channel_per_minute: float = CHANNEL_SEARCHES_PER_MINUTE,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if default_mode not in TRIGGER_MODES:
+            raise ValueError(f"Unknown trigger mode: {default_mode}")
+        self.default_mode = default_mode
+        self.channel_modes: Dict[str, str] = {}
+        for channel_id, mode in (channel_modes or {}).items():
+            self.set_channel_mode(channel_id, mode)
+        self.prefix = prefix
+        self.vocabulary = vocabulary
+        self.vocab_min_overlap = vocab_min_overlap
+        self.user_limiter = RateLimiter(user_per_minute, clock=clock)
+        self.channel_limiter = RateLimiter(channel_per_minute, clock=clock)
+        self.counters: Counter = Counter()
+
+    def mode_for(self, channel_id) -> str:
+        return self.channel_modes.get(str(channel_id), self.default_mode)
+
+    def set_channel_mode(self, channel_id, mode: str) -> None:
+        if mode not in TRIGGER_MODES:
+            raise ValueError(f"Unknown trigger mode: {mode}")
+        self.channel_modes[str(channel_id)] = mode
+
+    def _explicit_query(self, text: str, mode: str, bot_user_id) -> Optional[str]:
+        if mode in ("prefix", "vocab") and self.prefix and text.startswith(self.prefix):
+            return text[len(self.prefix):].strip()
+        if mode in ("mention", "vocab") and bot_user_id is not None:
+            mention = re.compile(rf"<@!?{bot_user_id}>")
+            if mention.search(text):
+                return mention.sub("", text).strip()
+        return None
+
+    def _gate(self, reason: str) -> None:
+        self.counters[f"gated_{reason}"] += 1
+        return None
+
+    def check(self, message, bot_user_id=None) -> Optional[TriggerDecision]:
+        """TriggerDecision for a message that should be searched, else None."""
+        text = (message.content or "").strip()
+        if not text:
+            return self._gate("empty")
+
+        mode = self.mode_for(message.channel.id)
+        if mode == "off":
+            return self._gate("mode")
+
+        if mode == "all":
+            decision = TriggerDecision(query=text, explicit=True)
+        else:
+            query = self._explicit_query(text, mode, bot_user_id)
+            if query is not None:
+                decision = TriggerDecision(query=query, explicit=True)
+            elif mode != "vocab":
+                return self._gate("mode")
+            elif self.vocabulary is None or self.vocabulary(text) >= self.vocab_min_overlap:
+                decision = TriggerDecision(query=text, explicit=False)
+            else:
+                return self._gate("vocab")
+
+        if not decision.query:
+            return self._gate("empty")
+        # Check both buckets before spending from either: a search the channel
+        # limit blocks must not cost the user a token.
+        if not self.user_limiter.available(message.author.id):
+            return self._gate("user_rate")
+        if not self.channel_limiter.available(message.channel.id):
+            return self._gate("channel_rate")
+        self.user_limiter.consume(message.author.id)
+        self.channel_limiter.consume(message.channel.id)
+
+        self.counters["executed"] += 1
+        return decision
+
+    def stats(self) -> Dict[str, int]:
+        gated = sum(v for k, v in self.counters.items() if k.startswith("gated_"))
+        return {"executed": self.counters["executed"], "gated": gated, **self.counters}
+
+
+def parse_channel_modes(spec: Optional[str]) -> Dict[str, str]:
+    """Parse "channel_id:mode,channel_id:mode" (e.g. from an env var)."""
+    modes: Dict[str, str] = {}
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        channel_id, _, mode = part.partition(":")
+        modes[channel_id.strip()] = mode.strip()
+    return modes
@@ -0,0 +1,164 @@
+# write_queue.py
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from db import transaction
+from executors import call_db
+
+
+T = TypeVar("T")
+
+DEFAULT_MAX_BATCH = 64
+DEFAULT_MAX_DELAY_SECONDS = 0.02
+
+# (fn, args, kwargs, future) for one queued write
+_Job = Tuple[Callable[..., Any], tuple, dict, "asyncio.Future[Any]"]
+
+
+class WriteQueue:
+    """
+    Write-behind batching for storage mutations.
+
+    `write(fn, *args)` queues `fn(conn, *args)` (e.g. save_image_record or
+    mark_sent) and returns an awaitable for its result. A consumer task takes
+    whatever has queued up, waiting at most `max_delay` seconds for up to
+    `max_batch` writes, and runs them inside one transaction on the db pool:
+    one commit (and one fsync) per batch instead of per row.
+
+    Each write runs in its own savepoint, so one failing write only fails its
+    own caller. Callers resolve after the batch has committed.
+    """
+
+    def __init__(
+        self,
+        conn,
+        executors=None,
+        *,
+        max_batch: int = DEFAULT_MAX_BATCH,
+        max_delay: float = DEFAULT_MAX_DELAY_SECONDS,
+    ):
+        self.conn = conn
+        self.executors = executors
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.writes = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_batch_seconds = 0.0
+
+    async def start(self) -> None:
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._consume())
+
+    async def close(self) -> None:
+        """Flush queued writes, then stop the consumer."""
+        if self._queue is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._queue = None
+
+    def submit(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> "asyncio.Future[T]":
+        if self._queue is None:
+            raise RuntimeError("WriteQueue.start() has not been called")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((fn, args, kwargs, future))
+        return future
+
+    async def write(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        return await self.submit(fn, *args, **kwargs)
+
+    @property
+    def running(self) -> bool:
+        return self._queue is not None
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _next_batch(self) -> List[_Job]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            if self._queue.empty():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            else:
+                batch.append(self._queue.get_nowait())
+        return batch
+
+    def _run_batch(self, batch: List[_Job]) -> List[Tuple[bool, Any]]:
+        outcomes: List[Tuple[bool, Any]] = []
+        with transaction(self.conn):
+            for fn, args, kwargs, _ in batch:
+                try:
+                    with transaction(self.conn):
+                        outcomes.append((True, fn(self.conn, *args, **kwargs)))
+                except Exception as e:
+                    outcomes.append((False, e))
+        return outcomes
+
+    async def _consume(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            started_at = time.perf_counter()
+            try:
+                outcomes = await call_db(self.executors, self._run_batch, batch)
+            except Exception as e:
+                # The commit itself failed: nothing in this batch was written.
+                outcomes = [(False, e)] * len(batch)
+            self.last_batch_seconds = time.perf_counter() - started_at
+            self.batches += 1
+
+            for (_, _, _, future), (ok, value) in zip(batch, outcomes):
+                self.writes += 1
+                if not ok:
+                    self.failed += 1
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+            for _ in batch:
+                self._queue.task_done()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "depth": self.depth,
+            "writes": self.writes,
+            "failed": self.failed,
+            "batches": self.batches,
+            "avg_batch_size": self.writes / (self.batches or 1),
+            "last_batch_seconds": self.last_batch_seconds,
+        }
+
+
+async def call_write(
+    writes: Optional[WriteQueue],
+    executors,
+    fn: Callable[..., T],
+    conn,
+    *args: Any,
+    **kwargs: Any,
+) -> T:
+    """
+    Run storage write `fn(conn, ...)` through `writes` when it batches for `conn`,
+    else directly via call_db (its own commit).
+    """
+    if writes is None or writes.conn is not conn or not writes.running:
+        return await call_db(executors, fn, conn, *args, **kwargs)
+    return await writes.write(fn, *args, **kwargs)